@@ -19,6 +19,88 @@ def create_app(test_config=None):
         SECRET_KEY='dev',
         # Path where the SQLite database file will be saved. It is under "app.instance_path", which is the path that Flask has chosen for the instance folder.
         DATABASE=os.path.join(app.instance_path, 'flaskr.sqlite'),
+        # Number of posts shown on each page of the index.
+        POSTS_PER_PAGE=20,
+        # Maximum number of SQLite connections kept open by each process. Use 0 to open (and close) a new connection in every request instead.
+        DATABASE_POOL_SIZE=5,
+        # Seconds a request waits for a free connection when all of them are in use.
+        DATABASE_POOL_TIMEOUT=30.0,
+        # Seconds between two runs of "PRAGMA optimize", which refreshes the statistics used by the query planner (0 disables it). See "db.close_db".
+        DATABASE_OPTIMIZE_INTERVAL=3600,
+        # Seconds the browsers keep the fingerprinted static files (see "assets"). Their URL changes with their content, so one year is safe.
+        STATIC_IMMUTABLE_MAX_AGE=31536000,
+        # Folder where the compiled templates are saved and shared by every process (see "templating"), or None to compile them in each process.
+        TEMPLATE_BYTECODE_CACHE=os.path.join(app.instance_path, 'jinja_cache'),
+        # Load every template when the application is created, so the first requests of a new worker don't compile them.
+        TEMPLATE_WARMUP=False,
+        # Compression of the responses (see "compression"): the encodings offered, in order of preference (brotli and zstd are used when their module is
+        # installed), and the size in bytes under which a response is sent uncompressed.
+        COMPRESSION=True,
+        COMPRESSION_ENCODINGS=('br', 'zstd', 'gzip'),
+        COMPRESSION_MIN_SIZE=512,
+        # Metrics of the requests, served at "/metrics" in the format of Prometheus (see "metrics"). With several worker processes, set
+        # METRICS_MULTIPROCESS_DIR to an empty folder shared by all of them, so "/metrics" adds up the requests of every worker.
+        # With METRICS_TOKEN, "/metrics" only answers requests with an "Authorization: Bearer <token>" header. Without it, it has no authentication and
+        # should only be reachable from the monitoring network.
+        METRICS=False,
+        METRICS_MULTIPROCESS_DIR=None,
+        METRICS_TOKEN=None,
+        # SQLite PRAGMAs applied to every new connection, on top of the defaults in "db.DEFAULT_PRAGMAS" (WAL journal, 5 s busy timeout...).
+        # For example, DATABASE_PRAGMAS = {'synchronous': 'full'} in "config.py". A value of None disables that PRAGMA.
+        DATABASE_PRAGMAS={},
+        # Number of prepared statements kept by each connection (the default of sqlite3 is 128). It should stay above the number of statements in "queries".
+        DATABASE_CACHED_STATEMENTS=256,
+        # Prepare the hot statements of "queries.WARMUP" when a connection is opened, so the first requests served by it don't parse them. It only changes
+        # the first queries of each connection (see "queries" for the measurements).
+        DATABASE_WARMUP=True,
+        # Send the views that only read to read-only connections ("db.get_read_db"), kept in their own pool. With False, they use the write connection.
+        DATABASE_READ_ROUTING=True,
+        # Path of a copy of the database read by the read-only connections, refreshed every DATABASE_REPLICA_INTERVAL seconds (see "replica").
+        # DATABASE_REPLICA_PAGES is the number of pages copied in each step (-1 copies everything at once). None reads the main file.
+        DATABASE_REPLICA=None,
+        DATABASE_REPLICA_INTERVAL=5.0,
+        DATABASE_REPLICA_PAGES=1024,
+        # Maximum number of user rows kept in the cache of each process (0 disables the cache), and seconds each one is valid.
+        USER_CACHE_SIZE=1024,
+        USER_CACHE_TTL=60,
+        # When True, "g.user" is only loaded when a view or template reads it, instead of before every request.
+        LOAD_USER_LAZILY=False,
+        # Cache of the pages rendered for anonymous visitors: 'memory' (one cache per process), 'sqlite' (shared by every worker, stored in
+        # PAGE_CACHE_DATABASE, by default "page_cache.sqlite" in the instance folder) or None to disable it. PAGE_CACHE_SIZE is the maximum number of pages.
+        PAGE_CACHE='memory',
+        PAGE_CACHE_SIZE=256,
+        PAGE_CACHE_DATABASE=None,
+        # When True, long listings are sent to the client while the template is rendered, in chunks of STREAM_BUFFER_SIZE template pieces.
+        STREAM_TEMPLATES=False,
+        STREAM_BUFFER_SIZE=32,
+        # Fraction of the requests whose SQL statements are profiled (0 disables it, 1 profiles every request), and duration in milliseconds from which
+        # a statement is logged as slow, together with its query plan.
+        SQL_PROFILE_SAMPLE_RATE=0.0,
+        SLOW_QUERY_MS=100,
+        # Executor of the password hashes: 'thread', 'process' or None (hash in the request thread), its number of workers, and the maximum number of
+        # hashes waiting or running. Past that, requests receive a 503 with a "Retry-After" of HASH_RETRY_AFTER seconds.
+        HASH_EXECUTOR='thread',
+        HASH_WORKERS=2,
+        HASH_QUEUE_SIZE=16,
+        HASH_RETRY_AFTER=1,
+        # Method used for new password hashes. Users with a hash made with other parameters get a new one the next time they log in.
+        PASSWORD_HASH_METHOD='scrypt',
+        # Login throttling: 'memory' (per process), 'sqlite' (shared by every worker, stored in LOGIN_THROTTLE_DATABASE, by default "throttle.sqlite"
+        # in the instance folder) or None to disable it. The limits are (attempts, seconds) for each username and for each client IP.
+        LOGIN_THROTTLE='memory',
+        LOGIN_THROTTLE_DATABASE=None,
+        LOGIN_THROTTLE_MAX_KEYS=100000,
+        LOGIN_USER_LIMIT=(5, 60),
+        LOGIN_IP_LIMIT=(20, 60),
+        # Number of reverse proxies in front of the application. Behind them, the address of the client (used by the login throttle) and the scheme are
+        # read from the last PROXY_FIX_X_FOR values of "X-Forwarded-For" and "X-Forwarded-Proto". With 0, those headers are ignored, as anyone can send them.
+        PROXY_FIX_X_FOR=0,
+        # Group commit of new posts: a background thread writes the inserts arriving within GROUP_COMMIT_MAX_DELAY seconds (up to GROUP_COMMIT_MAX_BATCH)
+        # in one transaction. Requests wait up to GROUP_COMMIT_TIMEOUT seconds for their batch. When False, each request commits its own insert.
+        GROUP_COMMIT=False,
+        GROUP_COMMIT_MAX_BATCH=64,
+        GROUP_COMMIT_MAX_DELAY=0.005,
+        GROUP_COMMIT_TIMEOUT=30,
     )
     # Load the instance config, if it exists, when not testing.
     if test_config is None:
@@ -31,12 +113,10 @@ def create_app(test_config=None):
         app.config.from_mapping(test_config)
 
 
-    # Ensuring that the instance folder exists:
-    try:
-        # Ensures that "app.instance_path" exists. It is not created automatically by Flask, but we need it for the SQLite database file.
-        os.makedirs(app.instance_path)
-    except OSError:
-        pass
+    # Ensuring that the instance folder exists. It is not created automatically by Flask, but we need it for the SQLite database file.
+    # Checking first costs a single "stat" on every start, instead of a failed "mkdir" and an exception.
+    if not os.path.isdir(app.instance_path):
+        os.makedirs(app.instance_path, exist_ok=True)
 
     # Simple page that says hello:
 
@@ -44,6 +124,10 @@ def create_app(test_config=None):
     @app.route('/hello')
     def hello():
         return 'Hello, World!'
+
+    # Bytecode cache of the templates. It must be configured before the blueprints are registered, as they create the Jinja environment.
+    from . import templating
+    templating.init_app(app)
     
     # Implementation of "close_db" and "init_db_command" into our factory.
     from . import db
@@ -56,10 +140,30 @@ def create_app(test_config=None):
     # Implementation of our blueprint "blog" into the application factory.
     from . import blog
     app.register_blueprint(blog.bp)
+    # Commands to fill the full-text search index of the "search" view ("search"), to export and import the users and posts ("transfer"), and to back
+    # up, vacuum, analyze and checkpoint the database ("maintenance").
+    # They are rarely used, so their modules are only imported when one of them runs (see "startup").
+    from . import startup
+    startup.init_app(app)
+    # Fingerprinted and precompressed static files, if "flask build-assets" has been run. The manifest is read once, here.
+    from . import assets
+    assets.init_app(app)
     # The blog blueprint does not have a "url_prefix", so the index view will be at "/", create view at "/create" and so on.
     # With "add_url_rule" we allow that both "/index" and "/blog.index" lead to the same URL.
     # If we create a url_prefix we would define different endpoints for index and blog.index, so their URLs would be different.
     app.add_url_rule('/', endpoint='index')
+    # Compiles the templates now if TEMPLATE_WARMUP is set, once every blueprint (and its templates) is known.
+    templating.warm_up(app)
+    # Behind reverse proxies, "request.remote_addr" is the address of the last proxy, so every client would share the same login attempts.
+    if app.config['PROXY_FIX_X_FOR']:
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'], x_proto=app.config['PROXY_FIX_X_FOR'])
+    # Middleware compressing the responses. It wraps "app.wsgi_app", so it sees the final response of every view, including the cached pages.
+    from . import compression
+    compression.init_app(app)
+    # Metrics of the requests and the "/metrics" endpoint. Its middleware is installed last, so it also measures the compression.
+    from . import metrics
+    metrics.init_app(app)
 
     # Return of the generated Flask instance.
     return app
\ No newline at end of file
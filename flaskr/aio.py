@@ -0,0 +1,102 @@
+# Module with the async variants of the database functions, used by the "async def" views.
+# sqlite3 has no async interface, so the calls of a connection used from a coroutine are sent to a thread pool shared by the whole application, and the
+# coroutine waits for them without blocking the event loop. Starting a thread per request would cost more than most queries. The calls of a connection
+# run one at a time, in order, as sqlite3 requires.
+#
+# Flask runs the async views with "asgiref" (installed with "flask[async]"). The sync views and "get_db"/"get_read_db" keep working as before, and both
+# kinds of views share the same pools.
+#
+# asyncio is the biggest import of the package, so it is only imported by the functions that run inside an async view, not when the application starts.
+import concurrent.futures
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, g
+from flaskr.db import get_db, get_read_db
+
+
+# Cursor returned by "AsyncConnection.execute". The rows are read in the thread of the connection, as SQLite runs the statement while they are read.
+class AsyncCursor(object):
+    def __init__(self, connection, cursor):
+        self._connection = connection
+        self._cursor = cursor
+
+    async def fetchone(self):
+        return await self._connection.run(self._cursor.fetchone)
+
+    async def fetchall(self):
+        return await self._connection.run(self._cursor.fetchall)
+
+    # "rowcount", "lastrowid"... are already known once "execute" returns.
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class AsyncConnection(object):
+    def __init__(self, connection, executor):
+        # The real connection (maybe a "ProfiledConnection"), also available for the sync code of the same request.
+        self.connection = connection
+        self._executor = executor
+        # Created by the first call, in the event loop of the request.
+        self._lock = None
+        # The last call sent to the executor. As the calls run one at a time, it is the only one that may still be running.
+        self._last = None
+
+    # Runs "function" in a thread of the executor and waits for its result. The lock keeps the calls in order even if the coroutines of a request
+    # ("asyncio.gather") use the connection at the same time.
+    async def run(self, function, *args):
+        import asyncio
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            self._last = self._executor.submit(function, *args)
+            return await asyncio.wrap_future(self._last)
+
+    async def execute(self, sql, params=()):
+        return AsyncCursor(self, await self.run(self.connection.execute, sql, params))
+
+    async def commit(self):
+        await self.run(self.connection.commit)
+
+    async def rollback(self):
+        await self.run(self.connection.rollback)
+
+    # Exceptions such as "IntegrityError" are forwarded to the real connection, so "except db.IntegrityError" works as with the sync one.
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+    # Waits for a call left running by a cancelled coroutine, so the connection is idle when "db.close_db" returns it to its pool.
+    def close(self):
+        if self._last is not None:
+            concurrent.futures.wait([self._last])
+
+
+# Lock used to create only one executor per application.
+_executor_lock = threading.Lock()
+
+
+# The executor is stored in "app.extensions" and created the first time an async view uses the database. It has a thread for each connection the pools
+# can hand out (writes and reads), so a call never waits for a thread, only for its connection.
+def get_executor(app=None):
+    if app is None:
+        app = current_app._get_current_object()
+    executor = app.extensions.get('flaskr.db_executor')
+    if executor is None:
+        with _executor_lock:
+            executor = app.extensions.get('flaskr.db_executor')
+            if executor is None:
+                # Without pools, the number of connections has no limit, and we use the default size.
+                size = app.config['DATABASE_POOL_SIZE'] * 2 or None
+                executor = app.extensions['flaskr.db_executor'] = ThreadPoolExecutor(max_workers=size, thread_name_prefix='flaskr-db')
+    return executor
+
+
+# Async variant of "get_db" (or of "get_read_db" with "readonly=True"). Checking a connection out of the pool may wait for a free one, so it is done in a
+# worker thread too. "to_thread" copies the context, so "g" and "current_app" work there.
+async def get_async_db(readonly=False):
+    import asyncio
+    name = 'async_read_db' if readonly else 'async_db'
+    if name not in g:
+        connection = await asyncio.to_thread(get_read_db if readonly else get_db)
+        setattr(g, name, AsyncConnection(connection, get_executor()))
+    return getattr(g, name)
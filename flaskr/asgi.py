@@ -0,0 +1,8 @@
+# Entry point for ASGI servers, for example "uvicorn flaskr.asgi:app".
+# Flask is a WSGI application, so "asgiref" translates the ASGI calls. Each request still runs in a worker thread, and the async views run their own event
+# loop there.
+from asgiref.wsgi import WsgiToAsgi
+
+from flaskr import create_app
+
+app = WsgiToAsgi(create_app())
@@ -0,0 +1,172 @@
+# Module with the fingerprinting of the static files.
+# "flask build-assets" copies every file of "static" to "static/dist" with a hash of its content in the name ("style.css" -> "dist/style.1a2b3c4d5e.css"),
+# along with gzip and brotli versions, and writes the list to "static/dist/manifest.json". When the manifest exists, it is loaded by "create_app" and:
+#   - url_for('static', filename='style.css') returns the URL of the fingerprinted copy.
+#   - That copy is served with "Cache-Control: immutable" and a max-age of STATIC_IMMUTABLE_MAX_AGE: its content never changes, as a new version gets
+#     a new name. Browsers then stop revalidating the stylesheet on every page view.
+#   - Clients accepting brotli or gzip receive the precompressed file, so nothing is compressed while serving.
+#
+# brotli is optional ("pip install brotli"). Without it, only the gzip versions are built.
+# The application only serves the files, so the modules used to build them (gzip, hashlib, brotli) are imported by "build_assets".
+import json
+import mimetypes
+import os
+
+import click
+from flask import current_app, request, send_from_directory
+from flask.cli import with_appcontext
+
+
+# Folder of the fingerprinted files, inside "static".
+DIST = 'dist'
+MANIFEST = 'manifest.json'
+
+# Extensions of the files worth compressing. Images and fonts (except SVG) are already compressed.
+COMPRESSIBLE = {'.css', '.js', '.mjs', '.map', '.json', '.svg', '.html', '.txt', '.xml', '.ico'}
+
+
+# Suffix of the precompressed files of each encoding, in order of preference: brotli is smaller than gzip.
+SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+
+# Returns the brotli module, or None if it is not installed.
+def _brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def _compressors():
+    import gzip
+    compressors = {'gzip': lambda data: gzip.compress(data, 9, mtime=0)}
+    brotli = _brotli()
+    if brotli is not None:
+        compressors['br'] = lambda data: brotli.compress(data, quality=11)
+    return compressors
+
+
+# Fingerprints every file of "static_folder" (except the ones in "dist") and returns the manifest: a dict mapping the original names to the path of the
+# copy and the encodings available. Files from previous builds are kept, so pages cached before the build keep working, unless "clean" is True.
+def build_assets(static_folder, clean=False):
+    import hashlib
+    dist = os.path.join(static_folder, DIST)
+    os.makedirs(dist, exist_ok=True)
+    manifest = {}
+    written = set()
+
+    for root, dirs, files in os.walk(static_folder):
+        if os.path.abspath(root) == os.path.abspath(static_folder) and DIST in dirs:
+            dirs.remove(DIST)
+        for name in sorted(files):
+            source = os.path.join(root, name)
+            filename = os.path.relpath(source, static_folder).replace(os.sep, '/')
+            with open(source, 'rb') as f:
+                data = f.read()
+
+            stem, extension = os.path.splitext(filename)
+            path = f'{DIST}/{stem}.{hashlib.sha256(data).hexdigest()[:10]}{extension}'
+            target = os.path.join(static_folder, *path.split('/'))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            _write(target, data)
+            written.add(target)
+
+            encodings = []
+            if extension.lower() in COMPRESSIBLE:
+                for encoding, compress in _compressors().items():
+                    compressed = compress(data)
+                    # A compressed version bigger than the original is useless.
+                    if len(compressed) < len(data):
+                        _write(target + SUFFIXES[encoding], compressed)
+                        written.add(target + SUFFIXES[encoding])
+                        encodings.append(encoding)
+            manifest[filename] = {'path': path, 'encodings': encodings}
+
+    if clean:
+        for root, dirs, files in os.walk(dist):
+            for name in files:
+                path = os.path.join(root, name)
+                if path not in written and name != MANIFEST:
+                    os.remove(path)
+
+    _write(os.path.join(dist, MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode('utf8'))
+    return manifest
+
+
+# The file is written under a temporary name and renamed, so a running server never serves a half written file.
+def _write(path, data):
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(data)
+    os.replace(temporary, path)
+
+
+# Reads the manifest of the application into "app.extensions". Without a manifest (the assets were never built), the static files are served as usual.
+def load_manifest(app):
+    path = os.path.join(app.static_folder, DIST, MANIFEST)
+    try:
+        with open(path, encoding='utf8') as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        manifest = {}
+    app.extensions['flaskr.assets'] = manifest
+    # The fingerprinted files, by path, to recognize them when they are requested.
+    app.extensions['flaskr.asset_paths'] = {entry['path']: entry for entry in manifest.values()}
+    return manifest
+
+
+# Called by "url_for" for every URL. The file names of the static endpoint are replaced by their fingerprinted copy.
+def fingerprint_url(endpoint, values):
+    if endpoint == 'static':
+        entry = current_app.extensions['flaskr.assets'].get(values.get('filename'))
+        if entry is not None:
+            values['filename'] = entry['path']
+
+
+# View of the static files, replacing the one of Flask. The fingerprinted files are served precompressed and cached forever, the rest as usual.
+def static(filename):
+    entry = current_app.extensions['flaskr.asset_paths'].get(filename)
+    if entry is None:
+        return current_app.send_static_file(filename)
+
+    encoding = None
+    for candidate in SUFFIXES:
+        # "gzip;q=0" is listed in the header, but refuses gzip.
+        if candidate in entry['encodings'] and request.accept_encodings.quality(candidate) > 0:
+            encoding = candidate
+            break
+    suffix = SUFFIXES[encoding] if encoding is not None else ''
+    response = send_from_directory(
+        current_app.static_folder, filename + suffix,
+        # The type is the one of the original file, not of the ".gz"/".br" one.
+        mimetype=mimetypes.guess_type(filename)[0],
+        max_age=current_app.config['STATIC_IMMUTABLE_MAX_AGE'],
+    )
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    # The answer depends on the "Accept-Encoding" of the request, so shared caches must keep one copy per encoding.
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+@click.command('build-assets')
+@click.option('--clean', is_flag=True, help='Remove the files of previous builds.')
+@with_appcontext
+def build_assets_command(clean):
+    """Fingerprint and precompress the static files."""
+    manifest = build_assets(current_app.static_folder, clean)
+    load_manifest(current_app)
+    compressed = sum(len(entry['encodings']) for entry in manifest.values())
+    click.echo(f'Built {len(manifest)} files and {compressed} compressed versions.')
+    if _brotli() is None:
+        click.echo('brotli is not installed, so only gzip versions were built.')
+
+
+def init_app(app):
+    load_manifest(app)
+    app.url_defaults(fingerprint_url)
+    app.view_functions['static'] = static
+    app.cli.add_command(build_assets_command)
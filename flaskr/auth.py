@@ -2,10 +2,14 @@
 import functools
 
 from flask import (
-    Blueprint, flash, g, redirect, render_template, request, session, url_for
+    Blueprint, current_app, flash, g, has_request_context, redirect, render_template,
+    request, session, url_for
 )
-from werkzeug.security import check_password_hash, generate_password_hash
-from flaskr.db import get_db
+from flask.ctx import _AppCtxGlobals
+from werkzeug.exceptions import ServiceUnavailable
+from flaskr.cache import TTLCache
+from flaskr.db import get_db, get_read_db
+from flaskr import queries
 
 # We create a blueprint called "auth". a Blueprint is a way to organize a group of related views and other code. This blueprint needs to know whjere its defined, for which we pass
 # the argument "__name__" as 2nd argument. The "url_prefix" will be prepended to all the URLs we associate with this blueprint.
@@ -19,14 +23,18 @@ bp = Blueprint('auth', __name__, url_prefix='/auth')
 
 
 # We associate the URL "/register" with the register view function. When flask receives a request to "/auth/register" it will call the register view and use its return value as response.
+# "register" and "login" are async views: while the password is hashed and the database queried, the event loop is free (see "aio").
 @bp.route('/register', methods=('GET','POST'))
-def register():
+async def register():
     # If the user submited the form, the request.method will be POST.
     if request.method == 'POST':
         # "request.form" is an special type of dict mapping. The user will input there their username and password.
+        # The async database layer and the hashing executor are only imported once a form is sent, so a new worker doesn't pay for them on start.
+        from flaskr.aio import get_async_db
+        from flaskr.hashing import hash_password_async
         username = request.form['username']
         password = request.form['password']
-        db = get_db()
+        db = await get_async_db()
         error = None
         
         # Validating that these parameters are not empty.
@@ -41,13 +49,16 @@ def register():
             try:
                 # "db.execute" allows to take a SQL query with "?" placeholders for any user input, and a tuple of values to replace them with.
                 # This library will take care automatically of escaping the values.
-                db.execute(
-                    "INSERT INTO user (username, password) VALUES (?, ?)",
+                cursor = await db.execute(
+                    queries.INSERT_USER,
                     # We should NEVER storage passwords directly. We securely hash the password, and store that hash.
-                    (username, generate_password_hash(password))
+                    # The hash is computed by the hashing executor, so it doesn't block the rest of the requests (see "hashing").
+                    (username, await hash_password_async(password))
                 )
                 # As we are modifying data with our query, we have to commit afterwards to save the changes.
-                db.commit()
+                await db.commit()
+                # Every change to a user row must remove it from the user cache, so no worker keeps an old copy.
+                invalidate_user(cursor.lastrowid)
             # We can expect an IntegrityError when the user does already exist. In this case, we show the following error.
             except db.IntegrityError:
                 error = f"User {username} is already registered."
@@ -69,25 +80,43 @@ def register():
 
 
 @bp.route("/login", methods=("GET","POST"))
-def login():
+async def login():
     if request.method == 'POST':
+        # As in "aio", asyncio is only imported once an async view runs, and so are the modules used only by the login.
+        import asyncio
+        from flaskr.aio import get_async_db
+        from flaskr.hashing import check_password_async, hash_password_async, needs_rehash
+        from flaskr.throttle import check_login_attempt
         username = request.form['username']
         password = request.form['password']
-        db = get_db()
+        # Brute-force protection: too many attempts for this username or from this address are rejected before touching the database.
+        # The counters may be in the database, so the check runs in a thread, out of the event loop.
+        await asyncio.to_thread(check_login_attempt, username, request.remote_addr)
+        db = await get_async_db()
         error = None
         # We query the user and save it in a variable.
-        user = db.execute(
-            'SELECT * FROM user WHERE username = ?', (username,)
-        ).fetchone()
+        user = await (await db.execute(queries.USER_BY_USERNAME, (username,))).fetchone()
         # "fetchone" returns one row from the query. If there is no result, it returns "None".
         # Validating that these parameters are not empty.
         if user is None:
             error = "Incorrect username."
 
         # Checks the password securely and compares it with the hash stored. If the match, the password is valid.
-        elif not check_password_hash(user['password'], password):
+        elif not await check_password_async(user['password'], password):
             error = "Incorrect password."
 
+        # Now that we know the password, we can replace a hash made with outdated parameters by a new one. It is only an improvement, so when the
+        # hasher is busy, the login goes on and the hash is replaced at a later login.
+        if error is None and needs_rehash(user['password']):
+            try:
+                new_hash = await hash_password_async(password)
+            except ServiceUnavailable:
+                new_hash = None
+            if new_hash is not None:
+                await db.execute(queries.UPDATE_USER_PASSWORD, (new_hash, user['id']))
+                await db.commit()
+                invalidate_user(user['id'])
+
         if error is None:
             # "session" is a dict that stores data across requests. When the validation succeds, the user's id is stored in a new session. This data is stored in a cookie
             # that is sent to the browser, and it then sends it back with subsequent requests. Flask signs the data securely, so it can't be tampered with.
@@ -100,18 +129,85 @@ def login():
     return render_template('auth/login.html')
 
 
+# Loading the user is the most frequent query of the application, as it runs before every request of a logged in user. We keep the user rows in an in-process
+# cache, stored in "app.extensions" and created the first time it is needed. Returns None when the cache is disabled (USER_CACHE_SIZE = 0).
+def get_user_cache(app=None):
+    if app is None:
+        app = current_app._get_current_object()
+    if not app.config['USER_CACHE_SIZE']:
+        return None
+
+    # "setdefault" keeps the first cache created if two threads arrive here at the same time.
+    cache = app.extensions.get('flaskr.user_cache')
+    if cache is None:
+        cache = app.extensions.setdefault('flaskr.user_cache', TTLCache(
+            maxsize=app.config['USER_CACHE_SIZE'], ttl=app.config['USER_CACHE_TTL']
+        ))
+    return cache
+
+
+# Removes a user from the cache. It must be called after any change to the "user" row (registration, profile or password changes...).
+def invalidate_user(user_id):
+    cache = get_user_cache()
+    if cache is not None:
+        cache.delete(user_id)
+
+
+# Returns the row of a user by its id, from the cache if possible.
+def load_user(user_id):
+    cache = get_user_cache()
+    if cache is not None:
+        user = cache.get(user_id)
+        if user is not None:
+            return user
+
+    user = get_read_db().execute(queries.USER_BY_ID, (user_id,)).fetchone()
+    # A user who has just registered may not be in the replica yet, so we ask the main database before giving up.
+    if user is None and current_app.config['DATABASE_REPLICA']:
+        user = get_db().execute(queries.USER_BY_ID, (user_id,)).fetchone()
+
+    if cache is not None and user is not None:
+        cache.set(user_id, user)
+    return user
+
+
+# Returns the user stored in the session, or None if nobody is logged in.
+def _session_user():
+    user_id = session.get('user_id')
+
+    if user_id is None:
+        return None
+    return load_user(user_id)
+
+
 # We register a function that runs before the view function, no matter what URL is requested. With this function we check is a user is stored in the session and get
 # that user's data from the database, storing it in "g.user", which will last for the length of the request.
 @bp.before_app_request
 def load_logged_in_user():
-    user_id = session.get('user_id')
+    # In lazy mode we don't load anything yet: "UserGlobals" loads "g.user" the first time a view or template reads it.
+    if current_app.config['LOAD_USER_LAZILY']:
+        return
 
-    if user_id is None:
-        g.user = None
-    else:
-        g.user = get_db().execute(
-            'SELECT * FROM user WHERE id = ?',(user_id,)
-        ).fetchone()
+    g.user = _session_user()
+
+
+# Class used by the application for the "g" object. When "g.user" has not been set, reading it loads the logged in user, so requests that never look
+# at the user (static files, redirects...) don't run any query.
+class UserGlobals(_AppCtxGlobals):
+    def __getattr__(self, name):
+        if name != 'user':
+            return super().__getattr__(name)
+
+        # Outside of a request (in a CLI command, for example) there is no session, so nobody is logged in.
+        user = _session_user() if has_request_context() else None
+        self.user = user
+        return user
+
+
+# "record_once" runs the function when the blueprint is registered in the application, so the factory doesn't need to know about "UserGlobals".
+@bp.record_once
+def _install_user_globals(state):
+    state.app.app_ctx_globals_class = UserGlobals
 
 # We register a logout. In this function, we remove the id from the session, so "load_logged_in_user" does not load a user on subsequent requests.
 @bp.route('/logout')
@@ -1,25 +1,89 @@
 # We are about to create a blog. This will list all posts, allow logged in users to create posts, and allow the author of a post to edit or delete it.
+import json
 
 from flask import (
-    Blueprint, flash, g, redirect, render_template, request, url_for
+    Blueprint, current_app, flash, g, jsonify, redirect, render_template, request, url_for
 )
 from werkzeug.exceptions import abort
 from flaskr.auth import login_required
-from flaskr.db import get_db
+from flaskr.conditional import conditional, get_data_version
+from flaskr.db import get_db, get_read_db
+from flaskr.pagecache import cache_anonymous_page, invalidate
+from flaskr.pagination import get_page
+from flaskr import queries
+from flaskr.streaming import render_page, streaming_enabled
 
 # Defining the blueprint for "blog".
 bp = Blueprint('blog',__name__)
 
+# Anonymous visitors receive the rendered page from the page cache, until a post is created, updated or deleted.
+# Before that, "conditional" answers 304 to clients that already have the current version of the page.
 @bp.route('/')
+@conditional(get_data_version)
+@cache_anonymous_page
 def index():
-    db = get_db()
-    posts = db.execute(
-        'SELECT p.id, title, body, created, author_id, username'
-        ' FROM post p JOIN user u ON p.author_id = u.id'
-        ' ORDER BY created DESC'
-    ).fetchall()
-
-    return render_template('blog/index.html',posts=posts)
+    db = get_read_db()
+    # Instead of loading every post, we show only one page. The "older"/"newer" links carry a cursor pointing at the last/first post shown.
+    try:
+        page = get_page(
+            db,
+            queries.POST_LISTING,
+            before=request.args.get('before'),
+            after=request.args.get('after'),
+            per_page=current_app.config['POSTS_PER_PAGE'],
+            # When streaming, the rows are read from the cursor while the template is being sent.
+            lazy=streaming_enabled(),
+        )
+    # A cursor that can't be decoded means the URL has been modified by hand.
+    except ValueError:
+        abort(400, 'Invalid page cursor.')
+
+    return render_page('blog/index.html', posts=page.items, page=page)
+
+
+# Validators of the page of an author. The counters in its header only change with the posts, so the version of the posts covers them too.
+def _user_validators(username):
+    return get_data_version()
+
+
+# Posts of one author, newest first, with the same pagination as the index. The header shows the counters stored in the user row.
+@bp.route('/user/<username>')
+@conditional(_user_validators)
+@cache_anonymous_page
+def user(username):
+    db = get_read_db()
+    author = db.execute(queries.USER_PROFILE, (username,)).fetchone()
+    if author is None:
+        abort(404, f"User {username} doesn't exist.")
+
+    try:
+        page = get_page(
+            db,
+            queries.POST_LISTING,
+            where=queries.AUTHOR_FILTER,
+            params=(author['id'],),
+            before=request.args.get('before'),
+            after=request.args.get('after'),
+            per_page=current_app.config['POSTS_PER_PAGE'],
+        )
+    except ValueError:
+        abort(400, 'Invalid page cursor.')
+
+    return render_template('blog/user.html', author=author, posts=page.items, page=page)
+
+
+# Full-text search over the title and body of the posts, with the best results first.
+# It is an async view: the query runs in the thread of the connection (see "aio").
+@bp.route('/search')
+async def search():
+    # The search and the group commit writer are imported by the views using them, so a new worker doesn't pay for them on start.
+    from flaskr.search import search_posts_async
+    q = request.args.get('q', '')
+    # "type=int" returns the default value when "page" is not a number.
+    page = max(request.args.get('page', 1, type=int), 1)
+    results, has_next = await search_posts_async(q, page=page, per_page=current_app.config['POSTS_PER_PAGE'])
+
+    return render_template('blog/search.html', q=q, results=results, page=page, has_next=has_next)
 
 
 # "login_required" does, as expected, require a login in order to access this route.
@@ -37,15 +101,22 @@ def create():
         if error is not None:
             flash(error)
         else:
-            # We make a request and add the post into the list of posts of our db
-            db = get_db()
-            db.execute(
-                'INSERT INTO post (title, body, author_id)'
-                ' VALUES (?, ?, ?)',
-                (title, body, g.user['id'])
-            )
-            # Commit to save changes
-            db.commit()
+            insert = queries.INSERT_POST
+            params = (title, body, g.user['id'])
+            from flaskr.writer import get_writer
+            writer = get_writer()
+            # With group commit, the insert is written by the writer thread together with the ones of other requests. "result" waits until the batch
+            # is committed, so the post is saved when we redirect.
+            if writer is not None:
+                writer.execute(insert, params).result(current_app.config['GROUP_COMMIT_TIMEOUT'])
+            else:
+                # We make a request and add the post into the list of posts of our db
+                db = get_db()
+                db.execute(insert, params)
+                # Commit to save changes
+                db.commit()
+            # The cached pages don't show the new post, so we discard them.
+            invalidate()
             # Redirects us to the index so we can see the new post.
             return redirect(url_for('blog.index'))
 
@@ -58,12 +129,7 @@ def create():
 def get_post(id, check_author=True):
 
     # A different way of writing previous lines. Useful if we do not need the request for multiple operations.
-    post = get_db().execute(
-        'SELECT p.id, title, body, created, author_id, username'
-        ' FROM post p JOIN user u ON p.author_id = u.id'
-        ' WHERE p.id = ?',
-        (id,)
-    ).fetchone()
+    post = get_read_db().execute(queries.GET_POST, (id,)).fetchone()
 
     # At any error, we use "abort" to raise an special exception (HTTP status code).
     if post is None:
@@ -74,48 +140,112 @@ def get_post(id, check_author=True):
     
     return post
 
+# Validators of the update form: the version of the posts table and the modification time of the post. They run before the view, so they make the
+# existence and author checks too: otherwise another user could send an ETag and learn from a 304 whether the post changed.
+def _post_validators(id):
+    post = get_read_db().execute(queries.POST_UPDATED, (id,)).fetchone()
+    if post is None:
+        abort(404, f"Post id {id} does not exist.")
+    if post['author_id'] != g.user['id']:
+        abort(403)
+    version, changed = get_data_version()
+    return version, post['updated']
+
+
+# When an UPDATE or DELETE restricted to the author changed nothing, we find out why with a cheap lookup by primary key (without the join of "get_post"):
+# the post doesn't exist (404) or belongs to somebody else (403).
+def abort_missing_or_forbidden(id):
+    post = get_db().execute(queries.POST_AUTHOR, (id,)).fetchone()
+    if post is None:
+        abort(404, f"Post id {id} does not exist.")
+    abort(403)
+
+
 # We define a URL to update a post by its URL. We use "<int:id>" as it must be an integer. "<id>" would be interpreted as a string.
 @bp.route('/<int:id>/update', methods=('GET', 'POST'))
 @login_required
+@conditional(_post_validators)
 def update(id):
-    # We get the post first.
-    post = get_post(id)
-
     # We are able to update the post information: title, body...
     if request.method == 'POST':
-        title = request.form['title']
-        body = request.form['body']
+        # "get" returns an empty title when the field is missing, so the request gets the same author checks as an invalid form.
+        title = request.form.get('title', '')
+        body = request.form.get('body', '')
         error = None
 
         if not title:
             error = 'Title is required.'
 
-        if error is not None:
-            flash(error)
-        # If there is no error, we make a request and then update the post.
-        else:
+        # If there is no error, we update the post. The author check is part of the UPDATE itself, so a valid form costs a single statement.
+        if error is None:
             db = get_db()
             # As we can see, we use UPDATE instead of INSERT for this part.
-            db.execute(
-                'UPDATE post SET title = ?, body = ?'
-                ' WHERE id = ?',
-                (title, body, id)
+            cursor = db.execute(
+                queries.UPDATE_OWN_POST,
+                (title, body, id, g.user['id'])
             )
+            # "rowcount" is the number of rows changed. If it is 0, the post doesn't exist or isn't ours.
+            if cursor.rowcount == 0:
+                abort_missing_or_forbidden(id)
             # Commiting the final version.
             db.commit()
+            invalidate()
             # And getting back to the index.
             return redirect(url_for('blog.index'))
 
+        # The form is shown again with the error, so we need the post (and the author check) in this case.
+        post = get_post(id)
+        flash(error)
+        return render_template('blog/update.html', post=post)
+
+    # We get the post to show it in the form.
+    post = get_post(id)
     return render_template('blog/update.html', post=post)
 
 # It is interesting to notice that both actions could be done in only one view and template, but we are separating them for the tutorial as it is clearer.
 
 # As it does not have its own template, "delete" will only handle the POST method and redirect to the index view.
+# As in "update", the author check is part of the DELETE statement.
 @bp.route('/<int:id>/delete', methods=('POST',))
 @login_required
 def delete(id):
-    get_post(id)
     db = get_db()
-    db.execute('DELETE FROM post WHERE id = ?', (id,))
+    cursor = db.execute(queries.DELETE_OWN_POST, (id, g.user['id']))
+    if cursor.rowcount == 0:
+        abort_missing_or_forbidden(id)
     db.commit()
-    return redirect(url_for('blog.index'))
\ No newline at end of file
+    invalidate()
+    return redirect(url_for('blog.index'))
+
+
+# Deletes many posts of the logged in user in one transaction, for the moderation tools. The ids are sent as a JSON body ({"ids": [1, 2, ...]}) or as
+# repeated "id" form fields. Posts that don't exist or belong to other users are skipped, and the number of deleted posts is returned.
+@bp.route('/delete', methods=('POST',))
+@login_required
+def delete_many():
+    if request.is_json:
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict) or not isinstance(payload.get('ids', []), list):
+            abort(400, 'The body must be an object with a list of post ids.')
+        ids = payload.get('ids', [])
+        # "int" would turn true into 1 and 1.9 into 1, so JSON ids must already be integers ("bool" is a subclass of "int").
+        if any(type(id) is not int for id in ids):
+            abort(400, 'Post ids must be integers.')
+    else:
+        try:
+            ids = [int(id) for id in request.form.getlist('id')]
+        except ValueError:
+            abort(400, 'Post ids must be integers.')
+
+    db = get_db()
+    # The ids travel as one JSON parameter (see "queries.DELETE_OWN_POSTS").
+    cursor = db.execute(queries.DELETE_OWN_POSTS, (g.user['id'], json.dumps(ids)))
+    deleted = cursor.rowcount
+    db.commit()
+    if deleted:
+        invalidate()
+
+    if request.is_json:
+        return jsonify(requested=len(ids), deleted=deleted)
+    flash(f'{deleted} posts deleted.')
+    return redirect(url_for('blog.index'))
@@ -0,0 +1,73 @@
+# Module with a small in-process cache, shared by every thread of a worker.
+# It is an LRU (Least Recently Used) cache: when it is full, the entry that has not been used for the longest time is removed. Entries also expire after "ttl" seconds.
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache(object):
+    # "maxsize" is the maximum number of entries and "ttl" the number of seconds an entry is valid (None means forever).
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # An OrderedDict remembers the order of the keys, so the first one is always the least recently used. Values are (expiration time, value) tuples.
+        self._data = OrderedDict()
+        # Counters exposed through "stats".
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    # Returns the value stored for "key", or "default" if it is missing or expired.
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+
+            expires, value = item
+            if expires is not None and expires <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+
+            # The key becomes the most recently used one.
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            # We remove the least recently used entries until the cache fits again.
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    # Returns a dict with the counters, useful for monitoring.
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
@@ -0,0 +1,386 @@
+# Module with the compression of the responses.
+# "CompressionMiddleware" wraps the WSGI application (it is installed by "create_app"), so every response goes through it: the HTML of the views, the
+# JSON... It compresses the ones worth it with the best encoding accepted by the client ("Accept-Encoding"), in the order of COMPRESSION_ENCODINGS.
+#
+#   - The level depends on the size of the response (see LEVELS): small pages get the best ratio, big ones a cheaper level.
+#   - Streamed responses (no "Content-Length", see "streaming") are compressed chunk by chunk, and each chunk is flushed, so the client still receives
+#     the rows while they are rendered.
+#   - Responses already compressed ("Content-Encoding", such as the precompressed files of "assets"), images and tiny responses are sent as they are.
+#   - Pages served by the page cache are compressed once: the compressed version is stored in the cache next to the page (see "pagecache").
+#
+# gzip is always available. brotli ("pip install brotli") and zstd ("pip install zstandard") are used when they are installed.
+# The CPU time spent compressing and the ratios are counted in "CompressionStats".
+import importlib
+import threading
+import time
+import zlib
+
+from flask import current_app
+from werkzeug.http import parse_accept_header
+
+from flaskr.pagecache import ENVIRON_KEY
+
+
+# Levels used for each encoding, as (maximum size in bytes, level) tuples. The last one (None) is used for bigger responses and for streamed ones, whose
+# size is not known.
+LEVELS = {
+    'br': ((16384, 8), (1048576, 5), (None, 4)),
+    'zstd': ((16384, 12), (1048576, 6), (None, 3)),
+    'gzip': ((16384, 9), (1048576, 6), (None, 4)),
+}
+
+# Responses with a known size up to this one are compressed at once, which gives a "Content-Length". Bigger ones are compressed while they are sent.
+BUFFER_LIMIT = 1048576
+
+# Types worth compressing, besides "text/*". Images (except SVG), fonts and archives are already compressed.
+COMPRESSIBLE_TYPES = {
+    'application/json', 'application/javascript', 'application/xml', 'application/xhtml+xml', 'application/rss+xml',
+    'application/atom+xml', 'application/manifest+json', 'image/svg+xml',
+}
+
+
+class _GzipEncoder(object):
+    def __init__(self, level):
+        # 31 writes the gzip header and trailer (15 would be the raw zlib format).
+        self._encoder = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._encoder.compress(data)
+
+    # Returns everything compressed so far, so the client can decompress it before the end of the response.
+    def flush(self):
+        return self._encoder.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._encoder.flush()
+
+
+class _BrotliEncoder(object):
+    def __init__(self, level):
+        import brotli
+        self._encoder = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self._encoder.process(data)
+
+    def flush(self):
+        return self._encoder.flush()
+
+    def finish(self):
+        return self._encoder.finish()
+
+
+class _ZstdEncoder(object):
+    def __init__(self, level):
+        import zstandard
+        self._flush_block = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        self._encoder = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self._encoder.compress(data)
+
+    def flush(self):
+        return self._encoder.flush(self._flush_block)
+
+    def finish(self):
+        return self._encoder.flush()
+
+
+# Encoders by name, with the module they need.
+ENCODERS = {
+    'br': (_BrotliEncoder, 'brotli'),
+    'zstd': (_ZstdEncoder, 'zstandard'),
+    'gzip': (_GzipEncoder, None),
+}
+
+# Encodings whose module is installed. It is filled on the first request, so the modules are not imported when the application starts.
+_available = None
+
+
+def available_encodings():
+    global _available
+    if _available is None:
+        available = set()
+        for encoding, (encoder, module) in ENCODERS.items():
+            try:
+                if module is not None:
+                    importlib.import_module(module)
+            except ImportError:
+                continue
+            available.add(encoding)
+        _available = available
+    return _available
+
+
+def _level(encoding, size):
+    for limit, level in LEVELS[encoding]:
+        if limit is None or (size is not None and size <= limit):
+            return level
+
+
+# Compresses "data" at once with the level chosen for its size.
+def compress(data, encoding):
+    encoder = ENCODERS[encoding][0](_level(encoding, len(data)))
+    return encoder.compress(data) + encoder.finish()
+
+
+def _compressible(mimetype):
+    mimetype = mimetype.split(';', 1)[0].strip().lower()
+    return mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES
+
+
+# Returns the encoding to use for a client sending "accept" ("Accept-Encoding"): the one with the highest quality, and for the same quality the first one
+# of "preferred". None when the client accepts none of them.
+def negotiate(accept, preferred):
+    if not accept:
+        return None
+    accept = parse_accept_header(accept)
+    available = available_encodings()
+    best, best_quality = None, 0
+    for encoding in preferred:
+        quality = accept.quality(encoding)
+        if quality > best_quality and encoding in available:
+            best, best_quality = encoding, quality
+    return best
+
+
+# Counters of the compressed responses, by encoding: responses, bytes before and after, and CPU seconds. "cached" counts the responses served with a
+# compressed version stored in the page cache, and "skipped" the responses sent uncompressed, by reason.
+class CompressionStats(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.encodings = {}
+        self.cached = 0
+        self.skipped = {}
+
+    def record(self, encoding, size, compressed, cpu_time):
+        with self._lock:
+            counters = self.encodings.setdefault(encoding, {'responses': 0, 'bytes_in': 0, 'bytes_out': 0, 'cpu_time': 0.0})
+            counters['responses'] += 1
+            counters['bytes_in'] += size
+            counters['bytes_out'] += compressed
+            counters['cpu_time'] += cpu_time
+
+    def skip(self, reason):
+        with self._lock:
+            self.skipped[reason] = self.skipped.get(reason, 0) + 1
+
+    def hit(self):
+        with self._lock:
+            self.cached += 1
+
+    # Returns a dict with the counters, useful for monitoring. "ratio" is the compressed size divided by the original one.
+    def stats(self):
+        with self._lock:
+            encodings = {}
+            for encoding, counters in self.encodings.items():
+                encodings[encoding] = dict(counters, ratio=counters['bytes_out'] / counters['bytes_in'] if counters['bytes_in'] else 1.0)
+            return {'encodings': encodings, 'cached': self.cached, 'skipped': dict(self.skipped)}
+
+
+def get_compression_stats(app=None):
+    if app is None:
+        app = current_app._get_current_object()
+    return app.extensions['flaskr.compression_stats']
+
+
+def _header(headers, name):
+    name = name.lower()
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+# Headers of a response compressed with "encoding". "Vary" tells the caches that the body depends on "Accept-Encoding", and the ETag becomes weak, as the
+# compressed body is not the same bytes as the original one ("conditional" compares them as weak ETags).
+def _compressed_headers(headers, encoding, length):
+    result = []
+    for key, value in headers:
+        name = key.lower()
+        if name == 'content-length' or name == 'vary':
+            continue
+        if name == 'etag' and not value.startswith('W/'):
+            value = 'W/' + value
+        result.append((key, value))
+    result.append(('Content-Encoding', encoding))
+    result.append(_vary(headers))
+    if length is not None:
+        result.append(('Content-Length', str(length)))
+    return result
+
+
+def _vary(headers):
+    vary = _header(headers, 'Vary')
+    if vary is None:
+        return 'Vary', 'Accept-Encoding'
+    if 'accept-encoding' in vary.lower() or vary.strip() == '*':
+        return 'Vary', vary
+    return 'Vary', f'{vary}, Accept-Encoding'
+
+
+# Headers of a response that could have been compressed but is not, for this client: the caches must not send it to clients accepting an encoding.
+def _uncompressed_headers(headers):
+    return [(key, value) for key, value in headers if key.lower() != 'vary'] + [_vary(headers)]
+
+
+def _close(app_iter):
+    close = getattr(app_iter, 'close', None)
+    if close is not None:
+        close()
+
+
+class CompressionMiddleware(object):
+    def __init__(self, wsgi_app, app):
+        self.wsgi_app = wsgi_app
+        self.app = app
+        self.stats = app.extensions['flaskr.compression_stats']
+
+    def __call__(self, environ, start_response):
+        config = self.app.config
+        if not config['COMPRESSION'] or environ['REQUEST_METHOD'] == 'HEAD':
+            return self.wsgi_app(environ, start_response)
+
+        # The status and headers are kept until we know whether the response is compressed, which changes them.
+        started = []
+        written = []
+
+        def capture(status, headers, exc_info=None):
+            started[:] = [status, headers]
+            # Bytes sent with the "write" callable of WSGI come before the body.
+            return written.append
+
+        app_iter = self.wsgi_app(environ, capture)
+        if not started:
+            # Flask always calls "start_response" before returning the body. Other applications may call it while the body is iterated: their
+            # responses are sent as they are.
+            return self._forward(app_iter, started, written, start_response)
+        status, headers = started
+
+        reason = self._skip_reason(status, headers)
+        if reason is not None:
+            self.stats.skip(reason)
+            if reason in ('size', 'no-transform'):
+                headers = _uncompressed_headers(headers)
+            return self._send(app_iter, status, headers, written, start_response)
+
+        encoding = negotiate(environ.get('HTTP_ACCEPT_ENCODING'), config['COMPRESSION_ENCODINGS'])
+        if encoding is None:
+            self.stats.skip('accept')
+            return self._send(app_iter, status, _uncompressed_headers(headers), written, start_response)
+
+        length = _header(headers, 'Content-Length')
+        length = int(length) if length is not None else None
+        page = environ.get(ENVIRON_KEY)
+        if page is not None:
+            return self._cached(page, encoding, app_iter, status, headers, written, start_response)
+        if length is not None and length <= BUFFER_LIMIT:
+            return self._buffered(encoding, app_iter, status, headers, written, start_response)
+        start_response(status, _compressed_headers(headers, encoding, None))
+        return self._stream(encoding, app_iter, written)
+
+    # Returns why a response is not compressed, or None if it must be.
+    def _skip_reason(self, status, headers):
+        if status[:3] in ('204', '206', '304') or status[0] == '1':
+            return 'status'
+        if _header(headers, 'Content-Encoding') is not None:
+            return 'encoded'
+        if not _compressible(_header(headers, 'Content-Type') or ''):
+            return 'type'
+        if 'no-transform' in (_header(headers, 'Cache-Control') or '').lower():
+            return 'no-transform'
+        length = _header(headers, 'Content-Length')
+        if length is not None and int(length) < self.app.config['COMPRESSION_MIN_SIZE']:
+            return 'size'
+        return None
+
+    # Sends the response as it is. Without "write" calls, the body of the application is returned unchanged, so the server can still use
+    # "wsgi.file_wrapper" for the files.
+    def _send(self, app_iter, status, headers, written, start_response):
+        start_response(status, headers)
+        if not written:
+            return app_iter
+        return self._chain(written, app_iter)
+
+    def _chain(self, written, app_iter):
+        try:
+            yield from written
+            yield from app_iter
+        finally:
+            _close(app_iter)
+
+    def _forward(self, app_iter, started, written, start_response):
+        sent = False
+        try:
+            for chunk in app_iter:
+                if not sent:
+                    start_response(*started)
+                    sent = True
+                    yield from written
+                yield chunk
+            if not sent:
+                start_response(*started)
+                yield from written
+        finally:
+            _close(app_iter)
+
+    def _read(self, app_iter, written):
+        try:
+            return b''.join(written) + b''.join(app_iter)
+        finally:
+            _close(app_iter)
+
+    def _compress(self, data, encoding):
+        start = time.thread_time()
+        compressed = compress(data, encoding)
+        self.stats.record(encoding, len(data), len(compressed), time.thread_time() - start)
+        return compressed
+
+    def _buffered(self, encoding, app_iter, status, headers, written, start_response):
+        compressed = self._compress(self._read(app_iter, written), encoding)
+        start_response(status, _compressed_headers(headers, encoding, len(compressed)))
+        return [compressed]
+
+    # Page of the page cache: "page" is the (cache, key, version) of the page, set by "cache_anonymous_page". The compressed version is stored under
+    # its own key, with the same version, so it is dropped along with the page.
+    def _cached(self, page, encoding, app_iter, status, headers, written, start_response):
+        cache, key, version = page
+        key = f'{key}|{encoding}'
+        stored = cache.get(key)
+        if stored is not None:
+            _close(app_iter)
+            compressed = stored[1]
+            self.stats.hit()
+        else:
+            compressed = self._compress(self._read(app_iter, written), encoding)
+            cache.set(key, version, (_header(headers, 'Content-Type'), compressed))
+        start_response(status, _compressed_headers(headers, encoding, len(compressed)))
+        return [compressed]
+
+    def _stream(self, encoding, app_iter, written):
+        encoder = ENCODERS[encoding][0](_level(encoding, None))
+        size = compressed = 0
+        cpu_time = 0.0
+        try:
+            for chunk in self._chain(written, app_iter):
+                if not chunk:
+                    continue
+                start = time.thread_time()
+                data = encoder.compress(chunk) + encoder.flush()
+                cpu_time += time.thread_time() - start
+                size += len(chunk)
+                compressed += len(data)
+                yield data
+            start = time.thread_time()
+            data = encoder.finish()
+            cpu_time += time.thread_time() - start
+            compressed += len(data)
+            yield data
+        finally:
+            # The counters are updated once, at the end, so the chunks don't take the lock.
+            self.stats.record(encoding, size, compressed, cpu_time)
+
+
+def init_app(app):
+    app.extensions['flaskr.compression_stats'] = CompressionStats()
+    app.wsgi_app = CompressionMiddleware(app.wsgi_app, app)
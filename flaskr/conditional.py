@@ -0,0 +1,64 @@
+# Module with the support for conditional GET requests.
+# Browsers and proxies that already have a copy of a page send its validators back ("If-None-Match" with the ETag, "If-Modified-Since" with the date). If
+# the data didn't change, we answer "304 Not Modified" without a body, before running the heavy query and rendering the template.
+import functools
+import hashlib
+from datetime import timezone
+
+from flask import current_app, make_response, request, session
+from flaskr.db import get_read_db
+from flaskr import queries
+
+
+# Returns the (version, changed) pair of the posts table. "version" is incremented by the triggers defined in "schema.sql" every time a post is inserted,
+# updated or deleted, and "changed" is the moment of the last change. It is a single-row lookup, whatever the number of posts.
+def get_data_version():
+    row = get_read_db().execute(queries.DATA_VERSION).fetchone()
+    return row['version'], row['changed']
+
+
+# Decorator adding ETag and Last-Modified headers to a view, and answering 304 when the client's copy is still valid.
+# "validators" receives the same arguments as the view and returns a (version, last_modified) pair. It must be cheap, as it runs before the view.
+def conditional(validators):
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapped_view(**kwargs):
+            # Only GET requests are conditional, and pages with flashed messages must always be rendered, as the messages are shown only once.
+            if request.method not in ('GET', 'HEAD') or '_flashes' in session:
+                return view(**kwargs)
+
+            version, last_modified = validators(**kwargs)
+            if last_modified is not None and last_modified.tzinfo is None:
+                # CURRENT_TIMESTAMP in SQLite is always in UTC.
+                last_modified = last_modified.replace(tzinfo=timezone.utc)
+            # The page depends on the data, the logged in user (name, edit links) and the URL (page cursors), so all of them are part of the ETag.
+            seed = f'{version}:{session.get("user_id")}:{request.full_path}'
+            etag = hashlib.sha1(seed.encode('utf8')).hexdigest()
+
+            if _not_modified(etag, last_modified):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(**kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            # The page changes with the session cookie, and the client must check it with us before using its copy.
+            response.vary.add('Cookie')
+            response.cache_control.no_cache = True
+            return response
+
+        return wrapped_view
+
+    return decorator
+
+
+# As in HTTP, "If-None-Match" has priority. "If-Modified-Since" is only used when the client didn't send an ETag.
+def _not_modified(etag, last_modified):
+    if request.if_none_match:
+        # The compressed responses have a weak version of the ETag (see "compression"), so the comparison is the weak one, as HTTP prescribes for GET.
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified is not None:
+        return last_modified.replace(microsecond=0) <= request.if_modified_since
+    return False
@@ -1,40 +1,367 @@
 # Module to control SQLite
+import re
 import sqlite3
+import threading
+import time
+from pathlib import Path
 
 import click
-from flask import current_app, g
+from flask import current_app, g, has_request_context, request, session
 from flask.cli import with_appcontext
+from flaskr import profiling, queries, replica
+
+
+# PRAGMA profile applied to every new connection. These are the production defaults, and any of them can be changed (or disabled with None) with the
+# DATABASE_PRAGMAS setting in "config.py". They are applied in this order: "busy_timeout" goes first so the rest wait for locks instead of failing.
+DEFAULT_PRAGMAS = {
+    # Milliseconds a connection waits for a lock held by another one before raising "database is locked".
+    'busy_timeout': 5000,
+    # With the Write-Ahead Log, readers don't block the writer and the writer doesn't block readers, so "/" keeps working while someone posts.
+    'journal_mode': 'wal',
+    # In WAL mode, NORMAL is still safe against corruption and avoids an fsync on every commit.
+    'synchronous': 'normal',
+    # Page cache of each connection. Negative values are in KiB, so this is 16 MiB.
+    'cache_size': -16000,
+    # Bytes of the file read through memory mapping instead of read() calls (256 MiB).
+    'mmap_size': 268435456,
+    # Temporary tables and indices (used by sorting, for example) are kept in memory.
+    'temp_store': 'memory',
+}
+
+# PRAGMA statements can't use "?" placeholders, so names and values are validated before building the statement.
+_PRAGMA_VALUE = re.compile(r'^-?\w+$')
+
+
+# Returns the PRAGMA profile of an application: the defaults updated with the DATABASE_PRAGMAS setting.
+def get_pragmas(app):
+    pragmas = dict(DEFAULT_PRAGMAS)
+    pragmas.update(app.config['DATABASE_PRAGMAS'])
+    return {name: value for name, value in pragmas.items() if value is not None}
+
+
+# Applies a PRAGMA profile to a connection.
+def apply_pragmas(db, pragmas):
+    for name, value in pragmas.items():
+        if not name.isidentifier() or not _PRAGMA_VALUE.match(str(value)):
+            raise ValueError(f'Invalid PRAGMA {name} = {value!r}.')
+        # "fetchall" is needed because some PRAGMAs (like journal_mode) return a row that must be consumed.
+        db.execute(f'PRAGMA {name} = {value}').fetchall()
+
+
+# Exception raised when every connection of the pool is in use and none is returned before the timeout.
+class PoolTimeout(Exception):
+    pass
+
+
+# A bounded pool of SQLite connections shared by every thread of the process.
+# Opening a connection means opening the file, reading the schema and configuring it, so we do it once and reuse the connection for many requests.
+class ConnectionPool(object):
+    # "connect" is a function without arguments returning a new connection. "size" is the maximum number of connections open at the same time, and "timeout" the
+    # number of seconds a request waits for a free connection before giving up.
+    def __init__(self, connect, size=5, timeout=30.0):
+        self._connect = connect
+        self.size = size
+        self.timeout = timeout
+        # The condition protects the attributes below and lets waiting threads sleep until a connection is returned.
+        self._cond = threading.Condition()
+        self._idle = []
+        self._open = 0
+        self._closed = False
+        # Connections opened before the last "drain" are closed when they are returned. "_generations" maps each open connection to the generation
+        # it was opened in.
+        self._generation = 0
+        self._generations = {}
+        # Counters exposed through "stats".
+        self.checkouts = 0
+        self.created = 0
+        self.discarded = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    # Takes a connection from the pool, opening a new one if the pool is not full yet, or waiting for another thread to return one.
+    def acquire(self):
+        with self._cond:
+            if self._closed:
+                raise PoolTimeout('The connection pool is closed.')
+
+            if not self._idle and self._open >= self.size:
+                start = time.perf_counter()
+                self.waits += 1
+                ready = self._cond.wait_for(
+                    lambda: self._idle or self._open < self.size or self._closed,
+                    self.timeout,
+                )
+                waited = time.perf_counter() - start
+                self.wait_time += waited
+                self.max_wait_time = max(self.max_wait_time, waited)
+                if not ready or self._closed:
+                    self.timeouts += 1
+                    raise PoolTimeout(
+                        f'No database connection available after {self.timeout} seconds.'
+                    )
+
+            self.checkouts += 1
+            # We reuse the most recently returned connection, whose pages are more likely to still be in the cache.
+            if self._idle:
+                return self._idle.pop()
+            # We reserve the place before leaving the lock, so the slow "connect" call doesn't block the other threads.
+            self._open += 1
+            generation = self._generation
+
+        try:
+            db = self._connect()
+        except BaseException:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self.created += 1
+            self._generations[db] = generation
+        return db
+
+    # Returns a connection to the pool. Any transaction left open by the request is rolled back, so the next request receives a clean connection.
+    def release(self, db):
+        try:
+            if db.in_transaction:
+                db.rollback()
+        # If the connection is broken (or was closed by someone), we throw it away and open a new one next time.
+        except sqlite3.Error:
+            self._discard(db)
+            return
+
+        with self._cond:
+            if self._closed:
+                self._open -= 1
+                self._generations.pop(db, None)
+                db.close()
+            elif self._generations.get(db) != self._generation:
+                self._open -= 1
+                self._generations.pop(db, None)
+                self.discarded += 1
+                db.close()
+            else:
+                self._idle.append(db)
+            self._cond.notify()
+
+    def _discard(self, db):
+        try:
+            db.close()
+        except sqlite3.Error:
+            pass
+        with self._cond:
+            self._open -= 1
+            self._generations.pop(db, None)
+            self.discarded += 1
+            self._cond.notify()
+
+    # Closes the idle connections, and the ones in use as soon as they are returned, so the next requests open new ones. Used when the file they
+    # should open changes (see "get_read_db").
+    def drain(self):
+        with self._cond:
+            self._generation += 1
+            for db in self._idle:
+                self._generations.pop(db, None)
+                db.close()
+            self._open -= len(self._idle)
+            self.discarded += len(self._idle)
+            self._idle = []
+            self._cond.notify_all()
+
+    # Closes every idle connection. Connections still in use are closed as soon as they are returned.
+    def close(self):
+        with self._cond:
+            self._closed = True
+            for db in self._idle:
+                self._generations.pop(db, None)
+                db.close()
+            self._open -= len(self._idle)
+            self._idle = []
+            self._cond.notify_all()
+
+    # Returns a dict with the state of the pool, useful for monitoring.
+    def stats(self):
+        with self._cond:
+            return {
+                'size': self.size,
+                'open': self._open,
+                'idle': len(self._idle),
+                'in_use': self._open - len(self._idle),
+                'checkouts': self.checkouts,
+                'created': self.created,
+                'discarded': self.discarded,
+                'waits': self.waits,
+                'timeouts': self.timeouts,
+                'wait_time': self.wait_time,
+                'max_wait_time': self.max_wait_time,
+            }
+
+
+# Opens a new connection configured as the rest of the application expects.
+# With "readonly=True", the connection opens the replica (or the main file if there is none, or if its first copy isn't made yet) in read-only mode, and
+# any attempt to write raises an error.
+def connect(app=None, readonly=False):
+    if app is None:
+        app = current_app
+    database = app.config['DATABASE']
+    if readonly:
+        replica_path = app.config['DATABASE_REPLICA']
+        if replica_path and Path(replica_path).exists():
+            database = replica_path
+        # "mode=ro" can only be given as a URI. "as_uri" needs an absolute path and escapes the characters with a meaning in URIs ("?", "#"...).
+        database = Path(database).absolute().as_uri() + '?mode=ro'
+    # "sqlite3.connect" establishes a connection to the file pointed at by the DATABASE configuration key. It does not have to exist yet, and won't until we initialize the db.
+    db = sqlite3.connect(
+        # "current_app" is another special object that points to the Flask application handling the request. As we have used an application factory, there is no application object.
+        # get_db will be called when the application has been created and is handling a request, so "current_app" can be used.
+        database,
+        detect_types=sqlite3.PARSE_DECLTYPES,
+        # Pooled connections are used by different threads along their life (one request at a time), so we disable the check made by sqlite3.
+        check_same_thread=False,
+        # Every statement run through the connection is kept prepared, keyed by its text (see "queries").
+        cached_statements=app.config['DATABASE_CACHED_STATEMENTS'],
+        uri=readonly,
+    )
+    # With the following, we tell the connection to return rows behaving like dicts, so we can access those columns by name.
+    db.row_factory = sqlite3.Row
+    # The PRAGMA profile is applied once, when the connection is opened. As connections are pooled, requests don't pay for it.
+    pragmas = get_pragmas(app)
+    if readonly:
+        # The journal mode is stored in the file, so only the writer sets it. "query_only" also refuses writes to temporary tables.
+        pragmas.pop('journal_mode', None)
+        pragmas['query_only'] = 1
+    apply_pragmas(db, pragmas)
+    # In the same way, the hot statements are prepared before the connection enters the pool.
+    if app.config['DATABASE_WARMUP']:
+        queries.warm_up(db)
+    return db
+
+
+# Lock used to create only one pool per application, even if several threads ask for it at the same time.
+_pool_lock = threading.Lock()
+
+
+# The pool is stored in "app.extensions" (the place where Flask keeps the objects owned by an application). It is created the first time it is needed, so the
+# configuration can still be changed after "create_app". Returns None when pooling is disabled (DATABASE_POOL_SIZE = 0).
+# The read-only connections have their own pool ("readonly=True"), of the same size.
+def get_pool(app=None, readonly=False):
+    if app is None:
+        app = current_app._get_current_object()
+    if not app.config['DATABASE_POOL_SIZE']:
+        return None
+
+    key = 'flaskr.read_pool' if readonly else 'flaskr.pool'
+    pool = app.extensions.get(key)
+    if pool is None:
+        with _pool_lock:
+            pool = app.extensions.get(key)
+            if pool is None:
+                pool = app.extensions[key] = ConnectionPool(
+                    lambda: connect(app, readonly),
+                    size=app.config['DATABASE_POOL_SIZE'],
+                    timeout=app.config['DATABASE_POOL_TIMEOUT'],
+                )
+    return pool
 
 
 def get_db():
     # "g" is an special object that is unique for each request. It is used to store data that might be accessed by multiple functions during the request.
     # The connection is stored and reused if "get_db" is called a second time in the same request.
     if 'db' not in g:
-        # "sqlite3.connect" establishes a connection to the file pointed at by the DATABASE configuration key. It does not have to exist yet, and won't until we initialize the db.
-        g.db = sqlite3.connect(
-            # "current_app" is another special object that points to the Flask application handling the request. As we have used an application factory, there is no application object.
-            # get_db will be called when the application has been created and is handling a request, so "current_app" can be used.
-            current_app.config['DATABASE'],
-            detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        # With the following, we tell the connection to return rows behaving like dicts, so we can access those columns by name.
-        g.db.row_factory = sqlite3.Row
+        # We check a connection out of the pool. If pooling is disabled, we open a new one that will be closed at the end of the request.
+        pool = get_pool()
+        g.db = pool.acquire() if pool is not None else connect()
+        # In the sampled requests, the connection records every statement (see "profiling").
+        g.db = profiling.wrap(g.db)
+        # With a replica, the user reads the main file until their changes have been copied (see "replica").
+        if current_app.config['DATABASE_REPLICA'] and has_request_context() and request.method not in ('GET', 'HEAD'):
+            session['read_primary_until'] = time.time() + 2 * current_app.config['DATABASE_REPLICA_INTERVAL']
 
     return g.db
 
 
-def close_db(e=None):
-    db = g.pop('db',None)
+# Returns the connection used by the views that only read (the index, the search, the loading of "g.user"...). It is a read-only connection, so those
+# views never take the write lock and the readers of all the threads run in parallel with the writer. The views that write keep using "get_db".
+# With DATABASE_READ_ROUTING = False, every view shares the connection of "get_db".
+def get_read_db():
+    if not current_app.config['DATABASE_READ_ROUTING']:
+        return get_db()
+    # The user has just written, and the replica may not have their changes yet.
+    if current_app.config['DATABASE_REPLICA'] and has_request_context() and session.get('read_primary_until', 0) > time.time():
+        return get_db()
+
+    if 'read_db' not in g:
+        # The replica is created the first time it is needed (see "replica").
+        replicator = replica.get_replicator()
+        pool = get_pool(readonly=True)
+        # Until the first copy exists, the read-only connections open the main file. Once it does, the pool is drained, so they open the replica.
+        if replicator is not None and not current_app.extensions.get('flaskr.replica_ready') and Path(replicator.target).exists():
+            current_app.extensions['flaskr.replica_ready'] = True
+            if pool is not None:
+                pool.drain()
+        g.read_db = pool.acquire() if pool is not None else connect(readonly=True)
+        g.read_db = profiling.wrap(g.read_db)
+
+    return g.read_db
+
 
-    # If "g.db" was set, it is closed.
-    if db is not None:
-        db.close()
+# Lock used to run "PRAGMA optimize" in only one thread at a time.
+_optimize_lock = threading.Lock()
+
+
+# Runs "PRAGMA optimize" on a write connection at most once every DATABASE_OPTIMIZE_INTERVAL seconds. SQLite recommends it for long-lived connections (ours
+# are pooled): it only runs ANALYZE on the tables whose statistics are out of date, so it is usually instant. As it runs after the response, an error
+# (the database is locked by another writer, for example) is only logged.
+def _maybe_optimize(db):
+    interval = current_app.config['DATABASE_OPTIMIZE_INTERVAL']
+    if not interval or db.in_transaction:
+        return
+    now = time.monotonic()
+    with _optimize_lock:
+        # The first request only starts the clock.
+        last = current_app.extensions.setdefault('flaskr.optimized', now)
+        if now - last < interval:
+            return
+        current_app.extensions['flaskr.optimized'] = now
+    try:
+        db.execute('PRAGMA optimize')
+    except sqlite3.Error as e:
+        current_app.logger.warning('PRAGMA optimize failed: %s', e)
+
+
+def close_db(e=None):
+    # The calls of the async views (see "aio") are done before their connections go back to the pool. They are closed here, so "aio" is only imported
+    # once an async view uses the database.
+    for name in ('async_db', 'async_read_db'):
+        async_db = g.pop(name, None)
+        if async_db is not None:
+            async_db.close()
+    # If "g.db" or "g.read_db" were set, they are returned to their pool (or closed if there is no pool).
+    for name, readonly in (('db', False), ('read_db', True)):
+        db = g.pop(name, None)
+        if db is not None:
+            if isinstance(db, profiling.ProfiledConnection):
+                db = db.connection
+            try:
+                # The read-only connections can't store statistics.
+                if not readonly:
+                    _maybe_optimize(db)
+            finally:
+                # Whatever happens, the connection goes back to the pool, or the pool would run out of connections.
+                pool = get_pool(readonly=readonly)
+                if pool is not None:
+                    pool.release(db)
+                else:
+                    db.close()
 
 def init_db():
     # First, we obtain a database connection in order to execute the commands read from the file.
     db = get_db()
 
-    # "open_resource" opens a file relative to our package, useful as we do not necessarily know where is it located after deploying. 
+    # "open_resource" opens a file relative to our package, useful as we do not necessarily know where is it located after deploying.
     with current_app.open_resource('schema.sql') as f:
         # "executescript" (sqlite3) allows for executing multiple SQL statements at once. The rest of the parameters are used to read the file properly
         db.executescript(f.read().decode('utf8'))
@@ -47,9 +374,36 @@ def init_db_command():
     init_db()
     click.echo('Database initialized')
 
+# Some PRAGMAs return a number instead of the name used to set them. We translate them so the output of "db-pragmas" can be compared with the profile.
+_PRAGMA_NAMES = {
+    'synchronous': {0: 'off', 1: 'normal', 2: 'full', 3: 'extra'},
+    'temp_store': {0: 'default', 1: 'file', 2: 'memory'},
+}
+
+
+# Command to print the PRAGMA values actually in effect on a connection, which can differ from the profile (for example, journal_mode=wal is not possible
+# for in-memory databases).
+@click.command('db-pragmas')
+@with_appcontext
+def db_pragmas_command():
+    """Show the SQLite PRAGMA settings in effect."""
+    db = get_db()
+    names = list(DEFAULT_PRAGMAS)
+    names.extend(name for name in get_pragmas(current_app) if name not in names)
+    for name in names:
+        row = db.execute(f'PRAGMA {name}').fetchone()
+        value = row[0] if row is not None else None
+        value = _PRAGMA_NAMES.get(name, {}).get(value, value)
+        click.echo(f'{name} = {value}')
+
 # Function to register with the application instance
 def init_app(app):
     # Call function "close_db" after cleaning up after returning the response.
     app.teardown_appcontext(close_db)
     # New command that can be called with the flask command.
     app.cli.add_command(init_db_command)
+    app.cli.add_command(db_pragmas_command)
+    # "Server-Timing" header and slow query log of the profiled requests.
+    profiling.init_app(app)
+    # "sync-replica" command.
+    replica.init_app(app)
@@ -0,0 +1,169 @@
+# Module to hash and check passwords outside of the request thread.
+# Password hashes (scrypt, pbkdf2) are slow on purpose, so a burst of logins keeps the worker busy and slows down every other request. We send the hashing
+# to a small dedicated executor with a bounded number of pending jobs: when it is full, the request fails at once with "503 Service Unavailable" and a
+# "Retry-After" header, instead of queuing forever.
+#
+# HASH_EXECUTOR chooses the executor:
+#   'thread': a thread pool. hashlib releases the GIL while computing scrypt and pbkdf2, so the other requests keep running.
+#   'process': a process pool, for hash backends that keep the GIL.
+#   None: hash in the request thread (the behaviour before this module existed).
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from werkzeug.exceptions import ServiceUnavailable
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class Hasher(object):
+    def __init__(self, executor='thread', workers=2, queue_size=16, method='scrypt', retry_after=1):
+        if executor == 'thread':
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='flaskr-hash')
+        elif executor == 'process':
+            # Imported here, as it loads "multiprocessing".
+            from concurrent.futures import ProcessPoolExecutor
+            self._executor = ProcessPoolExecutor(max_workers=workers)
+        elif executor is None:
+            self._executor = None
+        else:
+            raise ValueError(f'Unknown HASH_EXECUTOR {executor!r}.')
+        self.method = method
+        self.queue_size = queue_size
+        self.retry_after = retry_after
+        # The semaphore counts the free places: every job takes one while it waits or runs.
+        self._slots = threading.BoundedSemaphore(queue_size)
+        self._lock = threading.Lock()
+        # Counters exposed through "stats".
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    # Takes a place for a new job. Raises ServiceUnavailable if there are already "queue_size" jobs pending.
+    def _acquire(self):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise ServiceUnavailable('The server is busy, please try again.', retry_after=self.retry_after)
+        with self._lock:
+            self.pending += 1
+
+    def _release(self, start):
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.pending -= 1
+            self.completed += 1
+            self.total_time += elapsed
+            self.max_time = max(self.max_time, elapsed)
+        self._slots.release()
+
+    # Runs "function" in the executor and waits for the result.
+    def _run(self, function, *args):
+        self._acquire()
+        start = time.perf_counter()
+        try:
+            if self._executor is None:
+                return function(*args)
+            return self._executor.submit(function, *args).result()
+        finally:
+            self._release(start)
+
+    # Same as "_run", for the async views: the event loop keeps running while the hash is computed.
+    async def _run_async(self, function, *args):
+        # Imported here, so the application starts without asyncio (see "aio").
+        import asyncio
+        self._acquire()
+        start = time.perf_counter()
+        try:
+            if self._executor is None:
+                return function(*args)
+            return await asyncio.wrap_future(self._executor.submit(function, *args))
+        finally:
+            self._release(start)
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def check(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    async def hash_async(self, password):
+        return await self._run_async(generate_password_hash, password, self.method)
+
+    async def check_async(self, pwhash, password):
+        return await self._run_async(check_password_hash, pwhash, password)
+
+    # True when the hash was made with other parameters than the current ones (an older method or fewer iterations), so it should be replaced.
+    def needs_rehash(self, pwhash):
+        return pwhash.split('$', 1)[0] != _method_prefix(self.method)
+
+    # Returns a dict with the state of the executor, useful for monitoring. Times are in seconds.
+    def stats(self):
+        with self._lock:
+            return {
+                'queue_size': self.queue_size,
+                'pending': self.pending,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'total_time': self.total_time,
+                'max_time': self.max_time,
+                'mean_time': self.total_time / self.completed if self.completed else 0.0,
+            }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+
+# werkzeug stores the parameters at the start of the hash ("scrypt:32768:8:1$salt$hash"). To know the current ones we hash a dummy password once.
+@functools.lru_cache(maxsize=None)
+def _method_prefix(method):
+    return generate_password_hash('', method).split('$', 1)[0]
+
+
+# Lock used to create only one hasher per application.
+_hasher_lock = threading.Lock()
+
+
+# The hasher is stored in "app.extensions" and created the first time it is needed.
+def get_hasher(app=None):
+    if app is None:
+        app = current_app._get_current_object()
+
+    hasher = app.extensions.get('flaskr.hasher')
+    if hasher is None:
+        with _hasher_lock:
+            hasher = app.extensions.get('flaskr.hasher')
+            if hasher is None:
+                hasher = app.extensions['flaskr.hasher'] = Hasher(
+                    executor=app.config['HASH_EXECUTOR'],
+                    workers=app.config['HASH_WORKERS'],
+                    queue_size=app.config['HASH_QUEUE_SIZE'],
+                    method=app.config['PASSWORD_HASH_METHOD'],
+                    retry_after=app.config['HASH_RETRY_AFTER'],
+                )
+    return hasher
+
+
+# Shortcuts used by the views.
+def hash_password(password):
+    return get_hasher().hash(password)
+
+
+def check_password(pwhash, password):
+    return get_hasher().check(pwhash, password)
+
+
+def needs_rehash(pwhash):
+    return get_hasher().needs_rehash(pwhash)
+
+
+async def hash_password_async(password):
+    return await get_hasher().hash_async(password)
+
+
+async def check_password_async(pwhash, password):
+    return await get_hasher().check_async(pwhash, password)
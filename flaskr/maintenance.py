@@ -0,0 +1,165 @@
+# Module with the maintenance commands of the database, all of them safe to run while the application is serving requests.
+# The long operations (backup and vacuum) work in steps of a few pages and sleep between them, so the writers are only paused for one step at a time.
+# Every command reports the bytes processed, the total time and the longest pause: the time the database was locked in a single step.
+#
+#   flask backup DESTINATION   Copies the database with the backup API of SQLite.
+#   flask vacuum               Returns the free pages to the file system (PRAGMA incremental_vacuum).
+#   flask optimize             Refreshes the statistics of the query planner (PRAGMA optimize, or a full ANALYZE).
+#   flask checkpoint           Copies the WAL into the database file (PRAGMA wal_checkpoint).
+import os
+import sqlite3
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from flaskr.db import get_db
+
+
+# Copies the database into "destination" in steps of "pages" pages. If the database is written during the copy, SQLite restarts it, so the copy is always
+# a consistent snapshot. Returns a dict with the bytes copied, the number of steps, the total time and the longest step, in seconds.
+def backup(db, destination, pages=256, sleep=0.01):
+    page_size = db.execute('PRAGMA page_size').fetchone()[0]
+    report = {'bytes': 0, 'steps': 0, 'duration': 0.0, 'max_pause': 0.0}
+    start = last = time.perf_counter()
+
+    # Called by sqlite3 after each step. The sleep leaves time to the writers before the next step.
+    def progress(status, remaining, total):
+        nonlocal last
+        now = time.perf_counter()
+        report['steps'] += 1
+        report['max_pause'] = max(report['max_pause'], now - last)
+        report['bytes'] = (total - remaining) * page_size
+        if remaining and sleep:
+            time.sleep(sleep)
+        last = time.perf_counter()
+
+    target = sqlite3.connect(destination)
+    try:
+        db.backup(target, pages=pages, progress=progress)
+    finally:
+        target.close()
+    report['duration'] = time.perf_counter() - start
+    return report
+
+
+# Returns the free pages of the database to the file system, "pages" at a time. Needs "auto_vacuum = incremental" (see "schema.sql"). With "full=True",
+# runs a VACUUM instead: it rebuilds the whole file (and enables incremental auto_vacuum on older databases), but blocks the writers until it is done.
+def vacuum(db, pages=1024, sleep=0.01, full=False):
+    page_size = db.execute('PRAGMA page_size').fetchone()[0]
+    free = db.execute('PRAGMA freelist_count').fetchone()[0]
+    report = {'bytes': 0, 'steps': 0, 'duration': 0.0, 'max_pause': 0.0}
+    start = time.perf_counter()
+
+    if full:
+        db.executescript('PRAGMA auto_vacuum = incremental; VACUUM;')
+        report['steps'] = 1
+        report['max_pause'] = time.perf_counter() - start
+    else:
+        if db.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            raise click.ClickException('The database does not use incremental auto_vacuum. Run "flask vacuum --full" once to enable it.')
+        remaining = free
+        while remaining:
+            step = time.perf_counter()
+            # "execute" would only free the first page: "executescript" runs the PRAGMA to completion.
+            db.executescript(f'PRAGMA incremental_vacuum({pages})')
+            report['steps'] += 1
+            report['max_pause'] = max(report['max_pause'], time.perf_counter() - step)
+            left = db.execute('PRAGMA freelist_count').fetchone()[0]
+            # Other connections may free pages during the vacuum, so we stop when a step makes no progress.
+            remaining = left if left < remaining else 0
+            if remaining and sleep:
+                time.sleep(sleep)
+
+    report['bytes'] = (free - db.execute('PRAGMA freelist_count').fetchone()[0]) * page_size
+    report['duration'] = time.perf_counter() - start
+    return report
+
+
+# Refreshes the statistics used by the query planner. "PRAGMA optimize" only analyzes the tables that need it. With "analyze=True", every table and index
+# is analyzed.
+def optimize(db, analyze=False):
+    start = time.perf_counter()
+    db.execute('ANALYZE' if analyze else 'PRAGMA optimize')
+    db.commit()
+    duration = time.perf_counter() - start
+    return {'bytes': 0, 'steps': 1, 'duration': duration, 'max_pause': duration}
+
+
+# Copies the pages of the WAL into the database file. "mode" is one of the modes of "PRAGMA wal_checkpoint": PASSIVE doesn't wait for anyone, while
+# TRUNCATE waits for the readers and writers and leaves an empty WAL file.
+def checkpoint(db, mode='passive'):
+    page_size = db.execute('PRAGMA page_size').fetchone()[0]
+    start = time.perf_counter()
+    busy, log, checkpointed = db.execute(f'PRAGMA wal_checkpoint({mode.upper()})').fetchone()
+    duration = time.perf_counter() - start
+    return {
+        'bytes': max(checkpointed, 0) * page_size, 'steps': 1, 'duration': duration, 'max_pause': duration,
+        # True when the checkpoint could not finish because of other connections (the rest is done by the next one).
+        'busy': bool(busy), 'wal_pages': max(log, 0),
+    }
+
+
+def _size(path):
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def _echo(action, report):
+    click.echo(
+        f'{action} {report["bytes"] / 1048576:.1f} MiB in {report["duration"]:.2f} s'
+        f' ({report["steps"]} steps, longest pause {report["max_pause"] * 1000:.1f} ms).'
+    )
+
+
+@click.command('backup')
+@click.argument('destination', type=click.Path(dir_okay=False))
+@click.option('--pages', default=256, show_default=True, help='Pages copied in each step.')
+@click.option('--sleep', default=0.01, show_default=True, help='Seconds between steps, left to the writers.')
+@with_appcontext
+def backup_command(destination, pages, sleep):
+    """Copy the database to DESTINATION while the application is running."""
+    _echo('Copied', backup(get_db(), destination, pages, sleep))
+
+
+@click.command('vacuum')
+@click.option('--pages', default=1024, show_default=True, help='Pages freed in each step.')
+@click.option('--sleep', default=0.01, show_default=True, help='Seconds between steps, left to the writers.')
+@click.option('--full', is_flag=True, help='Rebuild the whole file with VACUUM (blocks the writers until it is done).')
+@with_appcontext
+def vacuum_command(pages, sleep, full):
+    """Return the free pages of the database to the file system."""
+    path = current_app.config['DATABASE']
+    size = _size(path)
+    report = vacuum(get_db(), pages, sleep, full)
+    _echo('Freed', report)
+    click.echo(f'File size: {size / 1048576:.1f} MiB -> {_size(path) / 1048576:.1f} MiB.')
+
+
+@click.command('optimize')
+@click.option('--analyze', is_flag=True, help='Analyze every table and index instead of only the ones out of date.')
+@with_appcontext
+def optimize_command(analyze):
+    """Refresh the statistics used by the query planner."""
+    report = optimize(get_db(), analyze)
+    click.echo(f'Statistics refreshed in {report["duration"] * 1000:.1f} ms.')
+
+
+@click.command('checkpoint')
+@click.option('--mode', type=click.Choice(['passive', 'full', 'restart', 'truncate']), default='passive', show_default=True)
+@with_appcontext
+def checkpoint_command(mode):
+    """Copy the write-ahead log into the database file."""
+    wal = current_app.config['DATABASE'] + '-wal'
+    size = _size(wal)
+    report = checkpoint(get_db(), mode)
+    _echo('Checkpointed', report)
+    if report['busy']:
+        click.echo('Other connections prevented a complete checkpoint.')
+    click.echo(f'WAL size: {size / 1048576:.1f} MiB -> {_size(wal) / 1048576:.1f} MiB.')
+
+
+def init_app(app):
+    app.cli.add_command(backup_command)
+    app.cli.add_command(vacuum_command)
+    app.cli.add_command(optimize_command)
+    app.cli.add_command(checkpoint_command)
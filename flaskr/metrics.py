@@ -0,0 +1,377 @@
+# Module with the metrics of the application, served in the text format of Prometheus at "/metrics".
+# For every endpoint ("blog.index", "auth.login"...), it records the requests by status class, the requests in flight, and histograms of the time spent
+# answering them, of the time spent rendering templates and in the database, and of the size of the responses. The counters of the pools, caches,
+# hasher, writer, replica and compression are added to the output too.
+#
+# The values are kept in a flat array of floats, at positions computed once from the list of endpoints, so recording a request is a few additions under a
+# lock. With METRICS_MULTIPROCESS_DIR, the array of each process is a file mapped in memory ("metrics-<pid>.bin") and "/metrics" adds up the files of
+# every worker. The folder must be emptied before the server starts, as with the multiprocess mode of the Prometheus client.
+#
+# Notes:
+#   - The database time comes from "profiling", so it is only known for the sampled requests (SQL_PROFILE_SAMPLE_RATE): timing every statement of every
+#     request would cost more than the rest of the recording. The "_count" of that histogram is the number of requests sampled.
+#   - The duration goes from the moment the request reaches the application to the moment the server closes the response, and the size is the number of
+#     bytes sent, after compression (see "compression").
+#   - In multiprocess mode, the counters of the pools, caches... are the ones of the process answering "/metrics".
+import bisect
+import hashlib
+import hmac
+import math
+import mmap
+import os
+import threading
+import time
+from array import array
+
+from flask import abort, current_app, has_request_context, request
+from flask.signals import before_render_template, template_rendered
+from flaskr import profiling
+
+
+# Upper bounds of the buckets of the histograms, in seconds and bytes.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# Histograms recorded for each endpoint: name, help and buckets.
+HISTOGRAMS = (
+    ('flaskr_request_duration_seconds', 'Time spent answering the requests.', LATENCY_BUCKETS),
+    ('flaskr_template_duration_seconds', 'Time spent rendering templates during the requests.', LATENCY_BUCKETS),
+    ('flaskr_db_duration_seconds', 'Time spent in the database during the requests sampled by SQL_PROFILE_SAMPLE_RATE.', LATENCY_BUCKETS),
+    ('flaskr_response_size_bytes', 'Bytes sent in the body of the responses.', SIZE_BUCKETS),
+)
+
+STATUS_CLASSES = ('1xx', '2xx', '3xx', '4xx', '5xx')
+
+# Endpoint of the requests that matched no URL (404, 405...).
+NO_ENDPOINT = 'none'
+
+# Objects of "app.extensions" whose "stats" are added to the output, with the prefix of their metrics.
+COMPONENTS = (
+    ('flaskr.pool', 'flaskr_db_pool'),
+    ('flaskr.read_pool', 'flaskr_db_read_pool'),
+    ('flaskr.user_cache', 'flaskr_user_cache'),
+    ('flaskr.page_cache', 'flaskr_page_cache'),
+    ('flaskr.hasher', 'flaskr_hasher'),
+    ('flaskr.writer', 'flaskr_writer'),
+    ('flaskr.replicator', 'flaskr_replica'),
+)
+
+# The files of the multiprocess mode start with this header and a hash of the layout, so the files written by another version of the application (with
+# other endpoints) are ignored. The header keeps the values aligned on 8 bytes.
+_MAGIC = b'flaskrm1'
+_HEADER_SIZE = 32
+
+
+# Positions of the values of each endpoint in the array. For each endpoint: the requests of each status class, the requests in flight, and for each
+# histogram, its buckets (the last one is "+Inf") followed by the sum of the values observed.
+class Layout(object):
+    def __init__(self, endpoints):
+        self.endpoints = list(endpoints)
+        self.index = {endpoint: i for i, endpoint in enumerate(self.endpoints)}
+        self.in_flight = len(STATUS_CLASSES)
+        self.histograms = []
+        offset = self.in_flight + 1
+        for name, help, buckets in HISTOGRAMS:
+            self.histograms.append((offset, buckets))
+            offset += len(buckets) + 2
+        self.stride = offset
+        self.size = self.stride * len(self.endpoints)
+        self.checksum = hashlib.blake2b(repr((self.endpoints, HISTOGRAMS)).encode('utf8'), digest_size=_HEADER_SIZE - len(_MAGIC)).digest()
+
+
+# The values of one process: a bytearray, or a file mapped in memory in multiprocess mode.
+class MetricsStore(object):
+    def __init__(self, layout, directory=None):
+        self.layout = layout
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        length = _HEADER_SIZE + layout.size * 8
+        if directory is None:
+            self._mmap = None
+            buffer = bytearray(length)
+        else:
+            self.path = os.path.join(directory, f'metrics-{self.pid}.bin')
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                os.ftruncate(fd, length)
+                buffer = self._mmap = mmap.mmap(fd, length)
+            finally:
+                os.close(fd)
+            # A file left by a previous process with the same pid (or another layout) starts again from zero.
+            if buffer[:_HEADER_SIZE] != _MAGIC + layout.checksum:
+                buffer[:] = bytes(length)
+                buffer[:_HEADER_SIZE] = _MAGIC + layout.checksum
+        self._view = memoryview(buffer)
+        self.values = self._view[_HEADER_SIZE:].cast('d')
+
+    def started(self, endpoint):
+        position = self.layout.index.get(endpoint, 0) * self.layout.stride + self.layout.in_flight
+        with self._lock:
+            self.values[position] += 1
+
+    # Records a finished request. "observed" holds the values of the histograms, in the order of HISTOGRAMS, None for the ones not measured.
+    # "started" is False for the requests that never reached "started" (the ones that matched no URL).
+    def finished(self, endpoint, status, observed, started=True):
+        base = self.layout.index.get(endpoint, 0) * self.layout.stride
+        values = self.values
+        with self._lock:
+            values[base + min(max(status // 100, 1), 5) - 1] += 1
+            if started:
+                values[base + self.layout.in_flight] -= 1
+            for (offset, buckets), value in zip(self.layout.histograms, observed):
+                if value is not None:
+                    values[base + offset + bisect.bisect_left(buckets, value)] += 1
+                    values[base + offset + len(buckets) + 1] += value
+
+    # Returns a copy of the values of this process.
+    def snapshot(self):
+        with self._lock:
+            return array('d', self.values)
+
+    def close(self):
+        self.values.release()
+        self._view.release()
+        if self._mmap is not None:
+            self._mmap.close()
+
+
+# Lock used to create only one store per application (and process).
+_store_lock = threading.Lock()
+
+
+# The store is created on the first request, when every endpoint is known. A process forked after that (with a preloaded application) creates its own.
+def get_store(app=None):
+    if app is None:
+        app = current_app._get_current_object()
+    store = app.extensions.get('flaskr.metrics')
+    if store is None or store.pid != os.getpid():
+        with _store_lock:
+            store = app.extensions.get('flaskr.metrics')
+            if store is None or store.pid != os.getpid():
+                layout = Layout([NO_ENDPOINT] + sorted(app.view_functions))
+                store = app.extensions['flaskr.metrics'] = MetricsStore(layout, app.config['METRICS_MULTIPROCESS_DIR'])
+    return store
+
+
+# On Windows, "os.kill" terminates the process whatever the signal, and the workers are not forked, so a file always belongs to a live process.
+def _alive(pid):
+    if os.name == 'nt':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# Returns the values of every process, added up. The requests in flight of the processes that are gone are left out.
+def collect(app=None):
+    store = get_store(app)
+    layout = store.layout
+    directory = (app or current_app).config['METRICS_MULTIPROCESS_DIR']
+    if directory is None:
+        return store.snapshot()
+
+    total = array('d', bytes(layout.size * 8))
+    for name in os.listdir(directory):
+        if not (name.startswith('metrics-') and name.endswith('.bin')):
+            continue
+        with open(os.path.join(directory, name), 'rb') as f:
+            data = f.read()
+        if data[:_HEADER_SIZE] != _MAGIC + layout.checksum or len(data) != _HEADER_SIZE + layout.size * 8:
+            continue
+        values = array('d', data[_HEADER_SIZE:])
+        alive = _alive(int(name[len('metrics-'):-len('.bin')]))
+        for i in range(layout.size):
+            if alive or i % layout.stride != layout.in_flight:
+                total[i] += values[i]
+    return total
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# Prometheus writes the special values as "NaN", "+Inf" and "-Inf".
+def _number(value):
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+# Returns the metrics in the text format of Prometheus. Only the endpoints that received requests are listed.
+def render_metrics(app=None):
+    app = app or current_app._get_current_object()
+    values = collect(app)
+    layout = get_store(app).layout
+    endpoints = []
+    for i, endpoint in enumerate(layout.endpoints):
+        base = i * layout.stride
+        if any(values[base:base + layout.in_flight + 1]):
+            endpoints.append((endpoint, base))
+
+    lines = [
+        '# HELP flaskr_requests_total Requests answered, by endpoint and status class.',
+        '# TYPE flaskr_requests_total counter',
+    ]
+    for endpoint, base in endpoints:
+        for i, status in enumerate(STATUS_CLASSES):
+            if values[base + i]:
+                lines.append(f'flaskr_requests_total{{endpoint="{_escape(endpoint)}",status="{status}"}} {_number(values[base + i])}')
+
+    lines.append('# HELP flaskr_requests_in_flight Requests being answered.')
+    lines.append('# TYPE flaskr_requests_in_flight gauge')
+    for endpoint, base in endpoints:
+        lines.append(f'flaskr_requests_in_flight{{endpoint="{_escape(endpoint)}"}} {_number(values[base + layout.in_flight])}')
+
+    for (name, help, buckets), (offset, _) in zip(HISTOGRAMS, layout.histograms):
+        lines.append(f'# HELP {name} {help}')
+        lines.append(f'# TYPE {name} histogram')
+        for endpoint, base in endpoints:
+            label = f'endpoint="{_escape(endpoint)}"'
+            count = 0
+            for i, bound in enumerate(buckets + ('+Inf',)):
+                count += values[base + offset + i]
+                le = bound if isinstance(bound, str) else _number(bound)
+                lines.append(f'{name}_bucket{{{label},le="{le}"}} {_number(count)}')
+            lines.append(f'{name}_sum{{{label}}} {_number(values[base + offset + len(buckets) + 1])}')
+            lines.append(f'{name}_count{{{label}}} {_number(count)}')
+
+    lines.extend(_component_metrics(app))
+    return '\n'.join(lines) + '\n'
+
+
+# Counters of the objects of COMPONENTS that exist in this process, and of the compression and the login throttle.
+def _component_metrics(app):
+    for key, prefix in COMPONENTS:
+        component = app.extensions.get(key)
+        if component is None:
+            continue
+        for name, value in component.stats().items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                yield f'# TYPE {prefix}_{name} untyped'
+                yield f'{prefix}_{name} {_number(value)}'
+
+    throttle = app.extensions.get('flaskr.throttle_stats')
+    if throttle is not None:
+        yield '# TYPE flaskr_login_attempts_total counter'
+        for result, value in throttle.as_dict().items():
+            yield f'flaskr_login_attempts_total{{result="{result}"}} {value}'
+
+    compression = app.extensions.get('flaskr.compression_stats')
+    if compression is not None:
+        stats = compression.stats()
+        for name in ('responses', 'bytes_in', 'bytes_out', 'cpu_time', 'ratio'):
+            yield f'# TYPE flaskr_compression_{name} untyped'
+            for encoding, counters in stats['encodings'].items():
+                yield f'flaskr_compression_{name}{{encoding="{encoding}"}} {_number(counters[name])}'
+        yield '# TYPE flaskr_compression_cached_total counter'
+        yield f'flaskr_compression_cached_total {stats["cached"]}'
+        yield '# TYPE flaskr_compression_skipped_total counter'
+        for reason, value in stats['skipped'].items():
+            yield f'flaskr_compression_skipped_total{{reason="{reason}"}} {value}'
+
+
+# Keys of the WSGI environ where the request leaves its endpoint and the time spent rendering templates. The environ is used instead of "g", as the
+# request is recorded by the middleware, after the request context is gone.
+ENDPOINT_KEY = 'flaskr.endpoint'
+TEMPLATE_TIME_KEY = 'flaskr.template_time'
+
+
+# Body of a response, counting the bytes sent. The request is recorded when the server closes it, so the time of the streamed responses includes the
+# whole stream.
+class _RecordedBody(object):
+    def __init__(self, app_iter, finish):
+        self._app_iter = app_iter
+        self._finish = finish
+        self.size = 0
+
+    def __iter__(self):
+        for chunk in self._app_iter:
+            self.size += len(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            close = getattr(self._app_iter, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            self._finish(self.size)
+
+
+# Middleware timing every request. It wraps the compression one, so the durations include the compression and the sizes are the bytes sent.
+# Every access to "g" or "request" goes through a proxy, which costs about a microsecond, so the request itself only uses one: "set_endpoint" stores the
+# endpoint in the environ, and everything else is read from there.
+class MetricsMiddleware(object):
+    def __init__(self, wsgi_app, app):
+        self.wsgi_app = wsgi_app
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        start = time.perf_counter()
+        status = [500]
+
+        def capture(code, headers, exc_info=None):
+            status[0] = int(code[:3])
+            return start_response(code, headers, exc_info)
+
+        try:
+            app_iter = self.wsgi_app(environ, capture)
+        except BaseException:
+            self._finish(environ, start, 500, None)
+            raise
+        return _RecordedBody(app_iter, lambda size: self._finish(environ, start, status[0], size))
+
+    def _finish(self, environ, start, status, size):
+        endpoint = environ.get(ENDPOINT_KEY)
+        observed = (time.perf_counter() - start, environ.get(TEMPLATE_TIME_KEY, 0.0), environ.get(profiling.DB_TIME_KEY), size)
+        get_store(self.app).finished(endpoint or NO_ENDPOINT, status, observed, started=endpoint is not None)
+
+
+# URL value preprocessor: Flask calls it with the endpoint of every request that matched a URL, before the "before_request" functions.
+def _set_endpoint(app):
+    def set_endpoint(endpoint, values):
+        request.environ[ENDPOINT_KEY] = endpoint
+        get_store(app).started(endpoint)
+    return set_endpoint
+
+
+# Templates are also rendered outside of requests ("compile-templates", TEMPLATE_WARMUP...), and those are not measured.
+def _template_started(app, **extra):
+    if has_request_context():
+        request.environ['flaskr.template_start'] = time.perf_counter()
+
+
+def _template_rendered(app, **extra):
+    if not has_request_context():
+        return
+    environ = request.environ
+    start = environ.pop('flaskr.template_start', None)
+    if start is not None:
+        environ[TEMPLATE_TIME_KEY] = environ.get(TEMPLATE_TIME_KEY, 0.0) + time.perf_counter() - start
+
+
+def metrics_view():
+    token = current_app.config['METRICS_TOKEN']
+    # "compare_digest" takes the same time wherever the strings differ, so the token can't be guessed one character at a time.
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        abort(403)
+    return current_app.response_class(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
+# Must be called once every other middleware is installed, so the time spent in them is measured too.
+def init_app(app):
+    if not app.config['METRICS']:
+        return
+    app.url_value_preprocessor(_set_endpoint(app))
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_rendered, app)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+    app.wsgi_app = MetricsMiddleware(app.wsgi_app, app)
@@ -0,0 +1,178 @@
+# Module with the cache of rendered pages.
+# For anonymous visitors, pages like the index are the same HTML until a post is created, updated or deleted. Instead of running the query and rendering the
+# template again, we keep the rendered page and send it directly.
+#
+# Every cached page is stored together with the "version" of the data it shows. The views that change posts call "invalidate", which increments the version,
+# so the pages rendered before are never served again. With a shared backend (SQLite), every worker sees the new version at once.
+import functools
+import os
+import sqlite3
+import threading
+import time
+
+from flask import current_app, request, session
+from flaskr.cache import TTLCache
+
+
+# Key of the WSGI environ where "cache_anonymous_page" leaves the (cache, key, version) of the page sent. The compression middleware uses it to store the
+# compressed versions of the page in the cache, next to the page itself (see "compression").
+ENVIRON_KEY = 'flaskr.page_cache'
+
+# Backend keeping the pages in the memory of each process. It is the fastest one. Each worker has its own "invalidate" counter, so the version also
+# includes the one of the posts table (see "conditional"), which the triggers increment on every change made by any process ("flask import", other
+# workers...). That costs one single-row lookup per page, but a page is never served after its posts changed.
+class MemoryPageCache(object):
+    def __init__(self, app):
+        self._pages = TTLCache(maxsize=app.config['PAGE_CACHE_SIZE'])
+        self._lock = threading.Lock()
+        self._version = 0
+
+    def version(self):
+        # Imported here because "db" imports this module (through "replica").
+        from flaskr.conditional import get_data_version
+
+        return f'{get_data_version()[0]}.{self._version}'
+
+    def invalidate(self):
+        with self._lock:
+            self._version += 1
+        # The pages of old versions can't be reached anymore, so we free their memory now.
+        self._pages.clear()
+
+    def get(self, key):
+        return self._pages.get(key)
+
+    def set(self, key, version, page):
+        self._pages.set(key, page)
+
+    def stats(self):
+        return self._pages.stats()
+
+
+# Backend keeping the pages in a SQLite file shared by every worker of the machine (PAGE_CACHE_DATABASE). It is slower than the memory one, but an
+# "invalidate" in one worker is seen by all of them.
+class SQLitePageCache(object):
+    def __init__(self, app):
+        self.path = app.config['PAGE_CACHE_DATABASE'] or os.path.join(app.instance_path, 'page_cache.sqlite')
+        self.maxsize = app.config['PAGE_CACHE_SIZE']
+        # sqlite3 connections can't be shared between threads by default, so each thread opens its own one.
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        with self._db() as db:
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS page ('
+                ' key TEXT PRIMARY KEY, version INTEGER NOT NULL, stored REAL NOT NULL,'
+                ' mimetype TEXT NOT NULL, body BLOB NOT NULL)'
+            )
+            db.execute('CREATE TABLE IF NOT EXISTS version (id INTEGER PRIMARY KEY CHECK (id = 0), value INTEGER NOT NULL)')
+            db.execute('INSERT OR IGNORE INTO version (id, value) VALUES (0, 0)')
+
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, timeout=5)
+            # The cache is read much more than it is written, so we use WAL as in the main database.
+            db.execute('PRAGMA journal_mode = wal').fetchall()
+            db.execute('PRAGMA synchronous = normal')
+        return db
+
+    def version(self):
+        return self._db().execute('SELECT value FROM version WHERE id = 0').fetchone()[0]
+
+    def invalidate(self):
+        with self._db() as db:
+            db.execute('UPDATE version SET value = value + 1 WHERE id = 0')
+            db.execute('DELETE FROM page WHERE version < (SELECT value FROM version WHERE id = 0)')
+
+    def get(self, key):
+        row = self._db().execute('SELECT mimetype, body FROM page WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0], row[1]
+
+    def set(self, key, version, page):
+        mimetype, body = page
+        with self._db() as db:
+            db.execute(
+                'INSERT OR REPLACE INTO page (key, version, stored, mimetype, body) VALUES (?, ?, ?, ?, ?)',
+                (key, version, time.time(), mimetype, body)
+            )
+            # We keep only the most recent pages.
+            db.execute(
+                'DELETE FROM page WHERE key NOT IN (SELECT key FROM page ORDER BY stored DESC LIMIT ?)',
+                (self.maxsize,)
+            )
+
+    def stats(self):
+        size = self._db().execute('SELECT COUNT(*) FROM page').fetchone()[0]
+        return {'size': size, 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses}
+
+
+# Backends that can be chosen by name with the PAGE_CACHE setting. PAGE_CACHE can also be a class (or any callable) receiving the application.
+BACKENDS = {
+    'memory': MemoryPageCache,
+    'sqlite': SQLitePageCache,
+}
+
+
+# Lock used to create only one cache per application.
+_cache_lock = threading.Lock()
+
+
+# The cache is stored in "app.extensions" and created the first time it is needed. Returns None when the cache is disabled (PAGE_CACHE = None).
+def get_page_cache(app=None):
+    if app is None:
+        app = current_app._get_current_object()
+    backend = app.config['PAGE_CACHE']
+    if not backend:
+        return None
+
+    cache = app.extensions.get('flaskr.page_cache')
+    if cache is None:
+        with _cache_lock:
+            cache = app.extensions.get('flaskr.page_cache')
+            if cache is None:
+                factory = BACKENDS[backend] if isinstance(backend, str) else backend
+                cache = app.extensions['flaskr.page_cache'] = factory(app)
+    return cache
+
+
+# Must be called after committing any change to the data shown by cached pages (posts, usernames...).
+def invalidate():
+    cache = get_page_cache()
+    if cache is not None:
+        cache.invalidate()
+
+
+# Decorator caching the page returned by a view for anonymous visitors. The key is made of the endpoint and the full path, so every page of the index
+# ("?before=...") is cached separately. Logged in users always get a fresh page, as it contains their name and edit links.
+def cache_anonymous_page(view):
+    @functools.wraps(view)
+    def wrapped_view(**kwargs):
+        cache = get_page_cache()
+        # Pages with flashed messages are shown only once, so they can't be cached either.
+        if cache is None or 'user_id' in session or '_flashes' in session:
+            return view(**kwargs)
+
+        # We read the version before rendering. If a post is changed meanwhile, the page is stored with the old version and never served.
+        version = cache.version()
+        key = f'{version}:{request.endpoint}:{request.full_path}'
+        page = cache.get(key)
+        if page is not None:
+            mimetype, body = page
+            response = current_app.response_class(body, mimetype=mimetype)
+            response.headers['X-Page-Cache'] = 'hit'
+            request.environ[ENVIRON_KEY] = (cache, key, version)
+            return response
+
+        response = current_app.make_response(view(**kwargs))
+        if response.status_code == 200 and not response.is_streamed:
+            cache.set(key, version, (response.mimetype, response.get_data()))
+            response.headers['X-Page-Cache'] = 'miss'
+            request.environ[ENVIRON_KEY] = (cache, key, version)
+        return response
+
+    return wrapped_view
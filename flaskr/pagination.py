@@ -0,0 +1,123 @@
+# Module with the helpers for keyset (cursor) pagination.
+# Instead of "OFFSET", which makes SQLite walk and discard every previous row, we remember the (created, id) of the last post shown and ask for the rows right after it.
+# Thanks to the index over (created, id) defined in "schema.sql", the 1000th page costs the same as the first one.
+import base64
+import binascii
+
+
+# Format version of the cursor. If we ever change its content, old links will be rejected instead of misread.
+CURSOR_VERSION = '1'
+
+
+# A cursor is the (created, id) pair of a post, encoded so it can travel safely inside a URL.
+# The content is "1|<created>|<id>", encoded with urlsafe base64 and without the "=" padding.
+def encode_cursor(created, id):
+    raw = f'{CURSOR_VERSION}|{created}|{id}'.encode('utf8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+# Reverse operation of "encode_cursor". It returns the (created, id) tuple or raises a "ValueError" when the cursor has been tampered with.
+def decode_cursor(cursor):
+    # We restore the padding removed in "encode_cursor".
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        raw = base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf8')
+    except (binascii.Error, UnicodeError) as e:
+        raise ValueError(f'Invalid cursor {cursor!r}.') from e
+
+    version, sep, rest = raw.partition('|')
+    # "rpartition" allows the timestamp to contain any character, as the id is always the last field.
+    created, sep2, id = rest.rpartition('|')
+    if version != CURSOR_VERSION or not sep or not sep2 or not id.isdigit():
+        raise ValueError(f'Invalid cursor {cursor!r}.')
+
+    return created, int(id)
+
+
+# Object returned by "get_page": the rows to show and the cursors for the "older"/"newer" links. A cursor is None when there is nothing in that direction.
+class Page(object):
+    def __init__(self, items, older=None, newer=None):
+        self.items = items
+        self.older = older
+        self.newer = newer
+
+
+# Returns the SQL of a page. "direction" is None for the first page, 'before' for older posts and 'after' for newer ones.
+# The text only depends on its arguments, so every request asking for the same kind of page uses the same statement (and the prepared copy kept by sqlite3).
+def page_query(select, where=(), direction=None):
+    where = list(where)
+    if direction == 'after':
+        # To go back in time, we read the rows in ascending order starting at the cursor, and reverse them afterwards.
+        where.append('(p.created, p.id) > (?, ?)')
+        order = 'ASC'
+    else:
+        if direction == 'before':
+            where.append('(p.created, p.id) < (?, ?)')
+        order = 'DESC'
+
+    query = select
+    if where:
+        query += ' WHERE ' + ' AND '.join(where)
+    return query + f' ORDER BY p.created {order}, p.id {order} LIMIT ?'
+
+
+# Returns one page of posts. "select" is the SELECT ... FROM ... part of the query (the post table must be aliased as "p"), and "where"/"params" are optional extra filters.
+# "before" asks for the posts older than a cursor and "after" for the newer ones. Without any of them we get the newest posts (the first page).
+# With "lazy=True", "items" is an iterator reading the rows from the cursor one by one (useful when streaming the template), and the "older"/"newer" cursors
+# are only known once all the items have been read.
+def get_page(db, select, where=(), params=(), before=None, after=None, per_page=20, lazy=False):
+    params = list(params)
+    direction = None
+    if after is not None:
+        params.extend(decode_cursor(after))
+        direction = 'after'
+    elif before is not None:
+        params.extend(decode_cursor(before))
+        direction = 'before'
+
+    query = page_query(select, where, direction)
+    # We ask for one more row than needed. If it exists, we know there is another page in that direction without running a "COUNT(*)".
+    params.append(per_page + 1)
+
+    cursor = db.execute(query, params)
+    # The rows of the "newer" direction have to be reversed, so they can't be read lazily.
+    if lazy and after is None:
+        page = Page(None)
+        page.items = _iter_page(page, cursor, per_page, has_newer=before is not None)
+        return page
+
+    rows = cursor.fetchall()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    if after is not None:
+        rows.reverse()
+        has_newer, has_older = has_more, True
+    else:
+        has_newer, has_older = before is not None, has_more
+
+    page = Page(rows)
+    _set_cursors(page, rows[0] if rows else None, rows[-1] if rows else None, has_older, has_newer)
+    return page
+
+
+# Generator used by the lazy pages. It yields the rows of the page and, when it is exhausted, sets the cursors of the page.
+def _iter_page(page, cursor, per_page, has_newer):
+    first = last = None
+    for count, row in enumerate(cursor):
+        if count == per_page:
+            # The extra row means there are older posts. We don't yield it.
+            _set_cursors(page, first, last, True, has_newer)
+            return
+        if first is None:
+            first = row
+        last = row
+        yield row
+    _set_cursors(page, first, last, False, has_newer)
+
+
+def _set_cursors(page, first, last, has_older, has_newer):
+    if last is not None and has_older:
+        page.older = encode_cursor(last['created'], last['id'])
+    if first is not None and has_newer:
+        page.newer = encode_cursor(first['created'], first['id'])
@@ -0,0 +1,187 @@
+# Module with the SQL profiling of each request.
+# When a request is sampled (SQL_PROFILE_SAMPLE_RATE), "get_db" and "get_read_db" return the connection wrapped in a "ProfiledConnection", which records every statement:
+# its normalized text, number of parameters, duration and rows returned. At the end of the request, the summary is sent in a "Server-Timing" header
+# (visible in the network panel of the browser) and the statements slower than SLOW_QUERY_MS are logged with their query plan.
+import functools
+import random
+import re
+import time
+
+from flask import current_app, g, request
+
+
+# Key of the WSGI environ where the time spent in the database by a profiled request is left, in seconds, for the metrics (see "metrics").
+DB_TIME_KEY = 'flaskr.db_time'
+
+# Information about one statement executed during the request.
+class QueryRecord(object):
+    __slots__ = ('sql', 'params', 'duration', 'rows')
+
+    def __init__(self, sql, params):
+        self.sql = sql
+        self.params = params
+        self.duration = 0.0
+        self.rows = 0
+
+    @property
+    def statement(self):
+        return normalize(self.sql)
+
+
+_SPACES = re.compile(r'\s+')
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+# Returns the SQL text with the spaces collapsed and the literals replaced by "?", so the same statement always looks the same in the logs.
+# The statements of the application are a few constant strings, so the result is cached.
+@functools.lru_cache(maxsize=512)
+def normalize(sql):
+    return _LITERALS.sub('?', _SPACES.sub(' ', sql).strip())
+
+
+# Cursor returned by "ProfiledConnection". SQLite runs the statement while the rows are read, so the time spent fetching is added to the record too.
+class ProfiledCursor(object):
+    def __init__(self, cursor, record):
+        self._cursor = cursor
+        self._record = record
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = self._cursor.fetchone()
+        self._record.duration += time.perf_counter() - start
+        if row is not None:
+            self._record.rows += 1
+        return row
+
+    def fetchmany(self, *args):
+        start = time.perf_counter()
+        rows = self._cursor.fetchmany(*args)
+        self._record.duration += time.perf_counter() - start
+        self._record.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = self._cursor.fetchall()
+        self._record.duration += time.perf_counter() - start
+        self._record.rows += len(rows)
+        return rows
+
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+# Wrapper around a sqlite3 connection recording the statements executed through it. Everything else (commit, rollback, IntegrityError...) is forwarded to
+# the real connection, available as "connection".
+class ProfiledConnection(object):
+    def __init__(self, connection):
+        self.connection = connection
+        self.queries = []
+
+    def _run(self, method, sql, params, count):
+        record = QueryRecord(sql, count)
+        self.queries.append(record)
+        start = time.perf_counter()
+        try:
+            cursor = method(sql, params)
+        finally:
+            record.duration += time.perf_counter() - start
+        return ProfiledCursor(cursor, record)
+
+    def execute(self, sql, params=()):
+        return self._run(self.connection.execute, sql, params, len(params))
+
+    def executemany(self, sql, seq_of_params):
+        # "seq_of_params" may be a generator, so we count the placeholders of the statement instead.
+        return self._run(self.connection.executemany, sql, seq_of_params, sql.count('?'))
+
+    def executescript(self, script):
+        record = QueryRecord(script, 0)
+        self.queries.append(record)
+        start = time.perf_counter()
+        try:
+            return self.connection.executescript(script)
+        finally:
+            record.duration += time.perf_counter() - start
+
+    def __enter__(self):
+        self.connection.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self.connection.__exit__(*exc_info)
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+    # Total number of statements and time spent in the database, in seconds.
+    def summary(self):
+        return len(self.queries), sum(query.duration for query in self.queries)
+
+
+# Decides if the current request is profiled. With a rate of 0.01, one request out of a hundred pays for the profiling.
+def sampled(app=None):
+    rate = (app or current_app).config['SQL_PROFILE_SAMPLE_RATE']
+    return rate >= 1 or (rate > 0 and random.random() < rate)
+
+
+# Returns the connection wrapped in a "ProfiledConnection" if the current request is sampled. The decision is taken once per request, so the read and
+# write connections of a request are profiled together.
+def wrap(db):
+    if 'sql_profiled' not in g:
+        g.sql_profiled = sampled()
+    return ProfiledConnection(db) if g.sql_profiled else db
+
+
+# Returns the profiled connections of the current request (the write and the read-only one), or an empty list if the request was not sampled.
+def get_profiles():
+    return [db for db in (g.get('db'), g.get('read_db')) if isinstance(db, ProfiledConnection)]
+
+
+# Runs after each request: adds the "Server-Timing" header and logs the slow statements.
+def add_server_timing(response):
+    profiles = get_profiles()
+    if not profiles:
+        return response
+
+    count = total = 0
+    for profile in profiles:
+        profile_count, profile_total = profile.summary()
+        count += profile_count
+        total += profile_total
+    response.headers.add('Server-Timing', f'db;dur={total * 1000:.3f};desc="{count} queries"')
+    request.environ[DB_TIME_KEY] = total
+
+    threshold = current_app.config['SLOW_QUERY_MS'] / 1000
+    for profile in profiles:
+        for query in profile.queries:
+            if query.duration >= threshold:
+                current_app.logger.warning(
+                    'Slow query (%.1f ms, %d params, %d rows): %s\n%s',
+                    query.duration * 1000, query.params, query.rows, query.statement,
+                    _explain(profile.connection, query),
+                )
+    return response
+
+
+# Returns the "EXPLAIN QUERY PLAN" of a statement, one step per line. The parameters are not kept, so NULLs are used instead: the plan only depends on
+# the shape of the query.
+def _explain(connection, query):
+    if not query.statement.upper().startswith(('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')):
+        return ''
+    try:
+        plan = connection.execute(f'EXPLAIN QUERY PLAN {query.sql}', (None,) * query.params).fetchall()
+    except Exception as e:
+        return f'  (no plan: {e})'
+    return '\n'.join(f'  {row[-1]}' for row in plan)
+
+
+def init_app(app):
+    app.after_request(add_server_timing)
@@ -0,0 +1,203 @@
+# Module keeping a read replica of the database.
+# With DATABASE_REPLICA set, the read-only views don't read the main file but a copy of it, refreshed every DATABASE_REPLICA_INTERVAL seconds by a
+# background thread with the backup API of SQLite. The readers then never share a file (and its locks and WAL) with the writer, at the price of showing
+# data up to one interval old. The copy is made in steps of DATABASE_REPLICA_PAGES pages, so the writer is never blocked for the whole copy.
+#
+# Only one process refreshes the replica: the one holding a lock on "<replica>.lock". The other workers read the copies it makes, and one of them takes
+# over if it exits. Where file locks aren't available (Windows), every process refreshes it.
+#
+# The requests never wait for a copy. The first one is made by the thread as soon as it starts, or before, with "flask sync-replica" (run it after
+# deploying). Until it exists, the read-only connections open the main file, and they are replaced once it does (see "db.get_read_db").
+#
+# A user doesn't find their own changes in a copy made before them. So, for two intervals after a request that writes (time for the next copy to start
+# and finish), the reads of that user go to the main file (see "db.get_read_db").
+#
+# Without DATABASE_REPLICA, the read-only connections open the main file and see every commit at once (see "db.get_read_db").
+import os
+import sqlite3
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from flaskr.pagecache import get_page_cache
+
+
+class Replicator(object):
+    # "source" and "target" are the paths of the database and of its replica. "on_copy" is called after each copy that changed the replica.
+    def __init__(self, source, target, interval=5.0, pages=1024, on_copy=None):
+        self.source = source
+        self.target = target
+        self.interval = interval
+        self.pages = pages
+        self._on_copy = on_copy
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._source_db = None
+        self._target_db = None
+        # File holding the lock of the process refreshing the replica, once this one got it.
+        self._lock_file = None
+        # Value of "PRAGMA data_version" at the last copy. It changes every time another connection commits, so we only copy when there is something new.
+        self._version = None
+        # Counters exposed through "stats".
+        self.copies = 0
+        self.skipped = 0
+        self.failures = 0
+        self.last_copy = None
+        self.last_duration = 0.0
+
+    def _connect(self):
+        if self._source_db is None:
+            self._source_db = sqlite3.connect(self.source, check_same_thread=False)
+            self._target_db = sqlite3.connect(self.target, check_same_thread=False)
+            # The readers of the replica keep reading their snapshot while it is being replaced.
+            self._target_db.execute('PRAGMA journal_mode = wal').fetchall()
+        return self._source_db, self._target_db
+
+    # Copies the database into the replica if it changed since the last copy. Returns True if a copy was made.
+    def sync(self):
+        with self._lock:
+            source, target = self._connect()
+            version = source.execute('PRAGMA data_version').fetchone()[0]
+            if version == self._version:
+                self.skipped += 1
+                return False
+
+            start = time.perf_counter()
+            # If the database is written during the copy, SQLite restarts it, so the replica is always a consistent snapshot.
+            source.backup(target, pages=self.pages)
+            self._version = version
+            self.copies += 1
+            self.last_copy = time.time()
+            self.last_duration = time.perf_counter() - start
+        if self._on_copy is not None:
+            self._on_copy()
+        return True
+
+    # Returns True if this process is the one refreshing the replica. The lock is released when the process exits, so the others keep trying.
+    def acquire(self):
+        if fcntl is None:
+            return True
+        with self._lock:
+            if self._lock_file is None:
+                lock_file = open(self.target + '.lock', 'a')
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    lock_file.close()
+                    return False
+                self._lock_file = lock_file
+            return True
+
+    # Starts the thread refreshing the replica. It is started on first use, so it is created in the worker process and not in a parent that forks later.
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='flaskr-replica', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        # Without a replica, the readers use the main file, so the first copy is made at once.
+        wait = 0 if not os.path.exists(self.target) else self.interval
+        while not self._stop.wait(wait):
+            wait = self.interval
+            if not self.acquire():
+                continue
+            try:
+                self.sync()
+            except sqlite3.Error:
+                # The next attempt may succeed (the database was locked for too long, for example). Meanwhile, the readers keep the previous copy.
+                with self._lock:
+                    self.failures += 1
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        with self._lock:
+            if self._source_db is not None:
+                self._source_db.close()
+                self._target_db.close()
+                self._source_db = self._target_db = None
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+
+    # Returns a dict with the state of the replica, useful for monitoring. "lag" is the number of seconds since the last copy.
+    def stats(self):
+        with self._lock:
+            return {
+                'owner': self._lock_file is not None or fcntl is None,
+                'copies': self.copies,
+                'skipped': self.skipped,
+                'failures': self.failures,
+                'last_duration': self.last_duration,
+                'lag': time.time() - self.last_copy if self.last_copy is not None else None,
+            }
+
+
+# Lock used to create only one replicator per application.
+_replicator_lock = threading.Lock()
+
+
+# The replicator is stored in "app.extensions" and created the first time it is needed, with its thread. Returns None when there is no replica
+# (DATABASE_REPLICA = None).
+def get_replicator(app=None):
+    if app is None:
+        app = current_app._get_current_object()
+    if not app.config['DATABASE_REPLICA']:
+        return None
+
+    replicator = app.extensions.get('flaskr.replicator')
+    if replicator is None:
+        with _replicator_lock:
+            replicator = app.extensions.get('flaskr.replicator')
+            if replicator is None:
+                replicator = _create_replicator(app)
+                replicator.start()
+                app.extensions['flaskr.replicator'] = replicator
+    return replicator
+
+
+def _create_replicator(app):
+    return Replicator(
+        app.config['DATABASE'],
+        app.config['DATABASE_REPLICA'],
+        interval=app.config['DATABASE_REPLICA_INTERVAL'],
+        pages=app.config['DATABASE_REPLICA_PAGES'],
+        on_copy=lambda: _invalidate_pages(app),
+    )
+
+
+# The pages cached while the replica was behind show old data, so they are discarded after every copy.
+def _invalidate_pages(app):
+    cache = get_page_cache(app)
+    if cache is not None:
+        cache.invalidate()
+
+
+# Command to refresh the replica at once, for example after a deployment or an import. It makes one copy with its own replicator, without the thread.
+@click.command('sync-replica')
+@with_appcontext
+def sync_replica_command():
+    """Copy the database into the read replica."""
+    if not current_app.config['DATABASE_REPLICA']:
+        raise click.ClickException('DATABASE_REPLICA is not set.')
+    replicator = _create_replicator(current_app._get_current_object())
+    try:
+        replicator.sync()
+    finally:
+        replicator.close()
+    stats = replicator.stats()
+    click.echo(f'Replica updated in {stats["last_duration"] * 1000:.1f} ms.')
+
+
+def init_app(app):
+    app.cli.add_command(sync_replica_command)
@@ -1,20 +1,100 @@
 
 
+-- With "incremental" auto_vacuum, the pages freed by deletes stay in a free list until "flask vacuum" gives them back to the file system, a few at a time,
+-- while the application keeps running. The mode can only be changed on an empty database, so the VACUUM below applies it once the tables are dropped.
+PRAGMA auto_vacuum = incremental;
+
 DROP TABLE IF EXISTS user;
 DROP TABLE IF EXISTS post;
+DROP TABLE IF EXISTS post_version;
+DROP TABLE IF EXISTS post_fts;
+
+VACUUM;
 
 CREATE TABLE user (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     username TEXT UNIQUE NOT NULL,
-    password text NOT NULL
+    password text NOT NULL,
+    -- Summary of the posts of the user, kept up to date by the "user_posts" triggers below, so the page of an author never counts its posts.
+    post_count INTEGER NOT NULL DEFAULT 0,
+    last_post_at TIMESTAMP
 );
 
 CREATE TABLE post (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     author_id INTEGER NOT NULL,
     created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    -- Moment of the last modification, used as "Last-Modified" by the update view.
+    updated TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
     title TEXT NOT NULL,
     body TEXT NOT NULL,
     FOREIGN KEY (author_id) REFERENCES user (id)
 );
 
+-- Index used by the keyset pagination of the index: the posts are listed by (created, id), newest first.
+CREATE INDEX post_created_id ON post (created DESC, id DESC);
+
+-- Index used by the page of each author ("/user/<username>"): the posts of one author, in the same order. It also gives the latest post of an author at once.
+CREATE INDEX post_author_created_id ON post (author_id, created DESC, id DESC);
+
+CREATE TRIGGER user_posts_insert AFTER INSERT ON post BEGIN
+    UPDATE user SET post_count = post_count + 1, last_post_at = MAX(COALESCE(last_post_at, new.created), new.created) WHERE id = new.author_id;
+END;
+
+CREATE TRIGGER user_posts_delete AFTER DELETE ON post BEGIN
+    UPDATE user SET post_count = post_count - 1, last_post_at = (SELECT MAX(created) FROM post WHERE author_id = old.author_id)
+    WHERE id = old.author_id;
+END;
+
+-- Posts rarely change author or date, but if they do, both authors are computed again.
+CREATE TRIGGER user_posts_update AFTER UPDATE OF author_id, created ON post BEGIN
+    UPDATE user SET
+        post_count = (SELECT COUNT(*) FROM post WHERE author_id = user.id),
+        last_post_at = (SELECT MAX(created) FROM post WHERE author_id = user.id)
+    WHERE id IN (old.author_id, new.author_id);
+END;
+
+-- A single row with a counter incremented on every change to the posts, and the moment of that change. The ETag / Last-Modified validators of the blog views
+-- are computed from it, so answering a revalidation costs one lookup.
+CREATE TABLE post_version (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    version INTEGER NOT NULL,
+    changed TIMESTAMP NOT NULL
+);
+
+INSERT INTO post_version (id, version, changed) VALUES (0, 0, CURRENT_TIMESTAMP);
+
+CREATE TRIGGER post_version_insert AFTER INSERT ON post BEGIN
+    UPDATE post_version SET version = version + 1, changed = CURRENT_TIMESTAMP WHERE id = 0;
+END;
+
+CREATE TRIGGER post_version_update AFTER UPDATE ON post BEGIN
+    UPDATE post_version SET version = version + 1, changed = CURRENT_TIMESTAMP WHERE id = 0;
+END;
+
+CREATE TRIGGER post_version_delete AFTER DELETE ON post BEGIN
+    UPDATE post_version SET version = version + 1, changed = CURRENT_TIMESTAMP WHERE id = 0;
+END;
+
+-- Full-text search index over the title and body of the posts. It is an "external content" FTS5 table: it only stores the index, and reads the text from
+-- "post" when it needs it (for the snippets). The triggers keep it in sync with every insert, update and delete.
+-- The "flask rebuild-search-index" command runs the statements between the "search" markers on existing databases, so all of them use "IF NOT EXISTS".
+-- search:begin
+CREATE VIRTUAL TABLE IF NOT EXISTS post_fts USING fts5(title, body, content='post', content_rowid='id');
+
+-- Results are ordered by bm25, with words in the title weighing ten times more than words in the body.
+INSERT INTO post_fts (post_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0)');
+
+CREATE TRIGGER IF NOT EXISTS post_fts_insert AFTER INSERT ON post BEGIN
+    INSERT INTO post_fts (rowid, title, body) VALUES (new.id, new.title, new.body);
+END;
+
+CREATE TRIGGER IF NOT EXISTS post_fts_delete AFTER DELETE ON post BEGIN
+    INSERT INTO post_fts (post_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+END;
+
+CREATE TRIGGER IF NOT EXISTS post_fts_update AFTER UPDATE OF title, body ON post BEGIN
+    INSERT INTO post_fts (post_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+    INSERT INTO post_fts (rowid, title, body) VALUES (new.id, new.title, new.body);
+END;
+-- search:end
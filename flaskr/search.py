@@ -0,0 +1,97 @@
+# Module with the full-text search over the posts, backed by the "post_fts" FTS5 table defined in "schema.sql".
+import secrets
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from markupsafe import Markup, escape
+from flaskr.aio import get_async_db
+from flaskr.db import get_db, get_read_db
+from flaskr import queries
+
+
+# Returns the (start, end) markers FTS5 places around the matched words. Any client can submit control characters in a post, so the markers also contain a
+# random token chosen for each search: text stored in a post can't contain it, and only the real markers become <mark> tags.
+def _markers():
+    token = secrets.token_hex(8)
+    return f'\x02{token}\x02', f'\x03{token}\x03'
+
+
+# Turns the text typed by the user into an FTS5 query. Every word is quoted, so characters with a special meaning in FTS5 (quotes, "*", "-", "OR"...)
+# are searched literally instead of raising a syntax error. Posts must contain all the words. Returns None if there is nothing to search.
+def build_query(text):
+    words = text.split()
+    if not words:
+        return None
+    return ' '.join('"{}"'.format(word.replace('"', '""')) for word in words)
+
+
+# Escapes the text of a snippet and highlights the matched words. The control characters left come from the post itself, so they are removed.
+def highlight(text, markers):
+    start, end = markers
+    text = str(escape(text)).replace(start, '<mark>').replace(end, '</mark>')
+    return Markup(text.replace('\x02', '').replace('\x03', ''))
+
+
+# Returns one page of results (the best ones first) and whether there are more pages. "page" starts at 1.
+# Results are ordered by relevance, so we use LIMIT/OFFSET: FTS5 has to rank every match anyway, and users rarely go past the first pages.
+def search_posts(text, page=1, per_page=20):
+    query = build_query(text)
+    if query is None:
+        return [], False
+
+    markers = _markers()
+    rows = get_read_db().execute(queries.SEARCH_POSTS, _search_params(query, markers, page, per_page)).fetchall()
+    return _search_results(rows, markers, per_page)
+
+
+# Same as "search_posts", for the async views.
+async def search_posts_async(text, page=1, per_page=20):
+    query = build_query(text)
+    if query is None:
+        return [], False
+
+    markers = _markers()
+    db = await get_async_db(readonly=True)
+    cursor = await db.execute(queries.SEARCH_POSTS, _search_params(query, markers, page, per_page))
+    return _search_results(await cursor.fetchall(), markers, per_page)
+
+
+def _search_params(query, markers, page, per_page):
+    return (*markers, *markers, query, per_page + 1, (page - 1) * per_page)
+
+
+def _search_results(rows, markers, per_page):
+    results = [
+        dict(row, title_hl=highlight(row['title_hl'], markers), snippet=highlight(row['snippet'], markers))
+        for row in rows[:per_page]
+    ]
+    return results, len(rows) > per_page
+
+
+# Returns the statements between the "search" markers of "schema.sql", which create the FTS5 table and its triggers if they don't exist.
+def _search_schema():
+    with current_app.open_resource('schema.sql') as f:
+        schema = f.read().decode('utf8')
+    start = schema.index('-- search:begin')
+    end = schema.index('-- search:end')
+    return schema[start:end]
+
+
+# Creates the search index if needed (databases initialized before the search existed) and fills it again from the "post" table.
+def rebuild_search_index():
+    db = get_db()
+    db.executescript(_search_schema())
+    db.execute("INSERT INTO post_fts (post_fts) VALUES ('rebuild')")
+    # Merging the segments of the index makes the following queries faster.
+    db.execute("INSERT INTO post_fts (post_fts) VALUES ('optimize')")
+    db.commit()
+    return db.execute(queries.COUNT_POSTS).fetchone()[0]
+
+
+@click.command('rebuild-search-index')
+@with_appcontext
+def rebuild_search_index_command():
+    """Create and fill the full-text search index of the posts."""
+    count = rebuild_search_index()
+    click.echo(f'Search index rebuilt ({count} posts).')
@@ -20,9 +20,16 @@ setup(
     # Including the setup in a zipfile or not.
     zip_safe=False,
     # Establish the condition that "flask" must be installed before installing this distribution.
+    # The "async" extra installs "asgiref", which Flask needs to run the "async def" views.
     install_requires=[
-        'flask',
+        'flask[async]',
     ],
+    # Optional dependencies, installed with "pip install -e .[brotli]". Without brotli, "flask build-assets" only builds the gzip versions.
+    # With them, the responses are also compressed with brotli and zstd (see "compression").
+    extras_require={
+        'brotli': ['brotli'],
+        'zstd': ['zstandard'],
+    },
 )
 
 # In the MANIFEST.in file we wrote the following:
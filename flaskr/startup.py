@@ -0,0 +1,111 @@
+# Module with the tools to keep the start of the application fast.
+# Every worker and every "flask" command runs "create_app", so everything it imports is paid on each cold start. The commands that are only used from time
+# to time (export, backup...) are registered as "LazyCommand": their module is imported when they run, not when the application is created.
+#
+# "flask startup-report" shows where the time of a cold start goes, module by module.
+import importlib
+import os
+import sys
+
+import click
+
+
+# Command standing for another one, defined in a module that is only imported when the command runs. "import_name" is "module:attribute".
+# Its help is the one of the real command, so "flask --help" imports the modules of the lazy commands, but running any other command doesn't.
+class LazyCommand(click.Command):
+    def __init__(self, name, import_name):
+        super().__init__(name)
+        self.import_name = import_name
+        self._command = None
+
+    def load(self):
+        if self._command is None:
+            module, attribute = self.import_name.split(':')
+            self._command = getattr(importlib.import_module(module), attribute)
+        return self._command
+
+    # The context is made by the real command, so its options, help and callback are used from here on.
+    def make_context(self, info_name, args, parent=None, **extra):
+        return self.load().make_context(info_name, args, parent=parent, **extra)
+
+    def invoke(self, ctx):
+        return self.load().invoke(ctx)
+
+    def get_params(self, ctx):
+        return self.load().get_params(ctx)
+
+    def get_short_help_str(self, limit=45):
+        return self.load().get_short_help_str(limit)
+
+    def get_help(self, ctx):
+        return self.load().get_help(ctx)
+
+
+# Commands registered lazily by "create_app".
+LAZY_COMMANDS = (
+    ('rebuild-search-index', 'flaskr.search:rebuild_search_index_command'),
+    ('export', 'flaskr.transfer:export_command'),
+    ('import', 'flaskr.transfer:import_command'),
+    ('backup', 'flaskr.maintenance:backup_command'),
+    ('vacuum', 'flaskr.maintenance:vacuum_command'),
+    ('optimize', 'flaskr.maintenance:optimize_command'),
+    ('checkpoint', 'flaskr.maintenance:checkpoint_command'),
+)
+
+
+# Code run in a new interpreter to measure a cold start. It prints the seconds spent importing "flaskr" (and Flask) and running "create_app".
+_PROBE = '''
+import time
+start = time.perf_counter()
+from flaskr import create_app
+imported = time.perf_counter()
+create_app({'TESTING': True, 'TEMPLATE_BYTECODE_CACHE': None})
+print(imported - start, time.perf_counter() - imported)
+'''
+
+
+# Starts a new interpreter with "-X importtime" and returns the import and factory times, in seconds, and the list of the modules imported as
+# (name, self time, cumulative time, depth) tuples, in seconds too.
+def measure_startup():
+    import subprocess
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [root, os.environ.get('PYTHONPATH')])))
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', _PROBE], capture_output=True, text=True, env=env, check=True,
+    )
+    imports, factory = (float(value) for value in result.stdout.split())
+
+    modules = []
+    for line in result.stderr.splitlines():
+        # "import time:  self [us] | cumulative | imported package", with the name indented by the depth of the import.
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_time, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        modules.append((name.strip(), int(self_time) / 1e6, int(cumulative) / 1e6, depth))
+    return {'import': imports, 'factory': factory, 'modules': modules}
+
+
+@click.command('startup-report')
+@click.option('--limit', default=20, show_default=True, help='Number of modules shown.')
+@click.option('--flaskr-only', is_flag=True, help='Show only the modules of flaskr.')
+def startup_report_command(limit, flaskr_only):
+    """Show the time spent importing each module when the application starts."""
+    report = measure_startup()
+    total = report['import'] + report['factory']
+    click.echo(
+        f'Cold start: {total * 1000:.1f} ms (import flaskr {report["import"] * 1000:.1f} ms,'
+        f' create_app {report["factory"] * 1000:.1f} ms, {len(report["modules"])} modules imported).'
+    )
+    modules = report['modules']
+    if flaskr_only:
+        modules = [module for module in modules if module[0].split('.')[0] == 'flaskr']
+    click.echo(f'{"self ms":>9} {"total ms":>9}  module')
+    for name, self_time, cumulative, depth in sorted(modules, key=lambda module: module[1], reverse=True)[:limit]:
+        click.echo(f'{self_time * 1000:9.1f} {cumulative * 1000:9.1f}  {name}')
+
+
+def init_app(app):
+    for name, import_name in LAZY_COMMANDS:
+        app.cli.add_command(LazyCommand(name, import_name))
+    app.cli.add_command(startup_report_command)
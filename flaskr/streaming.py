@@ -0,0 +1,32 @@
+# Module to send templates to the client while they are being rendered.
+# "render_template" builds the whole page in one string before sending anything, so the time until the first byte and the memory used grow with the number of
+# posts. When streaming, the header and the nav of "base.html" are sent first, and the rows flow out in chunks while they are read from the cursor.
+from flask import current_app, render_template, stream_with_context
+from flask.signals import before_render_template, template_rendered
+
+
+# Returns True when the views should stream their templates (STREAM_TEMPLATES setting).
+def streaming_enabled():
+    return current_app.config['STREAM_TEMPLATES']
+
+
+# Same as "render_template", but returns a streamed response when STREAM_TEMPLATES is enabled.
+def render_page(template_name, **context):
+    if not streaming_enabled():
+        return render_template(template_name, **context)
+
+    app = current_app._get_current_object()
+    template = app.jinja_env.get_or_select_template(template_name)
+    # As "render_template" does, we add "g", "request", "session"... and the context processors to the template context.
+    app.update_template_context(context)
+
+    def generate():
+        before_render_template.send(app, template=template, context=context)
+        stream = template.stream(context)
+        # Jinja yields many tiny strings. Buffering groups them, so each chunk sent to the client is a few rows instead of a few characters.
+        stream.enable_buffering(app.config['STREAM_BUFFER_SIZE'])
+        yield from stream
+        template_rendered.send(app, template=template, context=context)
+
+    # "stream_with_context" keeps the request (and its database connection) alive until the last chunk has been sent.
+    return app.response_class(stream_with_context(generate()), mimetype='text/html')
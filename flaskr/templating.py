@@ -0,0 +1,67 @@
+# Module with the bytecode cache of the templates.
+# Jinja compiles every template to Python code the first time it is used, and each worker process keeps its own compiled copy in memory. A new worker
+# (after a deploy or when scaling up) compiles "base.html", the blog and auth templates again, and its first requests pay for it.
+# With TEMPLATE_BYTECODE_CACHE, the compiled code is saved to that folder and loaded by the next processes instead of compiling the templates again.
+# Jinja checks the source of the template against the saved code, so an edited template is compiled again.
+#
+#   flask compile-templates   Compiles every template into the cache (at build or deploy time).
+#
+# With TEMPLATE_WARMUP, "create_app" also loads every template, so the worker compiles (or reads from the cache) all of them before serving requests.
+import os
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from jinja2 import FileSystemBytecodeCache
+
+
+# Bytecode cache creating its folder the first time it saves a template, so creating the application doesn't touch the file system.
+class BytecodeCache(FileSystemBytecodeCache):
+    def dump_bytecode(self, bucket):
+        os.makedirs(self.directory, exist_ok=True)
+        super().dump_bytecode(bucket)
+
+    def clear(self):
+        if os.path.isdir(self.directory):
+            super().clear()
+
+
+# Configures the bytecode cache. Flask creates the Jinja environment the first time it is used (registering a blueprint with template filters does it),
+# so this must run before the blueprints are registered.
+def init_app(app):
+    directory = app.config['TEMPLATE_BYTECODE_CACHE']
+    if directory:
+        app.jinja_options = dict(app.jinja_options, bytecode_cache=BytecodeCache(directory))
+    app.cli.add_command(compile_templates_command)
+
+
+# Loads every template of the application (and its blueprints), which compiles the ones missing from the cache and saves them.
+# Returns a list of (name, seconds) tuples.
+def compile_templates(app):
+    timings = []
+    for name in app.jinja_env.list_templates():
+        start = time.perf_counter()
+        app.jinja_env.get_template(name)
+        timings.append((name, time.perf_counter() - start))
+    return timings
+
+
+# Called at the end of "create_app", once every blueprint is registered.
+def warm_up(app):
+    if app.config['TEMPLATE_WARMUP']:
+        compile_templates(app)
+
+
+@click.command('compile-templates')
+@click.option('--clean', is_flag=True, help='Remove the cached code first, so every template is compiled again.')
+@with_appcontext
+def compile_templates_command(clean):
+    """Compile every template into the bytecode cache."""
+    cache = current_app.jinja_env.bytecode_cache
+    if cache is None:
+        raise click.ClickException('TEMPLATE_BYTECODE_CACHE is not set, so there is no cache to fill.')
+    if clean:
+        cache.clear()
+    timings = compile_templates(current_app)
+    click.echo(f'Compiled {len(timings)} templates in {sum(seconds for _, seconds in timings) * 1000:.1f} ms.')
@@ -0,0 +1,416 @@
+# Benchmark suite and load-test harness for the flaskr endpoints.
+# The functional tests check that the views work, but not how fast they are. This script seeds a database of the chosen size, measures the latency
+# percentiles and throughput of the main endpoints, and saves the results to JSON so they can be compared with a saved baseline.
+#
+# It is not collected by pytest (its name doesn't start with "test_"). From the root of the repository:
+#   PYTHONPATH=. python flaskr/tests/benchmark.py run --posts 100000 --output current.json
+#   PYTHONPATH=. python flaskr/tests/benchmark.py run --posts 100000 --server --concurrency 8 --output current.json
+#   PYTHONPATH=. python flaskr/tests/benchmark.py compare baseline.json current.json --threshold 0.1
+#   PYTHONPATH=. python flaskr/tests/benchmark.py first-request --runs 20
+#
+# Any setting of the application can be changed with "--config KEY=VALUE" (the value is read as JSON when possible), so the same run can be made with and
+# without an optimization: "--config PAGE_CACHE=null".
+import http.client
+import itertools
+import json
+import os
+import platform
+import queue
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlencode
+
+import click
+from werkzeug.security import generate_password_hash
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from flaskr import create_app
+from flaskr.db import get_db, get_pool, init_db
+from flaskr.templating import compile_templates
+
+
+# Password of every seeded user.
+PASSWORD = 'bench'
+
+# Endpoints measured, in the order they are run. Deletes go last, as they consume posts.
+SCENARIOS = ('index', 'index_logged_in', 'login', 'create', 'update', 'delete')
+
+
+# Fills the database with "users" users and "posts" posts. The first user (the one used by the write benchmarks) owns the first "reserved" posts, so
+# there are enough posts to update and delete. Everything is inserted with "executemany" in one transaction, which takes seconds even for 1M posts.
+def seed(app, posts, users, reserved=0):
+    with app.app_context():
+        init_db()
+        db = get_db()
+        # Hashing is slow on purpose, so every user shares the same hash.
+        password = generate_password_hash(PASSWORD)
+        db.executemany(
+            'INSERT INTO user (id, username, password) VALUES (?, ?, ?)',
+            ((i + 1, f'user{i}', password) for i in range(users))
+        )
+        start = datetime(2020, 1, 1)
+        rng = random.Random(0)
+        db.executemany(
+            'INSERT INTO post (author_id, created, title, body) VALUES (?, ?, ?, ?)',
+            (
+                (
+                    1 if i < reserved else i % users + 1,
+                    (start + timedelta(seconds=i * 37)).strftime('%Y-%m-%d %H:%M:%S'),
+                    f'Post number {i}',
+                    ' '.join(rng.choice(_WORDS) for _ in range(60)),
+                )
+                for i in range(posts)
+            )
+        )
+        db.commit()
+        # The statistics used by the query planner.
+        db.execute('ANALYZE')
+        ids = [row[0] for row in db.execute('SELECT id FROM post WHERE author_id = 1 ORDER BY id LIMIT ?', (reserved,))]
+    return ids
+
+
+_WORDS = (
+    'lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore et dolore magna aliqua '
+    'flask sqlite python request response template blueprint cursor index page cache worker'
+).split()
+
+
+# Drivers send the requests of a benchmark. Both keep the session cookie, so they can log in.
+# "TestClientDriver" uses the Flask test client: no network, so it measures the application alone.
+class TestClientDriver(object):
+    def __init__(self, app):
+        self._client = app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self._client.open(path, method=method, data=data)
+        # We read the whole body, as a real client would.
+        response.get_data()
+        return response.status_code
+
+
+# "HTTPDriver" talks HTTP to a real server, so the measures include the WSGI server, the sockets and the concurrency between clients.
+class HTTPDriver(object):
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.cookie = None
+
+    def request(self, method, path, data=None):
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        headers = {}
+        body = None
+        if data is not None:
+            body = urlencode(data)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            cookie = response.getheader('Set-Cookie')
+            if cookie:
+                self.cookie = cookie.split(';', 1)[0]
+            return response.status
+        finally:
+            conn.close()
+
+
+# Request handler of the benchmark server. Logging every request would measure the terminal instead of the application.
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+# Returns the request to make for each scenario, and the status expected. "ids" holds the posts of the first user that can be updated, and a queue with
+# the ones that can still be deleted.
+def _make_request(scenario, ids, counter):
+    if scenario == 'index' or scenario == 'index_logged_in':
+        return 'GET', '/', None, 200
+    if scenario == 'login':
+        return 'POST', '/auth/login', {'username': 'user0', 'password': PASSWORD}, 302
+    if scenario == 'create':
+        return 'POST', '/create', {'title': f'Created {counter}', 'body': 'benchmark body'}, 302
+    if scenario == 'update':
+        id = ids['update'][counter % len(ids['update'])]
+        return 'POST', f'/{id}/update', {'title': f'Updated {counter}', 'body': 'benchmark body'}, 302
+    if scenario == 'delete':
+        return 'POST', f'/{ids["delete"].get_nowait()}/delete', None, 302
+    raise ValueError(f'Unknown scenario {scenario!r}.')
+
+
+# Runs "count" requests of a scenario with "concurrency" clients, and returns the latency of each one in seconds and the total time.
+def run_scenario(scenario, make_driver, ids, count, concurrency, warmup):
+    lock = threading.Lock()
+    latencies = []
+    errors = []
+    counter = itertools.count()
+
+    def client(requests):
+        driver = make_driver()
+        # Every scenario except "index" and "login" needs a logged in user.
+        if scenario not in ('index', 'login'):
+            driver.request('POST', '/auth/login', {'username': 'user0', 'password': PASSWORD})
+        for i in range(warmup + requests):
+            with lock:
+                n = next(counter)
+            method, path, data, expected = _make_request(scenario, ids, n)
+            start = time.perf_counter()
+            status = driver.request(method, path, data)
+            elapsed = time.perf_counter() - start
+            if status != expected:
+                errors.append(f'{method} {path}: {status}')
+            if i >= warmup:
+                with lock:
+                    latencies.append(elapsed)
+
+    per_client = [count // concurrency + (1 if i < count % concurrency else 0) for i in range(concurrency)]
+    threads = [threading.Thread(target=client, args=(n,)) for n in per_client]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    total = time.perf_counter() - start
+
+    if errors:
+        raise click.ClickException(f'{scenario}: {len(errors)} unexpected responses, first: {errors[0]}')
+    return latencies, total
+
+
+# Summary of a list of latencies. Times are in milliseconds. The throughput includes the warmup requests of each client, so it is slightly conservative.
+def summarize(latencies, total):
+    latencies = sorted(latencies)
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(round(p / 100 * (len(latencies) - 1))))] * 1000
+
+    return {
+        'count': len(latencies),
+        'mean_ms': statistics.fmean(latencies) * 1000,
+        'p50_ms': percentile(50),
+        'p90_ms': percentile(90),
+        'p99_ms': percentile(99),
+        'max_ms': latencies[-1] * 1000,
+        'throughput_rps': len(latencies) / total if total else 0.0,
+    }
+
+
+# Runs the whole suite and returns the results as a dict ready to be saved to JSON.
+def run_benchmarks(posts, users, requests, warmup=5, concurrency=1, server=False, config=None, scenarios=SCENARIOS, database=None):
+    config = dict(config or {})
+    tmpdir = None
+    if database is None:
+        tmpdir = tempfile.TemporaryDirectory()
+        database = os.path.join(tmpdir.name, 'bench.sqlite')
+    # Every client logs in as the same user from the same address, so the login throttle is disabled unless it is enabled with "--config".
+    app = create_app({'TESTING': False, 'SECRET_KEY': 'bench', 'DATABASE': database, 'LOGIN_THROTTLE': None, **config})
+
+    # The first user must own enough posts for every update and delete, including the warmup ones.
+    reserved = min(posts, (requests + warmup * concurrency) * 2)
+    post_ids = seed(app, posts, users, reserved)
+    half = len(post_ids) // 2
+    ids = {'update': post_ids[:half], 'delete': queue.Queue()}
+    for id in post_ids[half:]:
+        ids['delete'].put(id)
+
+    httpd = None
+    if server:
+        # werkzeug's threaded server, listening on a free port of localhost.
+        httpd = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietRequestHandler)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+
+        def make_driver():
+            return HTTPDriver('127.0.0.1', httpd.server_port)
+    else:
+        concurrency = 1
+
+        def make_driver():
+            return TestClientDriver(app)
+
+    results = {}
+    try:
+        for scenario in scenarios:
+            latencies, total = run_scenario(scenario, make_driver, ids, requests, concurrency, warmup)
+            results[scenario] = summarize(latencies, total)
+    finally:
+        if httpd is not None:
+            httpd.shutdown()
+        if tmpdir is not None:
+            tmpdir.cleanup()
+
+    return {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'mode': 'server' if server else 'test-client',
+            'posts': posts,
+            'users': users,
+            'requests': requests,
+            'concurrency': concurrency,
+            'config': config,
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+        },
+        'results': results,
+    }
+
+
+# Pages requested by "first_request_latency". Together they render every template an anonymous visitor can see.
+FIRST_PAGES = ('/', '/auth/login', '/auth/register', '/search?q=flask', '/user/user0')
+
+# Ways of starting a worker compared by "first_request_latency": compiling the templates on first use, reading them from a bytecode cache filled by
+# "flask compile-templates", and reading them from the cache in "create_app" (TEMPLATE_WARMUP).
+FIRST_REQUEST_MODES = {
+    'compile': {'TEMPLATE_BYTECODE_CACHE': None},
+    'bytecode_cache': {},
+    'warmup': {'TEMPLATE_WARMUP': True},
+}
+
+
+# Measures what a new worker pays before its first responses: each run creates a new application, as a new process would, and requests every page of
+# FIRST_PAGES once. Returns, for each mode, the median time of "create_app" and of the first request of each page, in milliseconds.
+# Python modules stay imported between runs, so only the work of the application itself is measured (see "flask startup-report" for the imports).
+def first_request_latency(runs=10, posts=200, users=10):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        base = {
+            'TESTING': False, 'SECRET_KEY': 'bench', 'DATABASE': os.path.join(tmpdir, 'bench.sqlite'),
+            'TEMPLATE_BYTECODE_CACHE': os.path.join(tmpdir, 'jinja_cache'), 'PAGE_CACHE': None, 'LOGIN_THROTTLE': None,
+        }
+        app = create_app(base)
+        seed(app, posts, users)
+        # What "flask compile-templates" does at deploy time.
+        compile_templates(app)
+
+        for mode, config in FIRST_REQUEST_MODES.items():
+            startups = []
+            pages = {path: [] for path in FIRST_PAGES}
+            for _ in range(runs):
+                start = time.perf_counter()
+                app = create_app({**base, **config})
+                startups.append(time.perf_counter() - start)
+                driver = TestClientDriver(app)
+                for path in FIRST_PAGES:
+                    start = time.perf_counter()
+                    status = driver.request('GET', path)
+                    pages[path].append(time.perf_counter() - start)
+                    if status != 200:
+                        raise click.ClickException(f'GET {path}: {status}')
+                for readonly in (False, True):
+                    pool = get_pool(app, readonly)
+                    if pool is not None:
+                        pool.close()
+            first = {path: statistics.median(times) * 1000 for path, times in pages.items()}
+            results[mode] = {
+                'startup_ms': statistics.median(startups) * 1000,
+                'first_requests_ms': sum(first.values()),
+                'pages_ms': first,
+            }
+    return results
+
+
+# Compares two results. Returns a list of (scenario, baseline, current, change, regressed) tuples for the chosen metric. For latencies a higher value is
+# worse; for the throughput, a lower one.
+def compare_results(baseline, current, metric='p50_ms', threshold=0.1):
+    rows = []
+    for scenario, before in baseline['results'].items():
+        after = current['results'].get(scenario)
+        if after is None or not before[metric]:
+            continue
+        change = (after[metric] - before[metric]) / before[metric]
+        if metric == 'throughput_rps':
+            regressed = change < -threshold
+        else:
+            regressed = change > threshold
+        rows.append((scenario, before[metric], after[metric], change, regressed))
+    return rows
+
+
+def _parse_config(values):
+    config = {}
+    for value in values:
+        key, sep, raw = value.partition('=')
+        if not sep:
+            raise click.BadParameter(f'{value!r} is not KEY=VALUE.')
+        try:
+            config[key] = json.loads(raw)
+        except ValueError:
+            config[key] = raw
+    return config
+
+
+@click.group()
+def cli():
+    """Benchmarks of the flaskr endpoints."""
+
+
+@cli.command('run')
+@click.option('--posts', default=10000, show_default=True, help='Posts in the seeded database (10000, 100000, 1000000...).')
+@click.option('--users', default=100, show_default=True, help='Users in the seeded database.')
+@click.option('--requests', default=200, show_default=True, help='Measured requests per endpoint.')
+@click.option('--warmup', default=5, show_default=True, help='Requests per client made before measuring.')
+@click.option('--server', is_flag=True, help='Drive a real threaded WSGI server over HTTP instead of the test client.')
+@click.option('--concurrency', default=4, show_default=True, help='Concurrent clients (only with --server).')
+@click.option('--scenario', 'scenarios', multiple=True, type=click.Choice(SCENARIOS), help='Endpoints to measure (all by default).')
+@click.option('--config', 'config', multiple=True, help='Application setting as KEY=VALUE (JSON value).')
+@click.option('--database', type=click.Path(dir_okay=False), help='Database file to seed (a temporary one by default).')
+@click.option('--output', type=click.Path(dir_okay=False), help='File where the JSON results are written.')
+def run_command(posts, users, requests, warmup, server, concurrency, scenarios, config, database, output):
+    """Seed a database and measure the endpoints."""
+    results = run_benchmarks(
+        posts, users, requests, warmup=warmup, concurrency=concurrency, server=server,
+        config=_parse_config(config), scenarios=scenarios or SCENARIOS, database=database,
+    )
+    for scenario, summary in results['results'].items():
+        click.echo(
+            f'{scenario:<16} p50 {summary["p50_ms"]:8.2f} ms  p90 {summary["p90_ms"]:8.2f} ms  '
+            f'p99 {summary["p99_ms"]:8.2f} ms  {summary["throughput_rps"]:9.1f} req/s'
+        )
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+@cli.command('compare')
+@click.argument('baseline', type=click.File())
+@click.argument('current', type=click.File())
+@click.option('--metric', default='p50_ms', show_default=True,
+              type=click.Choice(('mean_ms', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms', 'throughput_rps')))
+@click.option('--threshold', default=0.1, show_default=True, help='Allowed relative change (0.1 = 10%).')
+def compare_command(baseline, current, metric, threshold):
+    """Compare two results and fail if any endpoint regressed past the threshold."""
+    rows = compare_results(json.load(baseline), json.load(current), metric, threshold)
+    regressions = 0
+    for scenario, before, after, change, regressed in rows:
+        regressions += regressed
+        click.echo(f'{scenario:<16} {before:10.2f} -> {after:10.2f} ({change:+.1%}){"  REGRESSION" if regressed else ""}')
+    if regressions:
+        click.echo(f'{regressions} regression(s) past {threshold:.0%} on {metric}.', err=True)
+        sys.exit(1)
+
+
+@cli.command('first-request')
+@click.option('--runs', default=10, show_default=True, help='New applications created for each mode.')
+@click.option('--output', type=click.Path(dir_okay=False), help='File where the JSON results are written.')
+def first_request_command(runs, output):
+    """Measure the first requests of a new worker, with and without the template bytecode cache."""
+    results = first_request_latency(runs)
+    compiled = results['compile']['first_requests_ms']
+    for mode, summary in results.items():
+        change = (summary['first_requests_ms'] - compiled) / compiled if compiled else 0.0
+        click.echo(
+            f'{mode:<16} create_app {summary["startup_ms"]:8.2f} ms  first requests {summary["first_requests_ms"]:8.2f} ms ({change:+.0%})'
+        )
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    cli()
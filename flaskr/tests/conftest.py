@@ -9,7 +9,7 @@ import tempfile
 
 import pytest
 from flaskr import create_app
-from flaskr.db import get_db, init_db
+from flaskr.db import get_db, get_pool, init_db
 
 # We read our sql file with the test data.
 with open(os.path.join(os.path.dirname(__file__), 'data.sql'), 'rb') as f:
@@ -27,9 +27,15 @@ with open(os.path.join(os.path.dirname(__file__), 'data.sql'), 'rb') as f:
     # Teardown logic can be easily and safely managed, not needing to carefully handle errors by hand or micromanage the order that cleanup steps are added.
 
 
+# Settings added to the test configuration. A test module can override this fixture to test a feature read when the application is created.
+@pytest.fixture
+def app_config():
+    return {}
+
+
 # Our app fixture will call the factory and pass test_config to configure the application and database for testing instead of using our local development configuration.
 @pytest.fixture
-def app():
+def app(app_config):
     # This creates and opens a temporary file, returning the file descriptor and path to it.
     db_fd, db_path = tempfile.mkstemp()
 
@@ -38,6 +44,9 @@ def app():
         'TESTING': True,
         # We override the original path to the DATABASE, so we use the temporary file.
         'DATABASE': db_path,
+        # The compiled templates are not saved, so the tests don't fill the "instance" folder of the project (see "test_templating").
+        'TEMPLATE_BYTECODE_CACHE': None,
+        **app_config,
     })
 
     with app.app_context():
@@ -49,6 +58,14 @@ def app():
     # In this case, that would mean that we are generating a new app, calling again the function would create another different one, and so on.
     yield app
 
+    # We stop the group commit writer and the replica (if they were used) and close the connections kept by the pools before removing the database file.
+    for name in ('flaskr.writer', 'flaskr.replicator'):
+        if name in app.extensions:
+            app.extensions[name].close()
+    for readonly in (False, True):
+        pool = get_pool(app, readonly)
+        if pool is not None:
+            pool.close()
     os.close(db_fd)
     os.unlink(db_path)
 
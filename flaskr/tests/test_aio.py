@@ -0,0 +1,45 @@
+# Tests over the async database layer.
+
+import asyncio
+import threading
+
+from flask import g
+from flaskr.aio import get_async_db
+from flaskr.db import get_db
+
+
+def test_async_db(app):
+    async def run():
+        db = await get_async_db()
+        # The same connection is returned during the request, and it wraps the one of "get_db".
+        assert await get_async_db() is db
+        assert db.connection is get_db()
+
+        cursor = await db.execute('SELECT title FROM post WHERE id = ?', (1,))
+        assert (await cursor.fetchone())['title'] == 'test title'
+        # The statements run in the thread of the connection, not in the one of the event loop.
+        assert await db.run(threading.current_thread) is not threading.current_thread()
+
+        cursor = await db.execute("UPDATE post SET title = 'async' WHERE id = 1")
+        assert cursor.rowcount == 1
+        await db.commit()
+        return db
+
+    with app.app_context():
+        db = asyncio.run(run())
+    # The threads are shared by the requests, and the connection is idle at the end of the context.
+    assert db._executor is app.extensions['flaskr.db_executor']
+    assert db._last.done()
+    with app.app_context():
+        assert get_db().execute('SELECT title FROM post WHERE id = 1').fetchone()[0] == 'async'
+
+
+def test_async_read_db(app):
+    async def run():
+        db = await get_async_db(readonly=True)
+        assert db.connection is g.read_db
+        cursor = await db.execute('SELECT COUNT(*) FROM user')
+        return (await cursor.fetchall())[0][0]
+
+    with app.app_context():
+        assert asyncio.run(run()) == 2
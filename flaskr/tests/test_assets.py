@@ -0,0 +1,71 @@
+# Tests over the fingerprinting of the static files.
+
+import gzip
+import os
+import shutil
+
+import pytest
+from flask import url_for
+from flaskr import assets
+
+
+@pytest.fixture
+def static_app(app, tmp_path):
+    # The files are built in a copy of "static", so the tests don't write in the package.
+    app.static_folder = str(shutil.copytree(app.static_folder, tmp_path / 'static'))
+    return app
+
+
+def test_build_assets(static_app, runner, client):
+    # Before the build, the files are served as usual.
+    with static_app.test_request_context():
+        assert url_for('static', filename='style.css') == '/static/style.css'
+
+    result = runner.invoke(args=['build-assets'])
+    assert 'Built 1 files' in result.output
+    with static_app.test_request_context():
+        url = url_for('static', filename='style.css')
+    assert url.startswith('/static/dist/style.') and url.endswith('.css')
+    assert url.encode() in client.get('/').data
+
+    with open(static_app.static_folder + '/style.css', 'rb') as f:
+        original = f.read()
+    response = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.mimetype == 'text/css'
+    assert 'immutable' in response.headers['Cache-Control']
+    assert 'Accept-Encoding' in response.vary
+    assert gzip.decompress(response.data) == original
+
+    response = client.get(url, headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in response.headers
+    assert response.data == original
+    # An encoding with a quality of 0 is refused.
+    response = client.get(url, headers={'Accept-Encoding': 'gzip;q=0, br;q=0'})
+    assert 'Content-Encoding' not in response.headers
+
+
+def test_brotli(static_app, client):
+    brotli = pytest.importorskip('brotli')
+    assets.build_assets(static_app.static_folder)
+    assets.load_manifest(static_app)
+    with static_app.test_request_context():
+        url = url_for('static', filename='style.css')
+
+    response = client.get(url, headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert brotli.decompress(response.data) == client.get('/static/style.css').data
+
+
+# A new version of a file gets a new URL, and the old files are only removed with "--clean".
+def test_rebuild(static_app, runner):
+    manifest = assets.build_assets(static_app.static_folder)
+    old = static_app.static_folder + '/' + manifest['style.css']['path']
+    with open(static_app.static_folder + '/style.css', 'a') as f:
+        f.write('\nbody { color: red; }\n')
+
+    manifest = assets.build_assets(static_app.static_folder)
+    assert static_app.static_folder + '/' + manifest['style.css']['path'] != old
+    assert os.path.exists(old)
+    assets.build_assets(static_app.static_folder, clean=True)
+    assert not os.path.exists(old)
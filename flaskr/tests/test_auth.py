@@ -2,6 +2,7 @@
 
 import pytest
 from flask import g, session
+from flaskr.auth import get_user_cache
 from flaskr.db import get_db
 
 
@@ -67,4 +68,41 @@ def test_logout(client, auth):
 
     with client:
         auth.logout()
-        assert 'user_id' not in session
\ No newline at end of file
+        assert 'user_id' not in session
+
+
+# The logged in user is read from the database once and then served from the cache.
+def test_user_cache(client, auth, app):
+    auth.login()
+    client.get('/')
+    client.get('/')
+
+    with app.app_context():
+        stats = get_user_cache().stats()
+        # We change the username behind the back of the cache.
+        db = get_db()
+        db.execute("UPDATE user SET username = 'renamed' WHERE id = 1")
+        db.commit()
+    assert stats['misses'] == 1
+    assert stats['hits'] == 1
+    assert b'<span>renamed</span>' not in client.get('/').data
+
+    # Once the entry is removed (as "invalidate_user" does), the new row is loaded.
+    with app.app_context():
+        get_user_cache().clear()
+    assert b'<span>renamed</span>' in client.get('/').data
+
+
+# In lazy mode, "g.user" is only loaded when somebody reads it.
+def test_load_user_lazily(client, auth, app):
+    app.config['LOAD_USER_LAZILY'] = True
+    auth.login()
+
+    with client:
+        client.get('/auth/logout')
+        assert 'user' not in g.__dict__
+
+    auth.login()
+    with client:
+        client.get('/')
+        assert g.user['username'] == 'test'
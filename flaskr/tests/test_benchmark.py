@@ -0,0 +1,40 @@
+# Smoke tests over the benchmark suite, so it keeps working as the application changes. The real runs are made with "benchmark.py run".
+
+import json
+
+import pytest
+from click.testing import CliRunner
+from benchmark import FIRST_REQUEST_MODES, SCENARIOS, cli, compare_results, first_request_latency, run_benchmarks
+
+
+@pytest.mark.parametrize('server', (False, True))
+def test_run_benchmarks(server):
+    results = run_benchmarks(
+        posts=50, users=3, requests=4, warmup=1, concurrency=2, server=server, config={'TEMPLATE_BYTECODE_CACHE': None}
+    )
+    assert results['meta']['mode'] == ('server' if server else 'test-client')
+    assert list(results['results']) == list(SCENARIOS)
+    for summary in results['results'].values():
+        assert summary['count'] == 4
+        assert summary['p50_ms'] <= summary['p99_ms'] <= summary['max_ms']
+
+
+def test_compare(tmp_path):
+    baseline = {'results': {'index': {'p50_ms': 10.0}, 'login': {'p50_ms': 10.0}}}
+    current = {'results': {'index': {'p50_ms': 10.5}, 'login': {'p50_ms': 12.0}}}
+    rows = compare_results(baseline, current, threshold=0.1)
+    assert [(row[0], row[4]) for row in rows] == [('index', False), ('login', True)]
+
+    # The "compare" command fails when there is a regression.
+    (tmp_path / 'baseline.json').write_text(json.dumps(baseline))
+    (tmp_path / 'current.json').write_text(json.dumps(current))
+    result = CliRunner().invoke(cli, ['compare', str(tmp_path / 'baseline.json'), str(tmp_path / 'current.json')])
+    assert result.exit_code == 1
+    assert 'login' in result.output and 'REGRESSION' in result.output
+
+
+def test_first_request_latency():
+    results = first_request_latency(runs=1, posts=10, users=2)
+    assert list(results) == list(FIRST_REQUEST_MODES)
+    for summary in results.values():
+        assert summary['first_requests_ms'] == sum(summary['pages_ms'].values())
@@ -1,5 +1,7 @@
 
 
+import hashlib
+
 import pytest
 from flaskr.db import get_db
 
@@ -90,3 +92,180 @@ def test_create_update_validate(client, auth, path):
     response = client.post(path, data={'title': '', 'body': ''})
     assert b'Title is required.' in response.data
 
+
+
+# Small helper to read the URL of a pagination link ("older" or "newer") from the rendered index.
+def _link(response, name):
+    marker = f'class="{name}" href="'.encode()
+    if marker not in response.data:
+        return None
+    return response.data.split(marker)[1].split(b'"')[0].decode()
+
+
+# We create several posts and check that the index only shows one page at a time, and that the "older"/"newer" links walk through all of them.
+def test_index_pagination(app, client):
+    app.config['POSTS_PER_PAGE'] = 2
+    with app.app_context():
+        db = get_db()
+        for i in range(2, 6):
+            db.execute(
+                'INSERT INTO post (title, body, author_id, created)'
+                ' VALUES (?, ?, 1, ?)',
+                (f'post {i}', '', f'2018-01-0{i} 00:00:00')
+            )
+        db.commit()
+
+    response = client.get('/')
+    assert b'post 5' in response.data
+    assert b'post 4' in response.data
+    assert b'post 3' not in response.data
+    assert _link(response, 'newer') is None
+
+    # We follow the "older" links until the last page.
+    titles = (b'post 5', b'post 4', b'post 3', b'post 2', b'test title')
+    seen = [t for t in titles if t in response.data]
+    while _link(response, 'older') is not None:
+        response = client.get(_link(response, 'older'))
+        seen.extend(t for t in titles if t in response.data)
+    assert seen == list(titles)
+
+    # From the last page, the "newer" link takes us back to the previous one.
+    response = client.get(_link(response, 'newer'))
+    assert b'post 3' in response.data
+    assert b'post 2' in response.data
+    assert b'post 4' not in response.data
+
+
+def test_index_invalid_cursor(client):
+    assert client.get('/?before=not-a-cursor').status_code == 400
+
+
+# A client sending back the ETag of the index receives 304 until a post changes.
+def test_index_conditional(client, auth, app):
+    response = client.get('/')
+    etag = response.headers['ETag']
+    last_modified = response.headers['Last-Modified']
+
+    response = client.get('/', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert client.get('/', headers={'If-Modified-Since': last_modified}).status_code == 304
+
+    # The triggers of the post table change the version on every write.
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE post SET title = 'changed' WHERE id = 1")
+        db.commit()
+    assert client.get('/', headers={'If-None-Match': etag}).status_code == 200
+
+    # The page of a logged in user has a different ETag.
+    auth.login()
+    assert client.get('/').headers['ETag'] != etag
+
+
+def test_update_conditional(client, auth):
+    auth.login()
+    etag = client.get('/1/update').headers['ETag']
+    assert client.get('/1/update', headers={'If-None-Match': etag}).status_code == 304
+
+    client.post('/1/update', data={'title': 'updated', 'body': ''})
+    assert client.get('/1/update', headers={'If-None-Match': etag}).status_code == 200
+
+
+# The author check runs before the ETag is compared, so another user gets 403 and can't learn whether the post changed.
+def test_update_conditional_forbidden(app, client, auth):
+    auth.login('other', 'other')
+    with app.app_context():
+        version = get_db().execute('SELECT version FROM post_version').fetchone()[0]
+    # The ETag the page would have for this user (see "conditional").
+    etag = hashlib.sha1(f'{version}:2:/1/update?'.encode('utf8')).hexdigest()
+    assert client.get('/1/update', headers={'If-None-Match': f'"{etag}"'}).status_code == 403
+
+
+# With STREAM_TEMPLATES, the index is sent in chunks and contains the same posts and links as the normal one.
+def test_index_streamed(app, client):
+    app.config['POSTS_PER_PAGE'] = 1
+    app.config['STREAM_BUFFER_SIZE'] = 2
+    with app.app_context():
+        db = get_db()
+        db.execute("INSERT INTO post (title, body, author_id) VALUES ('newest', '', 1)")
+        db.commit()
+
+    normal = client.get('/?v=normal')
+    app.config['STREAM_TEMPLATES'] = True
+    response = client.get('/?v=streamed')
+    assert response.is_streamed
+    assert b'newest' in response.data
+    # Reading "data" keeps the list of chunks sent by the generator.
+    assert len(response.response) > 1
+    assert b'test title' not in response.data
+    assert _link(response, 'older') is not None
+    assert _link(response, 'older') == _link(normal, 'older')
+
+
+def test_delete(client, auth, app):
+    auth.login()
+    response = client.post('/1/delete')
+    assert response.headers['Location'].endswith('/')
+
+    with app.app_context():
+        db = get_db()
+        post = db.execute('SELECT * FROM post WHERE id = 1').fetchone()
+        assert post is None
+
+
+# The bulk delete removes only the posts of the logged in user, and reports how many were deleted.
+def test_delete_many(client, auth, app):
+    with app.app_context():
+        db = get_db()
+        db.executemany(
+            'INSERT INTO post (title, body, author_id) VALUES (?, ?, ?)',
+            [('mine', '', 1), ('mine', '', 1), ('theirs', '', 2)]
+        )
+        db.commit()
+
+    auth.login()
+    response = client.post('/delete', json={'ids': [1, 2, 4, 99]})
+    assert response.get_json() == {'requested': 4, 'deleted': 2}
+
+    response = client.post('/delete', data={'id': ['3', '4']})
+    assert response.status_code == 302
+
+    with app.app_context():
+        titles = [row['title'] for row in get_db().execute('SELECT title FROM post')]
+        assert titles == ['theirs']
+
+    assert client.post('/delete', json={'ids': ['x']}).status_code == 400
+    assert client.post('/delete', json={'ids': [True]}).status_code == 400
+    assert client.post('/delete', json={'ids': [1.9]}).status_code == 400
+    assert client.post('/delete', json={'ids': ['1']}).status_code == 400
+    assert client.post('/delete', data={'id': ['x']}).status_code == 400
+    assert client.post('/delete', json=[1, 2]).status_code == 400
+    assert client.post('/delete', json={'ids': 3}).status_code == 400
+    assert client.post('/delete', data='{', content_type='application/json').status_code == 400
+
+
+# The page of an author lists only their posts, and the counters of the header follow the inserts and deletes.
+def test_user_page(client, app):
+    app.config['POSTS_PER_PAGE'] = 2
+    with app.app_context():
+        db = get_db()
+        db.executemany(
+            'INSERT INTO post (title, body, author_id, created) VALUES (?, ?, ?, ?)',
+            [(f'mine {i}', '', 1, f'2019-01-0{i} 00:00:00') for i in range(1, 4)] + [('theirs', '', 2, '2019-02-01 00:00:00')]
+        )
+        db.execute("DELETE FROM post WHERE title = 'mine 3'")
+        db.commit()
+        user = db.execute('SELECT post_count, last_post_at FROM user WHERE id = 1').fetchone()
+        assert (user['post_count'], str(user['last_post_at'])) == (3, '2019-01-02 00:00:00')
+
+    response = client.get('/user/test')
+    assert b'3 posts, the last one on 2019-01-02' in response.data
+    assert b'mine 2' in response.data and b'mine 1' in response.data
+    assert b'theirs' not in response.data and b'test title' not in response.data
+
+    older = response.data.split(b'class="older" href="')[1].split(b'"')[0].replace(b'&amp;', b'&')
+    response = client.get(older.decode())
+    assert b'test title' in response.data and b'mine 1' not in response.data
+
+    assert client.get('/user/nobody').status_code == 404
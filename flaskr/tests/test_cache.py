@@ -0,0 +1,36 @@
+# Tests over the in-process cache.
+
+from flaskr.cache import TTLCache
+
+
+# When the cache is full, the least recently used entry is removed.
+def test_lru_eviction():
+    cache = TTLCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    # Reading "a" makes "b" the least recently used entry.
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.stats()['evictions'] == 1
+
+
+# Entries are not returned after their TTL.
+def test_ttl_expiration(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('flaskr.cache.time.monotonic', lambda: now[0])
+    cache = TTLCache(ttl=10)
+    cache.set('a', 1)
+
+    now[0] += 5
+    assert cache.get('a') == 1
+    now[0] += 5
+    assert cache.get('a') is None
+
+    stats = cache.stats()
+    assert stats['hits'] == 1
+    assert stats['misses'] == 1
+    assert stats['expirations'] == 1
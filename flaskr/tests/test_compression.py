@@ -0,0 +1,93 @@
+# Tests over the compression of the responses.
+
+import gzip
+import zlib
+
+import pytest
+from flaskr.compression import get_compression_stats, negotiate
+
+
+@pytest.mark.parametrize(('accept', 'expected'), (
+    ('gzip', 'gzip'),
+    ('gzip, br', 'br'),
+    ('br;q=0.5, gzip', 'gzip'),
+    ('identity', None),
+    ('', None),
+))
+def test_negotiate(accept, expected):
+    # brotli is optional, and only offered when it is installed.
+    if expected == 'br':
+        pytest.importorskip('brotli')
+    assert negotiate(accept, ('br', 'zstd', 'gzip')) == expected
+
+
+def test_compressed_page(app, client):
+    app.config['PAGE_CACHE'] = None
+    plain = client.get('/')
+    assert 'Content-Encoding' not in plain.headers
+    assert 'Accept-Encoding' in plain.vary
+
+    response = client.get('/', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert int(response.headers['Content-Length']) == len(response.data)
+    assert gzip.decompress(response.data) == plain.data
+    # The ETag becomes weak, and still gives a 304.
+    etag = response.headers['ETag']
+    assert etag.startswith('W/')
+    assert client.get('/', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag}).status_code == 304
+
+    stats = get_compression_stats(app).stats()
+    assert stats['encodings']['gzip']['responses'] == 1
+    assert stats['encodings']['gzip']['ratio'] < 1
+    assert stats['skipped']['accept'] == 1
+
+
+# Only run when the optional brotli package is installed.
+def test_brotli_page(app, client):
+    brotli = pytest.importorskip('brotli')
+    app.config['PAGE_CACHE'] = None
+    plain = client.get('/')
+    response = client.get('/', headers={'Accept-Encoding': 'br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert brotli.decompress(response.data) == plain.data
+
+
+# Tiny responses and the ones already compressed are sent as they are.
+def test_skipped(app, client):
+    @app.route('/encoded')
+    def encoded():
+        return gzip.compress(b'x' * 1000), {'Content-Encoding': 'gzip', 'Content-Type': 'text/plain'}
+
+    assert 'Content-Encoding' not in client.get('/hello', headers={'Accept-Encoding': 'gzip'}).headers
+    response = client.get('/encoded', headers={'Accept-Encoding': 'br'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.data) == b'x' * 1000
+    assert get_compression_stats(app).stats()['skipped'] == {'size': 1, 'encoded': 1}
+
+
+# The cached pages are compressed once, and the compressed version is served from the cache afterwards.
+def test_cached_page(app, client):
+    first = client.get('/', headers={'Accept-Encoding': 'gzip'})
+    second = client.get('/', headers={'Accept-Encoding': 'gzip'})
+    assert second.headers['X-Page-Cache'] == 'hit'
+    assert second.data == first.data
+
+    stats = get_compression_stats(app).stats()
+    assert stats['encodings']['gzip']['responses'] == 1
+    assert stats['cached'] == 1
+
+
+# Streamed pages are compressed chunk by chunk: the first chunk can be decompressed before the rest arrives.
+def test_streamed_page(app, client):
+    app.config['STREAM_TEMPLATES'] = True
+    app.config['STREAM_BUFFER_SIZE'] = 2
+    plain = client.get('/?v=plain').data
+
+    response = client.get('/?v=gzip', headers={'Accept-Encoding': 'gzip'}, buffered=False)
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Length' not in response.headers
+    decoder = zlib.decompressobj(31)
+    chunks = [decoder.decompress(chunk) for chunk in response.response]
+    response.close()
+    assert len(chunks) > 2 and chunks[0]
+    assert b''.join(chunks) == plain
@@ -2,11 +2,18 @@
 
 import sqlite3
 
+import threading
+import time
+
 import pytest
-from flaskr.db import get_db
+from flaskr import queries
+from flaskr.db import ConnectionPool, PoolTimeout, connect, get_db, get_pool, get_read_db
+from flaskr.replica import Replicator, get_replicator
 
 
 def test_get_close_db(app):
+    # Without a pool, the connection is opened for the request and closed at the end of it.
+    app.config['DATABASE_POOL_SIZE'] = 0
     # "app._context" allows us to work over an application, even when we have not generated one.
     with app.app_context():
         db = get_db()
@@ -18,6 +25,48 @@ def test_get_close_db(app):
 
     assert 'closed' in str(e.value)
 
+# With the pool enabled (the default), the connection is not closed but returned to the pool, and the next request receives the same one.
+def test_pool_reuses_connection(app):
+    # The fixture already used the pool, so we compare with its counters from here on.
+    before = get_pool(app).stats()
+    with app.app_context():
+        db = get_db()
+        # We leave a transaction open, as a request that failed before committing.
+        db.execute("INSERT INTO user (username, password) VALUES ('dirty', '')")
+
+    with app.app_context():
+        assert get_db() is db
+        # The pool rolled back the changes of the previous request.
+        assert db.execute("SELECT * FROM user WHERE username = 'dirty'").fetchone() is None
+        stats = get_pool().stats()
+
+    # One checkout per context, and no new connection.
+    assert stats['checkouts'] - before['checkouts'] == 2
+    assert stats['created'] == before['created']
+    assert stats['in_use'] == 1
+
+
+# When every connection is in use, "acquire" waits for one to be returned, and gives up with "PoolTimeout" after the timeout.
+def test_pool_bounded(app):
+    with app.app_context():
+        pool = ConnectionPool(lambda: connect(app), size=1, timeout=0.01)
+
+    db = pool.acquire()
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+
+    # A connection returned by another thread wakes up the waiting one.
+    pool.timeout = 5
+    threading.Timer(0.05, pool.release, (db,)).start()
+    assert pool.acquire() is db
+
+    stats = pool.stats()
+    assert stats['waits'] == 2
+    assert stats['timeouts'] == 1
+    assert stats['open'] == 1
+    pool.close()
+
+
 # init-db command should call the init_db function and output a message.
 def test_init_db_command(runner, monkeypatch):
     # We define a class to control when has the object been called or not.
@@ -36,3 +85,139 @@ def test_init_db_command(runner, monkeypatch):
     assert 'Initialized' in result.output
     assert Recorder.called
 
+
+# Every new connection receives the PRAGMA profile: the defaults plus the DATABASE_PRAGMAS setting.
+def test_pragmas(app):
+    app.config['DATABASE_PRAGMAS'] = {'synchronous': 'full', 'mmap_size': None}
+    with app.app_context():
+        db = connect()
+        assert db.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert db.execute('PRAGMA busy_timeout').fetchone()[0] == 5000
+        assert db.execute('PRAGMA synchronous').fetchone()[0] == 2
+        assert db.execute('PRAGMA mmap_size').fetchone()[0] == 0
+        db.close()
+
+
+def test_invalid_pragma(app):
+    app.config['DATABASE_PRAGMAS'] = {'cache_size': '1; DROP TABLE post'}
+    with app.app_context():
+        with pytest.raises(ValueError):
+            connect()
+
+
+def test_db_pragmas_command(runner):
+    result = runner.invoke(args=['db-pragmas'])
+    assert 'journal_mode = wal' in result.output
+    assert 'synchronous = normal' in result.output
+    assert 'temp_store = memory' in result.output
+
+
+# Every statement of the registry must compile against the schema: a typo would otherwise only show up when its view is used.
+def test_queries_compile(app):
+    statements = [value for name, value in vars(queries).items() if name.isupper() and isinstance(value, str)]
+    with app.app_context():
+        db = get_db()
+        for sql in statements:
+            db.execute(f'EXPLAIN {sql}', (None,) * sql.count('?'))
+
+
+# Warming up an uninitialized database (no tables yet) must not prevent the connection from opening.
+def test_warm_up_empty_database(app, tmp_path):
+    app.config['DATABASE'] = str(tmp_path / 'empty.sqlite')
+    with app.app_context():
+        db = connect()
+        assert db.execute('SELECT 1').fetchone()[0] == 1
+        db.close()
+
+
+# The read-only views get their own connection, which can't write.
+def test_read_db(app):
+    with app.app_context():
+        db = get_read_db()
+        assert db is not get_db()
+        assert db.execute('PRAGMA query_only').fetchone()[0] == 1
+        with pytest.raises(sqlite3.OperationalError, match='readonly'):
+            db.execute("UPDATE post SET title = 'x'")
+
+    # Without routing, every view shares the write connection.
+    app.config['DATABASE_READ_ROUTING'] = False
+    with app.app_context():
+        assert get_read_db() is get_db()
+
+
+# With a replica, the readers see the changes once the replica has been refreshed.
+def test_replica(app, client, runner, tmp_path):
+    app.config['DATABASE_REPLICA'] = str(tmp_path / 'replica.sqlite')
+    # The thread must not refresh the replica during the test.
+    app.config['DATABASE_REPLICA_INTERVAL'] = 3600
+    app.config['PAGE_CACHE'] = None
+    # The first copy is made before the requests, so they never wait for it.
+    assert 'Replica updated' in runner.invoke(args=['sync-replica']).output
+    assert b'test title' in client.get('/').data
+
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE post SET title = 'replicated' WHERE id = 1")
+        db.commit()
+    assert b'replicated' not in client.get('/').data
+
+    replicator = get_replicator(app)
+    assert replicator.sync()
+    assert b'replicated' in client.get('/').data
+    # Nothing changed since the last copy. The copy of "sync-replica" was made by its own replicator.
+    assert not replicator.sync()
+    assert replicator.stats()['copies'] == 1
+
+    # Only one process refreshes the replica.
+    assert replicator.acquire()
+    other = Replicator(app.config['DATABASE'], app.config['DATABASE_REPLICA'])
+    assert not other.acquire()
+    replicator.close()
+    assert other.acquire()
+    other.close()
+
+
+# The read-only connections opened before the first copy, on the main file, are replaced by ones reading the replica once it exists.
+def test_replica_first_copy(app, client, tmp_path):
+    app.config['DATABASE_REPLICA'] = str(tmp_path / 'replica.sqlite')
+    app.config['DATABASE_REPLICA_INTERVAL'] = 3600
+    app.config['PAGE_CACHE'] = None
+    # Without a replica, the thread makes the first copy as soon as it starts.
+    assert b'test title' in client.get('/').data
+    replicator = get_replicator(app)
+    deadline = time.monotonic() + 5
+    while replicator.stats()['copies'] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE post SET title = 'replicated' WHERE id = 1")
+        db.commit()
+    assert b'replicated' not in client.get('/').data
+
+
+# The pool closes the connections opened before "drain", the idle ones at once and the others when they are returned.
+def test_pool_drain(app):
+    pool = ConnectionPool(lambda: connect(app), size=2)
+    idle, in_use = pool.acquire(), pool.acquire()
+    pool.release(idle)
+    pool.drain()
+    pool.release(in_use)
+    assert pool.stats()['open'] == 0 and pool.stats()['discarded'] == 2
+    assert pool.acquire() not in (idle, in_use)
+    pool.close()
+
+
+# After writing, a user reads the main file until the replica has their changes.
+def test_replica_read_your_writes(app, client, auth, runner, tmp_path):
+    app.config['DATABASE_REPLICA'] = str(tmp_path / 'replica.sqlite')
+    app.config['DATABASE_REPLICA_INTERVAL'] = 3600
+    app.config['PAGE_CACHE'] = None
+    runner.invoke(args=['sync-replica'])
+    assert b'test title' in client.get('/').data
+
+    auth.login()
+    client.post('/1/update', data={'title': 'mine', 'body': ''})
+    assert b'mine' in client.get('/').data
+    # Other users still read the replica.
+    assert b'mine' not in app.test_client().get('/').data
@@ -0,0 +1,74 @@
+# Tests over the password hashing executor.
+
+import threading
+
+import pytest
+from werkzeug.exceptions import ServiceUnavailable
+from flaskr.db import get_db
+from flaskr.hashing import Hasher, get_hasher
+
+
+@pytest.mark.parametrize('executor', ('thread', None))
+def test_hash_and_check(executor):
+    hasher = Hasher(executor=executor, method='pbkdf2:sha256:1000')
+    pwhash = hasher.hash('secret')
+    assert hasher.check(pwhash, 'secret')
+    assert not hasher.check(pwhash, 'other')
+    assert not hasher.needs_rehash(pwhash)
+    assert hasher.needs_rehash('pbkdf2:sha256:50000$salt$hash')
+
+    stats = hasher.stats()
+    assert stats['completed'] == 3
+    assert stats['pending'] == 0
+    hasher.shutdown()
+
+
+# When every place of the queue is taken, new jobs are rejected at once with a 503 and "Retry-After".
+def test_hasher_saturated(monkeypatch):
+    release = threading.Event()
+    started = threading.Event()
+
+    def slow_hash(password, method):
+        started.set()
+        release.wait(5)
+        return 'hash'
+
+    monkeypatch.setattr('flaskr.hashing.generate_password_hash', slow_hash)
+    hasher = Hasher(workers=1, queue_size=1, retry_after=3)
+    thread = threading.Thread(target=hasher.hash, args=('a',))
+    thread.start()
+    started.wait(5)
+
+    with pytest.raises(ServiceUnavailable) as e:
+        hasher.hash('b')
+    assert e.value.get_response().headers['Retry-After'] == '3'
+    assert hasher.stats()['rejected'] == 1
+    assert hasher.stats()['pending'] == 1
+
+    release.set()
+    thread.join()
+    hasher.shutdown()
+
+
+# The test users have old pbkdf2 hashes. After a successful login, the hash is replaced with one made with the current method.
+def test_rehash_on_login(app, auth):
+    auth.login()
+    with app.app_context():
+        pwhash = get_db().execute('SELECT password FROM user WHERE id = 1').fetchone()[0]
+        assert pwhash.startswith('scrypt:')
+        assert not get_hasher().needs_rehash(pwhash)
+
+    # The new hash keeps working.
+    assert auth.login().status_code == 302
+
+
+# When the hasher is busy, the login succeeds and keeps the old hash.
+def test_rehash_skipped_when_busy(app, auth, monkeypatch):
+    async def busy(password):
+        raise ServiceUnavailable()
+
+    monkeypatch.setattr('flaskr.hashing.hash_password_async', busy)
+    assert auth.login().status_code == 302
+    with app.app_context():
+        pwhash = get_db().execute('SELECT password FROM user WHERE id = 1').fetchone()[0]
+        assert get_hasher().needs_rehash(pwhash)
@@ -0,0 +1,64 @@
+# Tests over the maintenance commands.
+
+import sqlite3
+
+from flaskr.db import close_db, get_db
+
+
+def test_backup(runner, tmp_path):
+    destination = tmp_path / 'backup.sqlite'
+    result = runner.invoke(args=['backup', str(destination), '--pages', '1', '--sleep', '0'])
+    assert 'Copied' in result.output and 'longest pause' in result.output
+
+    copy = sqlite3.connect(destination)
+    assert copy.execute('SELECT title FROM post').fetchone()[0] == 'test title'
+    copy.close()
+
+
+def test_vacuum(app, runner):
+    with app.app_context():
+        db = get_db()
+        # "init-db" creates the database with incremental auto_vacuum.
+        assert db.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+        db.execute("INSERT INTO post (title, body, author_id) SELECT 'bulk', randomblob(2000), 1 FROM post_fts_data, post_fts_data")
+        db.execute("DELETE FROM post WHERE title = 'bulk'")
+        db.commit()
+        assert db.execute('PRAGMA freelist_count').fetchone()[0] > 0
+
+    result = runner.invoke(args=['vacuum', '--pages', '2', '--sleep', '0'])
+    assert 'Freed' in result.output and 'File size' in result.output
+    with app.app_context():
+        assert get_db().execute('PRAGMA freelist_count').fetchone()[0] == 0
+
+
+def test_optimize_and_checkpoint(runner):
+    assert 'Statistics refreshed' in runner.invoke(args=['optimize', '--analyze']).output
+    result = runner.invoke(args=['checkpoint', '--mode', 'truncate'])
+    assert 'Checkpointed' in result.output and 'WAL size' in result.output
+
+
+# "PRAGMA optimize" runs at the end of a request once the interval has passed.
+def test_scheduled_optimize(app, client):
+    app.config['DATABASE_OPTIMIZE_INTERVAL'] = 1
+    # The clock was started by the first use of the write connection (the test data).
+    last = app.extensions['flaskr.optimized'] - 2
+    app.extensions['flaskr.optimized'] = last
+    # Only the requests using the write connection run it.
+    client.get('/')
+    assert app.extensions['flaskr.optimized'] == last
+    client.post('/auth/login', data={'username': 'test', 'password': 'test'})
+    assert app.extensions['flaskr.optimized'] > last
+
+
+# A failing "PRAGMA optimize" is logged, and the connection is still released.
+def test_optimize_failure(app, caplog):
+    app.config['DATABASE_OPTIMIZE_INTERVAL'] = 1
+    with app.test_request_context():
+        db = get_db()
+        app.extensions['flaskr.optimized'] -= 2
+        db.set_authorizer(lambda action, *args: sqlite3.SQLITE_DENY if action == sqlite3.SQLITE_PRAGMA else sqlite3.SQLITE_OK)
+        close_db()
+        db.set_authorizer(None)
+    assert 'PRAGMA optimize failed' in caplog.text
+    with app.app_context():
+        assert get_db().execute('SELECT COUNT(*) FROM post').fetchone()[0] == 1
@@ -0,0 +1,96 @@
+# Tests over the metrics of the requests.
+
+import os
+
+import pytest
+from flask import render_template_string
+from flaskr import create_app
+from flaskr.metrics import _number, collect, get_store
+
+
+# The metrics are disabled by default, and installed when the application is created.
+@pytest.fixture
+def app_config():
+    return {'METRICS': True}
+
+
+def _value(output, line):
+    for row in output.splitlines():
+        if row.startswith(line + ' '):
+            return float(row.rsplit(' ', 1)[1])
+    return None
+
+
+# The requests are recorded when the server closes the response: "buffered" makes the test client read and close it, as a server would.
+def test_metrics(app, client):
+    app.config['SQL_PROFILE_SAMPLE_RATE'] = 1
+    client.get('/', buffered=True)
+    client.get('/', buffered=True)
+    client.get('/missing', buffered=True)
+    response = client.get('/metrics')
+    assert response.mimetype == 'text/plain'
+    output = response.get_data(as_text=True)
+
+    assert _value(output, 'flaskr_requests_total{endpoint="blog.index",status="2xx"}') == 2
+    assert _value(output, 'flaskr_requests_total{endpoint="none",status="4xx"}') == 1
+    # The request for "/metrics" is still being answered.
+    assert _value(output, 'flaskr_requests_in_flight{endpoint="metrics"}') == 1
+    assert _value(output, 'flaskr_request_duration_seconds_count{endpoint="blog.index"}') == 2
+    assert _value(output, 'flaskr_request_duration_seconds_bucket{endpoint="blog.index",le="+Inf"}') == 2
+    assert _value(output, 'flaskr_db_duration_seconds_count{endpoint="blog.index"}') == 2
+    # The second visit is served by the page cache, so only the first one renders the template.
+    assert _value(output, 'flaskr_template_duration_seconds_sum{endpoint="blog.index"}') > 0
+    assert _value(output, 'flaskr_response_size_bytes_sum{endpoint="blog.index"}') == 2 * len(client.get('/').data)
+    assert _value(output, 'flaskr_page_cache_hits') == 1
+
+
+# Each process writes its own file, and "/metrics" adds them up. The requests in flight of a finished process are not counted.
+def test_multiprocess(app, client, tmp_path):
+    app.config['METRICS_MULTIPROCESS_DIR'] = str(tmp_path)
+    client.get('/', buffered=True)
+
+    pid = os.fork()
+    if pid == 0:
+        store = get_store(app)
+        store.started('blog.index')
+        store.finished('blog.index', 200, (0.01, 0.0, None, 1000))
+        store.started('blog.index')
+        os._exit(0)
+    os.waitpid(pid, 0)
+
+    assert len(list(tmp_path.iterdir())) == 2
+    output = client.get('/metrics').get_data(as_text=True)
+    assert _value(output, 'flaskr_requests_total{endpoint="blog.index",status="2xx"}') == 2
+    assert _value(output, 'flaskr_requests_in_flight{endpoint="blog.index"}') == 0
+
+
+def test_disabled_by_default():
+    app = create_app({'TESTING': True, 'TEMPLATE_BYTECODE_CACHE': None})
+    assert app.test_client().get('/metrics').status_code == 404
+
+
+def test_token(app, client):
+    app.config['METRICS_TOKEN'] = 'secret'
+    assert client.get('/metrics').status_code == 403
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 403
+    response = client.get('/metrics', headers={'Authorization': 'Bearer secret'})
+    assert response.status_code == 200 and 'flaskr_requests_total' in response.get_data(as_text=True)
+
+
+def test_recording(app, client):
+    client.get('/hello')
+    store = get_store(app)
+    for _ in range(3):
+        store.started('blog.index')
+        store.finished('blog.index', 200, (0.003, 0.001, None, 5000))
+    assert collect(app)[store.layout.index['blog.index'] * store.layout.stride + 1] == 3
+
+
+def test_special_values():
+    assert [_number(value) for value in (float('nan'), float('inf'), float('-inf'), 2.0, 0.5)] == ['NaN', '+Inf', '-Inf', '2', '0.5']
+
+
+# Rendering a template outside of a request (a command, the warm up...) isn't measured, and doesn't fail.
+def test_template_outside_request(app):
+    with app.app_context():
+        assert render_template_string('{{ 1 + 1 }}') == '2'
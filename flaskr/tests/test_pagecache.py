@@ -0,0 +1,65 @@
+# Tests over the cache of rendered pages.
+
+import os
+
+import pytest
+from flaskr import create_app
+from flaskr.db import get_db
+from flaskr.pagecache import get_page_cache
+
+
+# The second anonymous visit to the index is served from the cache, and creating a post invalidates it.
+def test_index_cached(client, auth):
+    assert client.get('/').headers['X-Page-Cache'] == 'miss'
+    assert client.get('/').headers['X-Page-Cache'] == 'hit'
+
+    auth.login()
+    # Logged in users never receive cached pages.
+    assert 'X-Page-Cache' not in client.get('/').headers
+    client.post('/create', data={'title': 'new post', 'body': ''})
+    auth.logout()
+
+    response = client.get('/')
+    assert response.headers['X-Page-Cache'] == 'miss'
+    assert b'new post' in response.data
+
+
+# With the memory backend, a change made by another process (which can't call "invalidate" on this one) is noticed through the version of the posts.
+def test_memory_backend_shared_version(client, app):
+    assert client.get('/').headers['X-Page-Cache'] == 'miss'
+    assert client.get('/').headers['X-Page-Cache'] == 'hit'
+
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE post SET title = 'changed elsewhere' WHERE id = 1")
+        db.commit()
+
+    response = client.get('/')
+    assert response.headers['X-Page-Cache'] == 'miss'
+    assert b'changed elsewhere' in response.data
+
+
+def test_cache_disabled(client, app):
+    app.config['PAGE_CACHE'] = None
+    assert 'X-Page-Cache' not in client.get('/').headers
+
+
+# With the SQLite backend, the version is shared: an invalidation made by one worker (here, another application) is seen by all of them.
+def test_sqlite_backend_shared(tmp_path):
+    config = {'TESTING': True, 'TEMPLATE_BYTECODE_CACHE': None, 'PAGE_CACHE': 'sqlite', 'PAGE_CACHE_DATABASE': os.fspath(tmp_path / 'pages.sqlite')}
+    first = get_page_cache(create_app(config))
+    second = get_page_cache(create_app(config))
+
+    version = first.version()
+    first.set(f'{version}:blog.index:/?', version, ('text/html', b'page'))
+    assert second.get(f'{version}:blog.index:/?') == ('text/html', b'page')
+
+    second.invalidate()
+    assert first.version() == version + 1
+    assert first.get(f'{version}:blog.index:/?') is None
+
+
+def test_unknown_backend(app):
+    app.config['PAGE_CACHE'] = 'nope'
+    with pytest.raises(KeyError):
+        get_page_cache(app)
@@ -0,0 +1,50 @@
+# Tests over the SQL profiling.
+
+import logging
+
+from flaskr.db import get_db
+from flaskr.profiling import ProfiledConnection, normalize
+
+
+def test_server_timing(client, app):
+    # Without sampling, the requests are not profiled.
+    assert 'Server-Timing' not in client.get('/').headers
+
+    app.config['SQL_PROFILE_SAMPLE_RATE'] = 1
+    app.config['PAGE_CACHE'] = None
+    header = client.get('/').headers['Server-Timing']
+    assert header.startswith('db;dur=')
+    # The index reads the version of the posts and one page of posts.
+    assert header.endswith('desc="2 queries"')
+
+
+def test_profiled_connection(app):
+    app.config['SQL_PROFILE_SAMPLE_RATE'] = 1
+    with app.app_context():
+        db = get_db()
+        assert isinstance(db, ProfiledConnection)
+        rows = db.execute('SELECT * FROM user WHERE id > ?', (0,)).fetchall()
+        # The rest of the connection keeps working through the wrapper.
+        assert db.in_transaction is False
+
+        query = db.queries[-1]
+        assert query.statement == 'SELECT * FROM user WHERE id > ?'
+        assert query.params == 1
+        assert query.rows == len(rows) == 2
+        assert query.duration > 0
+
+
+# Statements slower than SLOW_QUERY_MS are logged with their query plan.
+def test_slow_query_log(client, app, caplog):
+    app.config['SQL_PROFILE_SAMPLE_RATE'] = 1
+    app.config['SLOW_QUERY_MS'] = 0
+    app.config['PAGE_CACHE'] = None
+    with caplog.at_level(logging.WARNING):
+        client.get('/')
+
+    messages = [record.getMessage() for record in caplog.records]
+    assert any('Slow query' in message and 'USING INDEX post_created_id' in message for message in messages)
+
+
+def test_normalize():
+    assert normalize("SELECT *\n  FROM post WHERE id = 12 AND title = 'it''s'") == 'SELECT * FROM post WHERE id = ? AND title = ?'
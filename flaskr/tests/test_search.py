@@ -0,0 +1,68 @@
+# Tests over the full-text search.
+
+from flaskr.db import get_db
+from flaskr.search import build_query
+
+
+def test_search(client):
+    response = client.get('/search?q=body')
+    assert response.status_code == 200
+    assert b'test title' in response.data
+    assert b'<mark>body</mark>' in response.data
+
+    assert b'No posts found.' in client.get('/search?q=missing').data
+
+
+# The triggers keep the index in sync with the posts, and the text of the posts is escaped in the snippets.
+def test_search_follows_changes(client, auth):
+    auth.login()
+    client.post('/create', data={'title': 'sync', 'body': '<script>searchable</script>'})
+    response = client.get('/search?q=searchable')
+    assert b'&lt;script&gt;<mark>searchable</mark>&lt;/script&gt;' in response.data
+
+    client.post('/1/update', data={'title': 'renamed', 'body': ''})
+    assert b'No posts found.' in client.get('/search?q=body').data
+
+
+# Control characters typed in a post can't be used to inject <mark> tags (or anything else) into the results.
+def test_search_control_characters(client, auth):
+    auth.login()
+    client.post('/create', data={'title': 'marks', 'body': 'findme \x02injected\x03 text'})
+    response = client.get('/search?q=findme')
+    assert b'<mark>findme</mark> injected text' in response.data
+    assert b'<mark>injected' not in response.data
+
+
+def test_search_pagination(client, app):
+    app.config['POSTS_PER_PAGE'] = 1
+    with app.app_context():
+        db = get_db()
+        db.execute("INSERT INTO post (title, body, author_id) VALUES ('second', 'body', 1)")
+        db.commit()
+
+    response = client.get('/search?q=body')
+    assert b'page=2' in response.data
+    response = client.get('/search?q=body&page=2')
+    assert b'page=1' in response.data
+    assert b'page=3' not in response.data
+
+
+# Special FTS5 characters are searched literally instead of breaking the query.
+def test_build_query():
+    assert build_query('  ') is None
+    assert build_query('a "b OR') == '"a" """b" "OR"'
+    assert build_query('c*') == '"c*"'
+
+
+def test_rebuild_search_index_command(runner, app):
+    with app.app_context():
+        db = get_db()
+        db.executescript('DROP TABLE post_fts;')
+
+    result = runner.invoke(args=['rebuild-search-index'])
+    assert 'rebuilt (1 posts)' in result.output
+
+    with app.app_context():
+        assert get_db().execute(
+            "SELECT rowid FROM post_fts WHERE post_fts MATCH 'body'"
+        ).fetchone()[0] == 1
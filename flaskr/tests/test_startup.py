@@ -0,0 +1,42 @@
+# Tests over the start of the application.
+
+import importlib
+import os
+
+import pytest
+from flaskr.startup import LAZY_COMMANDS, measure_startup
+
+
+def test_cold_start():
+    imported = {module[0] for module in measure_startup()['modules']}
+    assert 'flaskr.db' in imported
+    # The modules of the rarely used commands and of the views that aren't used by every request, and asyncio, are left for later.
+    for module in ('flaskr.transfer', 'flaskr.maintenance', 'flaskr.search', 'flaskr.aio', 'flaskr.writer', 'flaskr.hashing', 'flaskr.throttle', 'asyncio'):
+        assert module not in imported
+
+
+# Seconds "create_app" may take on a cold start, given in the FLASKR_STARTUP_BUDGET environment variable. The time depends on the machine, so the check
+# only runs when a budget is given (on a known machine, for example).
+@pytest.mark.skipif('FLASKR_STARTUP_BUDGET' not in os.environ, reason='FLASKR_STARTUP_BUDGET is not set.')
+def test_startup_budget():
+    # The fastest of a few runs, as the first one also pays for the disk cache.
+    reports = [measure_startup() for _ in range(3)]
+    assert min(report['factory'] for report in reports) < float(os.environ['FLASKR_STARTUP_BUDGET'])
+
+
+def test_lazy_commands(app, runner):
+    for name, import_name in LAZY_COMMANDS:
+        module, attribute = import_name.split(':')
+        command = getattr(importlib.import_module(module), attribute)
+        # The help shown by "flask --help" is the one of the real command.
+        assert command.name == name
+        assert app.cli.get_command(None, name).get_short_help_str() == command.get_short_help_str()
+
+    result = runner.invoke(args=['checkpoint', '--help'])
+    assert '--mode' in result.output
+
+
+def test_startup_report(runner):
+    result = runner.invoke(args=['startup-report', '--flaskr-only', '--limit', '5'])
+    assert 'Cold start' in result.output
+    assert 'flaskr' in result.output
@@ -0,0 +1,37 @@
+# Tests over the bytecode cache of the templates.
+
+from flaskr import create_app
+
+
+def test_compile_templates(tmp_path):
+    cache = tmp_path / 'jinja_cache'
+    app = create_app({'TESTING': True, 'TEMPLATE_BYTECODE_CACHE': str(cache)})
+    # The folder is only created when the first template is saved.
+    assert not cache.exists()
+    result = app.test_cli_runner().invoke(args=['compile-templates'])
+    assert 'Compiled' in result.output
+    # One file per template: "base.html", the blog and the auth ones.
+    assert len(list(cache.iterdir())) == len(app.jinja_env.list_templates())
+
+    # A new worker loads the compiled code instead of compiling the template.
+    other = create_app({'TESTING': True, 'TEMPLATE_BYTECODE_CACHE': str(cache)})
+    compiled = []
+    other.jinja_env.compile = lambda *args, **kwargs: compiled.append(args)
+    other.jinja_env.get_template('base.html')
+    assert compiled == []
+
+    result = app.test_cli_runner().invoke(args=['compile-templates', '--clean'])
+    assert result.exit_code == 0
+
+
+def test_without_cache():
+    app = create_app({'TESTING': True, 'TEMPLATE_BYTECODE_CACHE': None})
+    assert app.jinja_env.bytecode_cache is None
+    result = app.test_cli_runner().invoke(args=['compile-templates'])
+    assert result.exit_code != 0 and 'TEMPLATE_BYTECODE_CACHE' in result.output
+
+
+def test_warmup(tmp_path):
+    app = create_app({'TESTING': True, 'TEMPLATE_BYTECODE_CACHE': str(tmp_path), 'TEMPLATE_WARMUP': True})
+    # Every template is already loaded when "create_app" returns.
+    assert len(app.jinja_env.cache) == len(app.jinja_env.list_templates())
@@ -0,0 +1,108 @@
+# Tests over the login throttling.
+
+import os
+
+import pytest
+from flaskr import create_app
+from flaskr.throttle import MemoryThrottle, get_stats, get_throttle
+
+
+# After LOGIN_USER_LIMIT attempts for a username, the next ones are rejected before checking the password.
+def test_login_throttled(client, app, auth, monkeypatch):
+    app.config['LOGIN_USER_LIMIT'] = (2, 60)
+    assert auth.login('test', 'a').status_code == 200
+    assert auth.login('test', 'a').status_code == 200
+
+    # The database is not used by rejected attempts. The login view opens it with "aio.get_async_db".
+    monkeypatch.setattr('flaskr.aio.get_async_db', lambda: pytest.fail('get_async_db called'))
+    response = auth.login('test', 'test')
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) > 0
+
+    with app.app_context():
+        assert get_stats().as_dict() == {'allowed': 2, 'rejected_user': 1, 'rejected_ip': 0}
+
+
+def test_ip_throttled(app, auth):
+    app.config['LOGIN_IP_LIMIT'] = (1, 60)
+    assert auth.login('a', 'a').status_code == 200
+    # Another username from the same address is rejected too.
+    assert auth.login('b', 'b').status_code == 429
+
+
+# Behind a trusted proxy, each client forwarded by it has its own attempts. Without one, "X-Forwarded-For" is ignored.
+@pytest.mark.parametrize(('proxies', 'expected'), ((1, 200), (0, 429)))
+def test_ip_behind_proxy(app, proxies, expected):
+    proxied = create_app({
+        'TESTING': True, 'DATABASE': app.config['DATABASE'], 'TEMPLATE_BYTECODE_CACHE': None,
+        'LOGIN_IP_LIMIT': (1, 60), 'PROXY_FIX_X_FOR': proxies,
+    })
+    client = proxied.test_client()
+
+    def login(ip):
+        return client.post('/auth/login', data={'username': 'a', 'password': 'a'}, headers={'X-Forwarded-For': ip}).status_code
+
+    assert login('203.0.113.1') == 200
+    assert login('203.0.113.2') == expected
+    assert login('203.0.113.1') == 429
+
+
+def test_bucket_refills(app, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('flaskr.throttle.time.monotonic', lambda: now[0])
+    throttle = MemoryThrottle(app)
+    assert throttle.hit('k', (2, 10)) == 0
+    assert throttle.hit('k', (2, 10)) == 0
+    assert throttle.hit('k', (2, 10)) == pytest.approx(5)
+
+    # A token comes back every 5 seconds.
+    now[0] += 5
+    assert throttle.hit('k', (2, 10)) == 0
+
+    # Once the bucket would be full again, the key is forgotten.
+    now[0] += 10
+    throttle.hit('other', (2, 10))
+    assert len(throttle) == 1
+
+
+# Each kind of bucket is evicted on its own period, even when it was used before a bucket of a longer period.
+def test_eviction_per_kind(app, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('flaskr.throttle.time.monotonic', lambda: now[0])
+    throttle = MemoryThrottle(app)
+    throttle.hit('long', (2, 3600))
+    throttle.hit('short', (2, 10))
+
+    now[0] += 10
+    throttle.hit('other', (2, 3600))
+    # "short" is gone, "long" and "other" remain.
+    assert len(throttle) == 2
+
+
+# When there are too many keys, the least recently used bucket is removed, whatever its kind, and the size never goes over the limit.
+def test_eviction_max_keys(app, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('flaskr.throttle.time.monotonic', lambda: now[0])
+    app.config['LOGIN_THROTTLE_MAX_KEYS'] = 2
+    throttle = MemoryThrottle(app)
+    throttle.hit('a', (2, 3600))
+    now[0] += 1
+    throttle.hit('b', (2, 10))
+    now[0] += 1
+    throttle.hit('a', (2, 3600))
+    now[0] += 1
+    throttle.hit('c', (2, 3600))
+
+    assert len(throttle) == 2
+    # "b" was removed, not "a", which already used its two attempts.
+    assert throttle.hit('a', (2, 3600)) > 0
+
+
+# With the SQLite backend, the buckets are shared by every worker (here, two applications).
+def test_sqlite_backend_shared(tmp_path):
+    config = {'TESTING': True, 'TEMPLATE_BYTECODE_CACHE': None, 'LOGIN_THROTTLE': 'sqlite', 'LOGIN_THROTTLE_DATABASE': os.fspath(tmp_path / 'throttle.sqlite')}
+    first = get_throttle(create_app(config))
+    second = get_throttle(create_app(config))
+
+    assert first.hit('k', (1, 60)) == 0
+    assert second.hit('k', (1, 60)) > 0
@@ -0,0 +1,79 @@
+# Tests over the "export" and "import" commands.
+
+import json
+
+import pytest
+from flaskr.db import get_db, init_db
+
+
+@pytest.mark.parametrize('extension', ('ndjson', 'csv'))
+def test_export_import(app, runner, tmp_path, extension):
+    users = tmp_path / f'users.{extension}'
+    posts = tmp_path / f'posts.{extension}'
+    assert runner.invoke(args=['export', 'user', str(users)]).exit_code == 0
+    assert runner.invoke(args=['export', 'post', str(posts)]).exit_code == 0
+
+    with app.app_context():
+        init_db()
+    result = runner.invoke(args=['import', 'user', str(users)])
+    assert 'Imported 2 user rows' in result.output
+    result = runner.invoke(args=['import', 'post', str(posts), '--batch-size', '1'])
+    assert 'Imported 1 post rows' in result.output
+
+    with app.app_context():
+        db = get_db()
+        post = db.execute('SELECT * FROM post').fetchone()
+        assert (post['id'], post['author_id'], post['title'], post['body']) == (1, 1, 'test title', 'test\nbody')
+        assert str(post['created']) == '2018-01-01 00:00:00'
+        # The triggers and the index are back, and the work they skipped has been done.
+        names = {row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE tbl_name = 'post'")}
+        assert {'post_created_id', 'post_version_insert', 'post_fts_insert'} <= names
+        assert db.execute('SELECT version FROM post_version').fetchone()[0] == 1
+        assert db.execute("SELECT rowid FROM post_fts WHERE post_fts MATCH 'body'").fetchone()[0] == 1
+
+
+# An empty CSV field is an empty body, not a missing one, while an empty id is assigned by SQLite.
+def test_csv_empty_fields(app, runner, tmp_path):
+    path = tmp_path / 'posts.csv'
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE post SET body = ''")
+        db.commit()
+    assert runner.invoke(args=['export', 'post', str(path)]).exit_code == 0
+    path.write_text(path.read_text().replace('\n1,', '\n,'))
+
+    result = runner.invoke(args=['import', 'post', str(path)])
+    assert 'Imported 1 post rows' in result.output
+    with app.app_context():
+        post = get_db().execute('SELECT id, title, body FROM post ORDER BY id DESC').fetchone()
+        assert tuple(post) == (2, 'test title', '')
+
+
+# An interrupted import continues after the last committed batch.
+def test_import_resume(app, runner, tmp_path):
+    path = tmp_path / 'posts.ndjson'
+    records = [{'author_id': 1, 'title': f'post {i}', 'body': ''} for i in range(3)]
+    # The second record has no title, so the import stops there.
+    records[1]['title'] = None
+    path.write_text('\n'.join(json.dumps(record) for record in records))
+
+    result = runner.invoke(args=['import', 'post', str(path), '--batch-size', '1'])
+    assert result.exit_code != 0
+    with app.app_context():
+        db = get_db()
+        assert db.execute('SELECT COUNT(*) FROM post').fetchone()[0] == 2
+        assert db.execute('SELECT position FROM import_checkpoint').fetchone()[0] == 1
+        # The failed import still put back the triggers, and counted the post it did insert.
+        assert db.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'post_fts_insert'").fetchone()[0] == 1
+        assert db.execute('SELECT post_count FROM user WHERE id = 1').fetchone()[0] == 2
+
+    records[1]['title'] = 'fixed'
+    path.write_text('\n'.join(json.dumps(record) for record in records))
+    result = runner.invoke(args=['import', 'post', str(path), '--batch-size', '1'])
+    assert 'Imported 2 post rows' in result.output
+    with app.app_context():
+        db = get_db()
+        titles = [row[0] for row in db.execute('SELECT title FROM post ORDER BY id')]
+        assert titles == ['test title', 'post 0', 'fixed', 'post 2']
+        assert db.execute('SELECT COUNT(*) FROM import_checkpoint').fetchone()[0] == 0
+        assert db.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'post_fts_insert'").fetchone()[0] == 1
@@ -0,0 +1,71 @@
+# Tests over the group commit writer.
+
+import sqlite3
+import threading
+
+import pytest
+from flaskr.db import connect, get_db
+from flaskr.writer import GroupCommitWriter, get_writer
+
+
+def test_create_with_group_commit(client, auth, app):
+    app.config['GROUP_COMMIT'] = True
+    auth.login()
+    client.post('/create', data={'title': 'grouped', 'body': ''})
+
+    with app.app_context():
+        assert get_writer().stats()['writes'] == 1
+        # The post is committed before the view answers.
+        assert get_db().execute("SELECT * FROM post WHERE title = 'grouped'").fetchone() is not None
+
+
+# Writes sent at the same time are committed together, and a failing one doesn't affect the rest of its batch.
+def test_batches(app):
+    writer = GroupCommitWriter(lambda: connect(app), max_batch=100, max_delay=0.2)
+    insert = 'INSERT INTO post (title, body, author_id) VALUES (?, ?, 1)'
+    futures = []
+
+    def send(i):
+        futures.append(writer.execute(insert, (f'post {i}', '')))
+
+    threads = [threading.Thread(target=send, args=(i,)) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # "title" can't be NULL.
+    failing = writer.execute(insert, (None, ''))
+
+    ids = [future.result(5) for future in futures]
+    assert len(set(ids)) == 20
+    with pytest.raises(sqlite3.IntegrityError):
+        failing.result(5)
+
+    writer.close()
+    stats = writer.stats()
+    assert stats['writes'] == 21
+    assert stats['failures'] == 1
+    assert stats['batches'] < 21
+
+    with app.app_context():
+        assert get_db().execute('SELECT COUNT(*) FROM post').fetchone()[0] == 21
+
+
+# When the thread fails, the waiting writes get the error and the next one starts a new thread.
+def test_thread_failure(app):
+    attempts = []
+
+    def flaky_connect():
+        attempts.append(None)
+        if len(attempts) == 1:
+            raise sqlite3.OperationalError('unable to open database file')
+        return connect(app)
+
+    writer = GroupCommitWriter(flaky_connect)
+    insert = 'INSERT INTO post (title, body, author_id) VALUES (?, ?, 1)'
+    with pytest.raises(sqlite3.OperationalError):
+        writer.execute(insert, ('lost', '')).result(5)
+    assert writer.execute(insert, ('kept', '')).result(5) == 2
+
+    writer.close()
+    assert writer.stats()['failures'] == 1
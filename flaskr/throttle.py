@@ -0,0 +1,186 @@
+# Module with the brute-force protection of the login.
+# Each login attempt runs a query and, for existing users, a slow password hash, so credential stuffing is the most expensive traffic we receive. Before
+# touching the database, the login view asks the throttle: every username and every client IP has a "token bucket" of LOGIN_USER_LIMIT / LOGIN_IP_LIMIT
+# attempts that refills steadily. When the bucket is empty, the attempt is rejected with "429 Too Many Requests".
+#
+# A bucket is only two numbers (tokens left and last update), so the memory used per key is constant, and idle keys (whose bucket is full again) are removed.
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+from werkzeug.exceptions import TooManyRequests
+
+
+# Refills a bucket and tries to take one token. "limit" is a (attempts, seconds) pair. Returns the new state and the seconds to wait (0 when allowed).
+def _take(tokens, updated, now, limit):
+    attempts, period = limit
+    rate = attempts / period
+    tokens = min(attempts, tokens + (now - updated) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) / rate
+
+
+# Backend keeping the buckets in the memory of each process.
+class MemoryThrottle(object):
+    def __init__(self, app):
+        self.max_keys = app.config['LOGIN_THROTTLE_MAX_KEYS']
+        self._lock = threading.Lock()
+        # One OrderedDict of buckets per limit (the IP and the username ones have different periods), each ordered by last use, so the idle buckets of a
+        # kind are always at its beginning. Values are [tokens, updated] lists.
+        self._buckets = {}
+
+    def hit(self, key, limit):
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            buckets = self._buckets.setdefault(limit, OrderedDict())
+            # Taking the bucket out and putting it back moves it to the end.
+            bucket = buckets.pop(key, None)
+            if bucket is not None:
+                tokens, updated = bucket
+            else:
+                tokens, updated = limit[0], now
+                while len(self) >= self.max_keys:
+                    self._evict_oldest()
+            tokens, wait = _take(tokens, updated, now, limit)
+            buckets[key] = [tokens, now]
+        return wait
+
+    # Removes the buckets that are full again (a new one would be identical).
+    def _evict(self, now):
+        for (attempts, period), buckets in self._buckets.items():
+            while buckets and now - next(iter(buckets.values()))[1] >= period:
+                buckets.popitem(last=False)
+
+    # Removes the least recently used bucket of all kinds, when there are too many keys.
+    def _evict_oldest(self):
+        buckets = min((buckets for buckets in self._buckets.values() if buckets), key=lambda buckets: next(iter(buckets.values()))[1])
+        buckets.popitem(last=False)
+
+    def __len__(self):
+        return sum(len(buckets) for buckets in self._buckets.values())
+
+
+# Backend keeping the buckets in a SQLite table shared by every worker of the machine (LOGIN_THROTTLE_DATABASE), so an attacker can't multiply the limit
+# by the number of workers. It uses its own file, so a rejected attempt never touches the main database.
+class SQLiteThrottle(object):
+    def __init__(self, app):
+        self.path = app.config['LOGIN_THROTTLE_DATABASE'] or os.path.join(app.instance_path, 'throttle.sqlite')
+        self._local = threading.local()
+        self._writes = 0
+        with self._db() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS bucket (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, period REAL NOT NULL)')
+            db.execute('CREATE INDEX IF NOT EXISTS bucket_updated ON bucket (updated)')
+
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            # "isolation_level=None" lets us open the transactions ourselves with BEGIN IMMEDIATE.
+            db = self._local.db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.execute('PRAGMA journal_mode = wal').fetchall()
+            db.execute('PRAGMA synchronous = normal')
+        return db
+
+    def hit(self, key, limit):
+        # Wall clock time, as the value is shared between processes.
+        now = time.time()
+        db = self._db()
+        # BEGIN IMMEDIATE takes the write lock at once, so two workers can't read the same bucket and both take its last token.
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            row = db.execute('SELECT tokens, updated FROM bucket WHERE key = ?', (key,)).fetchone()
+            tokens, updated = row if row is not None else (limit[0], now)
+            tokens, wait = _take(tokens, updated, now, limit)
+            db.execute(
+                'INSERT OR REPLACE INTO bucket (key, tokens, updated, period) VALUES (?, ?, ?, ?)',
+                (key, tokens, now, limit[1])
+            )
+            # From time to time, we remove the idle buckets.
+            self._writes += 1
+            if self._writes % 1000 == 0:
+                db.execute('DELETE FROM bucket WHERE updated + period < ?', (now,))
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        return wait
+
+
+# Backends that can be chosen by name with the LOGIN_THROTTLE setting. LOGIN_THROTTLE can also be a class (or any callable) receiving the application.
+BACKENDS = {
+    'memory': MemoryThrottle,
+    'sqlite': SQLiteThrottle,
+}
+
+
+# Counters of the attempts, shared by every backend of the process.
+class ThrottleStats(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.rejected_user = 0
+        self.rejected_ip = 0
+
+    def add(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def as_dict(self):
+        with self._lock:
+            return {'allowed': self.allowed, 'rejected_user': self.rejected_user, 'rejected_ip': self.rejected_ip}
+
+
+# Lock used to create only one throttle per application.
+_throttle_lock = threading.Lock()
+
+
+# The throttle and its counters are stored in "app.extensions" and created the first time they are needed. Returns None when the throttle is disabled
+# (LOGIN_THROTTLE = None).
+def get_throttle(app=None):
+    if app is None:
+        app = current_app._get_current_object()
+    backend = app.config['LOGIN_THROTTLE']
+    if not backend:
+        return None
+
+    throttle = app.extensions.get('flaskr.throttle')
+    if throttle is None:
+        with _throttle_lock:
+            throttle = app.extensions.get('flaskr.throttle')
+            if throttle is None:
+                factory = BACKENDS[backend] if isinstance(backend, str) else backend
+                app.extensions['flaskr.throttle_stats'] = ThrottleStats()
+                throttle = app.extensions['flaskr.throttle'] = factory(app)
+    return throttle
+
+
+def get_stats(app=None):
+    if app is None:
+        app = current_app._get_current_object()
+    get_throttle(app)
+    return app.extensions.get('flaskr.throttle_stats')
+
+
+# Called by the login view before anything else. Raises TooManyRequests (429 with "Retry-After") when the IP or the username ran out of attempts.
+# The IP is checked first, so an attacker trying many usernames from one address doesn't use up the attempts of those users.
+def check_login_attempt(username, ip):
+    throttle = get_throttle()
+    if throttle is None:
+        return
+    stats = get_stats()
+
+    wait = throttle.hit(f'ip:{ip}', current_app.config['LOGIN_IP_LIMIT'])
+    if wait:
+        stats.add('rejected_ip')
+    else:
+        wait = throttle.hit(f'user:{username}', current_app.config['LOGIN_USER_LIMIT'])
+        if wait:
+            stats.add('rejected_user')
+
+    if wait:
+        raise TooManyRequests('Too many login attempts, please try again later.', retry_after=int(wait) + 1)
+    stats.add('allowed')
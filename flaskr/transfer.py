@@ -0,0 +1,228 @@
+# Module with the "export" and "import" commands, which move the users and posts in and out of the database as NDJSON (one JSON object per line) or CSV.
+# Both commands stream: the export writes the rows while it reads them from the cursor, and the import reads the file in batches, so the memory used does
+# not depend on the size of the table.
+#
+# The import inserts each batch with "executemany" in one transaction, and records in the same transaction how many records of the file are done
+# (the "import_checkpoint" table). If it is interrupted, running it again with the same file continues after the last committed batch.
+# By default, the indexes and triggers of the table are dropped during the import and created again at the end: updating them once per row is what
+# makes the inserts slow. The search index and the version of the posts are then rebuilt once.
+import csv
+import json
+import os
+import sys
+import time
+
+import click
+from flask.cli import with_appcontext
+from flaskr.db import get_db, get_read_db
+from flaskr.pagecache import invalidate
+from flaskr.search import rebuild_search_index
+
+
+# Columns of each table, in the order they are exported, and the statement used to import them. Missing ids are assigned by SQLite, and missing dates are
+# the moment of the import.
+TABLES = {
+    'user': (
+        ('id', 'username', 'password'),
+        'INSERT INTO user (id, username, password) VALUES (?, ?, ?)',
+    ),
+    'post': (
+        ('id', 'author_id', 'created', 'updated', 'title', 'body'),
+        'INSERT INTO post (id, author_id, created, updated, title, body)'
+        ' VALUES (?, ?, COALESCE(?, CURRENT_TIMESTAMP), COALESCE(?, CURRENT_TIMESTAMP), ?, ?)',
+    ),
+}
+
+FORMATS = ('ndjson', 'csv')
+
+# Columns where an empty CSV field means a missing value (assigned by SQLite or by the import). In the other columns, like the body of a post, it is an
+# empty string, because CSV can't tell them apart.
+OPTIONAL_COLUMNS = {'id', 'created', 'updated'}
+
+# The counters of the users are kept by triggers on "post", which are dropped during the imports, and imported users start at 0. They are computed again
+# after every import, from the "post_author_created_id" index.
+RECOUNT_USERS = (
+    'UPDATE user SET post_count = (SELECT COUNT(*) FROM post WHERE author_id = user.id),'
+    ' last_post_at = (SELECT MAX(created) FROM post WHERE author_id = user.id)'
+)
+
+# Tables of the import state. They are created the first time "import" runs.
+_STATE_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS import_checkpoint (source TEXT NOT NULL, table_name TEXT NOT NULL, position INTEGER NOT NULL,'
+    ' PRIMARY KEY (source, table_name));'
+    # Definitions of the indexes and triggers dropped by an import, so they are created again even if the import is resumed by another process.
+    'CREATE TABLE IF NOT EXISTS import_relaxed (table_name TEXT NOT NULL, name TEXT NOT NULL, sql TEXT NOT NULL, PRIMARY KEY (table_name, name));'
+)
+
+
+# The format is given with "--format" or guessed from the extension of the file.
+def _format(path, format):
+    if format is not None:
+        return format
+    return 'csv' if path.lower().endswith('.csv') else 'ndjson'
+
+
+# Writes the rows of a table to "out" and returns their number. "progress" is called every "every" rows with the count.
+def export_table(db, table, out, format='ndjson', progress=None, every=10000):
+    columns = TABLES[table][0]
+    # Iterating over the cursor reads the rows one by one, so the table is never loaded whole. As a single statement, it sees a consistent snapshot.
+    cursor = db.execute(f'SELECT {", ".join(columns)} FROM {table} ORDER BY id')
+    if format == 'csv':
+        writer = csv.writer(out)
+        writer.writerow(columns)
+        write = writer.writerow
+    else:
+        # Dates are read as "datetime" (PARSE_DECLTYPES), and "str" gives back the format used by SQLite.
+        write = lambda row: out.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=str) + '\n')
+
+    count = 0
+    for row in cursor:
+        write(tuple(row))
+        count += 1
+        if progress is not None and count % every == 0:
+            progress(count)
+    return count
+
+
+# Yields the records of a file as tuples in the order of the columns of the table. Missing keys, and empty CSV fields of the optional columns, are None.
+def read_records(f, table, format='ndjson'):
+    columns = TABLES[table][0]
+    if format == 'csv':
+        for record in csv.DictReader(f):
+            yield tuple(
+                record.get(column) or None if column in OPTIONAL_COLUMNS else record.get(column) for column in columns
+            )
+    else:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                yield tuple(record.get(column) for column in columns)
+
+
+# Drops the indexes and triggers of a table, after saving their definitions. The automatic indexes of UNIQUE columns have no SQL and can't be dropped.
+def relax(db, table):
+    objects = db.execute(
+        "SELECT type, name, sql FROM sqlite_master WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL",
+        (table,)
+    ).fetchall()
+    for type, name, sql in objects:
+        db.execute('INSERT OR REPLACE INTO import_relaxed (table_name, name, sql) VALUES (?, ?, ?)', (table, name, sql))
+        db.execute(f'DROP {type.upper()} {name}')
+    db.commit()
+
+
+# Creates again the indexes and triggers dropped by "relax", and does once the work the triggers would have done for every row.
+def restore(db, table):
+    objects = db.execute('SELECT name, sql FROM import_relaxed WHERE table_name = ?', (table,)).fetchall()
+    if not objects:
+        return
+    for name, sql in objects:
+        db.execute(sql)
+    db.execute('DELETE FROM import_relaxed WHERE table_name = ?', (table,))
+    if table == 'post':
+        db.execute('UPDATE post_version SET version = version + 1, changed = CURRENT_TIMESTAMP WHERE id = 0')
+    db.commit()
+    if table == 'post':
+        rebuild_search_index()
+
+
+# Inserts the records of "records" into a table in transactions of "batch_size" records, and returns the number inserted by this call.
+# "source" identifies the file in the checkpoints, so an interrupted import of the same file skips the records already committed.
+def import_table(db, table, records, source, batch_size=50000, relax_table=True, progress=None):
+    insert = TABLES[table][1]
+    db.executescript(_STATE_SCHEMA)
+    row = db.execute(
+        'SELECT position FROM import_checkpoint WHERE source = ? AND table_name = ?', (source, table)
+    ).fetchone()
+    position = row[0] if row is not None else 0
+    for _ in range(position):
+        if next(records, None) is None:
+            break
+
+    if relax_table:
+        relax(db, table)
+
+    imported = 0
+    try:
+        while True:
+            batch = [record for _, record in zip(range(batch_size), records)]
+            if not batch:
+                break
+            db.executemany(insert, batch)
+            position += len(batch)
+            imported += len(batch)
+            db.execute(
+                'INSERT OR REPLACE INTO import_checkpoint (source, table_name, position) VALUES (?, ?, ?)', (source, table, position)
+            )
+            # The batch and its checkpoint are committed together, so a resumed import never inserts a record twice.
+            db.commit()
+            if progress is not None:
+                progress(position)
+    finally:
+        # Even if the import fails, the failed batch is rolled back and the table gets its indexes and triggers back, with the batches already
+        # committed counted. Without "relax_table", there may still be objects left by an interrupted import that did relax the table.
+        db.rollback()
+        restore(db, table)
+        db.execute(RECOUNT_USERS)
+        db.commit()
+
+    db.execute('DELETE FROM import_checkpoint WHERE source = ? AND table_name = ?', (source, table))
+    db.commit()
+    return imported
+
+
+def _progress(table, start):
+    def progress(count):
+        elapsed = time.perf_counter() - start
+        click.echo(f'{table}: {count} records ({count / elapsed if elapsed else 0:.0f}/s)', err=True)
+    return progress
+
+
+@click.command('export')
+@click.argument('table', type=click.Choice(list(TABLES)))
+@click.argument('output', type=click.Path(dir_okay=False, allow_dash=True))
+@click.option('--format', type=click.Choice(FORMATS), help='Defaults to the extension of OUTPUT (ndjson unless it ends in .csv).')
+@with_appcontext
+def export_command(table, output, format):
+    """Write the rows of TABLE to OUTPUT ("-" for stdout)."""
+    format = _format(output, format)
+    start = time.perf_counter()
+    # The read-only connection doesn't block the writers during a long export.
+    db = get_read_db()
+    if output == '-':
+        count = export_table(db, table, sys.stdout, format, progress=_progress(table, start))
+    else:
+        with open(output, 'w', encoding='utf8', newline='') as out:
+            count = export_table(db, table, out, format, progress=_progress(table, start))
+    click.echo(f'Exported {count} {table} rows in {time.perf_counter() - start:.1f} s.', err=True)
+
+
+@click.command('import')
+@click.argument('table', type=click.Choice(list(TABLES)))
+@click.argument('input', type=click.Path(dir_okay=False, allow_dash=True, exists=True))
+@click.option('--format', type=click.Choice(FORMATS), help='Defaults to the extension of INPUT (ndjson unless it ends in .csv).')
+@click.option('--batch-size', default=50000, show_default=True, help='Records inserted in each transaction.')
+@click.option('--relax/--no-relax', default=True, show_default=True, help='Drop the indexes and triggers of TABLE during the import.')
+@with_appcontext
+def import_command(table, input, format, batch_size, relax):
+    """Insert the records of INPUT ("-" for stdin) into TABLE, continuing an interrupted import of the same file."""
+    format = _format(input, format)
+    source = input if input == '-' else os.path.abspath(input)
+    start = time.perf_counter()
+    f = sys.stdin if input == '-' else open(input, encoding='utf8', newline='')
+    try:
+        count = import_table(
+            get_db(), table, read_records(f, table, format), source,
+            batch_size=batch_size, relax_table=relax, progress=_progress(table, start),
+        )
+    finally:
+        if f is not sys.stdin:
+            f.close()
+    # The cached pages don't show the imported rows.
+    invalidate()
+    click.echo(f'Imported {count} {table} rows in {time.perf_counter() - start:.1f} s.', err=True)
+
+
+def init_app(app):
+    app.cli.add_command(export_command)
+    app.cli.add_command(import_command)
@@ -0,0 +1,168 @@
+# Module with the group commit writer.
+# Every commit waits for the disk (fsync), so when many posts are created at the same time, each request spends most of its time waiting for its own
+# commit. With GROUP_COMMIT enabled, the inserts are sent to a single background thread per process, which gathers the ones arriving within
+# GROUP_COMMIT_MAX_DELAY seconds (up to GROUP_COMMIT_MAX_BATCH) and writes them in one transaction: one fsync for the whole batch.
+# Each request waits for a "future" that is completed once its batch is committed, so a request never answers before its data is durable.
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from flask import current_app
+from flaskr.db import connect
+
+
+class GroupCommitWriter(object):
+    # "connect" is a function without arguments returning a new connection, used by the writer thread.
+    def __init__(self, connect, max_batch=64, max_delay=0.005):
+        self._connect = connect
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        # Counters exposed through "stats".
+        self.batches = 0
+        self.writes = 0
+        self.failures = 0
+
+    # Sends a statement to the writer and returns a Future. Its result is the "lastrowid" of the statement, available once the batch is committed.
+    def execute(self, sql, params=()):
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('The writer is closed.')
+            # The thread is started on first use, so it is created in the worker process and not in a parent that forks later.
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='flaskr-writer', daemon=True)
+                self._thread.start()
+            self._queue.put((sql, params, future))
+        return future
+
+    def _run(self):
+        batch = []
+        try:
+            db = self._connect()
+        except Exception as e:
+            self._fail(e, batch)
+            return
+        try:
+            while True:
+                job = self._queue.get()
+                if job is None:
+                    return
+                batch = [job]
+                # We keep collecting jobs until the batch is full or the delay is over.
+                deadline = time.monotonic() + self.max_delay
+                while len(batch) < self.max_batch:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        job = self._queue.get(timeout=timeout)
+                    except queue.Empty:
+                        break
+                    if job is None:
+                        self._write(db, batch)
+                        return
+                    batch.append(job)
+                self._write(db, batch)
+        except Exception as e:
+            self._fail(e, batch)
+        finally:
+            db.close()
+
+    # Called when the thread stops because of an error outside of a statement (the connection can't be opened, for example). The futures of the batch
+    # and of the queued jobs get the error, so no request waits for a write that will never happen, and the next "execute" starts a new thread.
+    def _fail(self, error, batch):
+        with self._lock:
+            self._thread = None
+            while True:
+                try:
+                    job = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is not None:
+                    batch.append(job)
+            self.failures += sum(1 for sql, params, future in batch if not future.done())
+        for sql, params, future in batch:
+            if not future.done():
+                future.set_exception(error)
+
+    # Writes a batch in one transaction. Each job runs inside a SAVEPOINT, so a failing statement is undone alone and the rest of the batch is committed.
+    def _write(self, db, batch):
+        results = []
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            for sql, params, future in batch:
+                db.execute('SAVEPOINT job')
+                try:
+                    cursor = db.execute(sql, params)
+                except Exception as e:
+                    db.execute('ROLLBACK TO job')
+                    results.append((future, None, e))
+                else:
+                    results.append((future, cursor.lastrowid, None))
+                db.execute('RELEASE job')
+            db.commit()
+        except Exception as e:
+            # The commit failed (disk full, database locked for too long...), so none of the writes is durable.
+            if db.in_transaction:
+                db.rollback()
+            results = [(future, None, e) for sql, params, future in batch]
+
+        with self._lock:
+            self.batches += 1
+            self.writes += len(batch)
+            self.failures += sum(1 for future, result, error in results if error is not None)
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    # Writes the pending jobs and stops the thread.
+    def close(self):
+        with self._lock:
+            self._closed = True
+            thread = self._thread
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+    # Returns a dict with the counters, useful for monitoring.
+    def stats(self):
+        with self._lock:
+            return {
+                'batches': self.batches,
+                'writes': self.writes,
+                'failures': self.failures,
+                'pending': self._queue.qsize(),
+                'mean_batch_size': self.writes / self.batches if self.batches else 0.0,
+            }
+
+
+# Lock used to create only one writer per application.
+_writer_lock = threading.Lock()
+
+
+# The writer is stored in "app.extensions" and created the first time it is needed. Returns None when group commit is disabled (GROUP_COMMIT = False),
+# in which case the views commit their own writes.
+def get_writer(app=None):
+    if app is None:
+        app = current_app._get_current_object()
+    if not app.config['GROUP_COMMIT']:
+        return None
+
+    writer = app.extensions.get('flaskr.writer')
+    if writer is None:
+        with _writer_lock:
+            writer = app.extensions.get('flaskr.writer')
+            if writer is None:
+                writer = app.extensions['flaskr.writer'] = GroupCommitWriter(
+                    lambda: connect(app),
+                    max_batch=app.config['GROUP_COMMIT_MAX_BATCH'],
+                    max_delay=app.config['GROUP_COMMIT_MAX_DELAY'],
+                )
+    return writer